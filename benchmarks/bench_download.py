@@ -0,0 +1,122 @@
+"""
+比较旧的 download / download_progress（先用 urlopen 获取大小，1 KiB 读取）和现在的实现的速度
+
+python benchmarks/bench_download.py
+python benchmarks/bench_download.py --size 268435456 --repeat 5
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+from urllib.request import urlopen
+
+import requests
+from tqdm import tqdm
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.server import BenchServer  # noqa
+from spider_utils.download import download, download_progress  # noqa
+
+
+def legacy_download(url, dst, resume=True, **kwargs):
+    """
+    1.0.4 版本的 download
+    """
+    if resume:
+        if os.path.exists(dst):
+            first_byte = os.path.getsize(dst)
+        else:
+            first_byte = 0
+        file_size = int(urlopen(url).info().get('Content-Length', -1))
+
+        if first_byte >= file_size:
+            return file_size
+
+        if 'headers' in kwargs:
+            kwargs['headers']['Range'] = 'bytes=%s-%s' % (first_byte, file_size)
+        else:
+            kwargs['headers'] = {'Range': 'bytes=%s-%s' % (first_byte, file_size)}
+
+    kwargs['stream'] = True
+
+    req = requests.get(url, **kwargs)
+    with(open(dst, 'ab')) as f:
+        for chunk in req.iter_content(chunk_size=1024):
+            if chunk:
+                f.write(chunk)
+
+    return int(req.headers['content-length'])
+
+
+def legacy_download_progress(url, dst, resume=True, **kwargs):
+    """
+    1.0.4 版本的 download_progress
+    """
+    first_byte = 0
+    file_size = int(urlopen(url).info().get('Content-Length', -1))
+
+    if resume:
+        if os.path.exists(dst):
+            first_byte = os.path.getsize(dst)
+
+        if first_byte >= file_size:
+            return file_size
+
+        if 'headers' in kwargs:
+            kwargs['headers']['Range'] = 'bytes=%s-%s' % (first_byte, file_size)
+        else:
+            kwargs['headers'] = {'Range': 'bytes=%s-%s' % (first_byte, file_size)}
+
+    kwargs['stream'] = True
+
+    pbar = tqdm(
+        total=file_size, initial=first_byte,
+        unit='B', unit_scale=True, desc=url.split('/')[-1]
+    )
+
+    req = requests.get(url, **kwargs)
+    with(open(dst, 'ab')) as f:
+        for chunk in req.iter_content(chunk_size=1024):
+            if chunk:
+                f.write(chunk)
+                pbar.update(1024)
+    pbar.close()
+
+    return file_size
+
+
+def bench(function, url, size, repeat):
+    """
+    下载 repeat 次，返回最好的速度（MB/s）
+    """
+    best = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for i in range(repeat):
+            dst = os.path.join(tmp_dir, f'{i}.bin')
+            start = time.perf_counter()
+            function(url, dst)
+            elapsed = time.perf_counter() - start
+            assert os.path.getsize(dst) == size, f'{function.__name__} 下载的文件大小不正确'
+            best = max(best, size / elapsed / 1e6)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=64 * 1024 * 1024, help='文件大小（字节）')
+    parser.add_argument('--repeat', type=int, default=3, help='每个函数运行的次数')
+    args = parser.parse_args()
+
+    with BenchServer() as server:
+        url = server.url(f'/files/{args.size}.bin')
+        print(f'文件大小 {args.size / 1e6:.1f} MB，取 {args.repeat} 次里面最快的一次')
+        for old, new in ((legacy_download, download), (legacy_download_progress, download_progress)):
+            before = bench(old, url, args.size, args.repeat)
+            after = bench(new, url, args.size, args.repeat)
+            print(f'{new.__name__:<20} 之前 {before:8.1f} MB/s    之后 {after:8.1f} MB/s    {after / before:5.1f}x')
+
+
+if __name__ == '__main__':
+    main()
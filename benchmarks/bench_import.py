@@ -0,0 +1,79 @@
+"""
+检查导入时间有没有变慢（回归测试）
+
+使用 python -X importtime 在新的进程里面导入，取几次里面最快的一次和预算比较，
+并检查不应该加载的依赖（比如只导入 spider_utils 的时候不应该加载 requests）。
+超过预算或者加载了不应该加载的模块的时候退出码为 1。tests/test_import.py 使用同样的 CASES，由 pytest 运行。
+
+python benchmarks/bench_import.py
+python benchmarks/bench_import.py --runs 10 --scale 2   # 比较慢的机器把预算放大 2 倍
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORTTIME_RE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)')
+
+# 只使用简单的函数时不应该加载的依赖
+HEAVY = ('requests', 'urllib3', 'tqdm', 'html2text', 'bs4', 'lxml', 'asyncio', 'fake_useragent')
+
+# (代码, 预算毫秒, 不应该加载的模块)
+CASES = [
+    ('import spider_utils', 60, HEAVY),
+    ('from spider_utils import url_to_dict, get_cookie_dict', 60, HEAVY),
+    ('from spider_utils import Frontier', 80, HEAVY),
+    ('import spider_utils.useragent', 60, HEAVY),
+    ('import spider_utils.spider', 400, ('tqdm', 'html2text', 'bs4', 'lxml', 'asyncio', 'fake_useragent')),
+]
+
+
+def import_time(code):
+    """
+    在新的进程里面运行 code，返回 (spider_utils 的导入毫秒数, 加载的模块)，导入时间不包括 Python 本身启动的时间
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                             stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True, check=True)
+    total = 0
+    modules = set()
+    for line in process.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match is None:
+            continue
+        _, cumulative, indent, name = match.groups()
+        modules.add(name)
+        # 只计算最外层的 spider_utils 模块，里面导入的模块已经包括在 cumulative 里面
+        if not indent and name.split('.')[0] == 'spider_utils':
+            total += int(cumulative)
+    return total / 1000, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='每种导入运行的次数，取最快的一次')
+    parser.add_argument('--scale', type=float, default=1.0, help='预算的倍数')
+    args = parser.parse_args()
+
+    failed = False
+    for code, budget, forbidden in CASES:
+        budget *= args.scale
+        best = None
+        modules = set()
+        for _ in range(args.runs):
+            elapsed, modules = import_time(code)
+            best = elapsed if best is None else min(best, elapsed)
+        loaded = sorted(name for name in forbidden if name in modules)
+        ok = best <= budget and not loaded
+        failed = failed or not ok
+        print(f'{"通过" if ok else "失败"}  {best:7.1f} ms / {budget:5.0f} ms  {code}')
+        if loaded:
+            print(f'      不应该加载: {", ".join(loaded)}')
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
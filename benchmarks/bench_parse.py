@@ -0,0 +1,97 @@
+"""
+比较各个解析器每秒可以解析的页面数量
+
+python benchmarks/bench_parse.py
+python benchmarks/bench_parse.py --pages 500 --workers 4
+"""
+import os
+import sys
+import time
+import argparse
+
+import html2text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.pages import list_page, detail_page  # noqa
+from spider_utils.parsers import PARSERS, get_parser, parse_list_pages  # noqa
+from spider_utils.converter import ConverterPool, convert_detail, convert_pages  # noqa
+
+
+def make_text_maker():
+    text_maker = html2text.HTML2Text()
+    text_maker.body_width = 0
+    text_maker.kypass_tables = True
+    return text_maker
+
+
+def legacy_detail(content):
+    """
+    1.0.4 版本的 parse_detail：bs4 + prettify
+    """
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, 'lxml')
+    article = soup.find('div', class_='entry-content')
+    return make_text_maker().handle(article.prettify("utf-8").decode(encoding="utf-8"))
+
+
+def pages_per_second(function, contents):
+    start = time.perf_counter()
+    for content in contents:
+        function(content)
+    return len(contents) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=200, help='每种页面的数量')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='进程池的进程数')
+    args = parser.parse_args()
+
+    lists = [list_page(i) for i in range(args.pages)]
+    details = [detail_page(i) for i in range(args.pages)]
+
+    backends = []
+    for name in PARSERS:
+        try:
+            get_parser(name)
+        except ImportError:
+            print(f'{name:<12} 没有安装，跳过')
+            continue
+        backends.append(name)
+
+    print('每秒解析的页面数量：列表页、详情页正文、详情页正文+Markdown')
+    print(f'{"bs4+prettify":<12} {"-":>12} {"-":>12} {pages_per_second(legacy_detail, details):>16.1f}')
+    for name in backends:
+        backend = get_parser(name)
+        text_maker = make_text_maker()
+        list_rate = pages_per_second(backend.parse_list, lists)
+        detail_rate = pages_per_second(backend.detail_html, details)
+        markdown_rate = pages_per_second(lambda content: text_maker.handle(backend.detail_html(content)), details)
+        print(f'{name:<12} {list_rate:>12.1f} {detail_rate:>12.1f} {markdown_rate:>16.1f}')
+
+    # ConverterPool：复用 HTML2Text，lxml 直接转换正文的元素
+    options = {'body_width': 0, 'kypass_tables': True}
+    for name in backends:
+        backend = get_parser(name)
+        converters = ConverterPool(options)
+        rate = pages_per_second(lambda content: convert_detail(backend, converters, content), details)
+        print(f'{name:<12} ConverterPool 详情页正文+Markdown/秒 {rate:.1f}')
+
+    for name in backends:
+        start = time.perf_counter()
+        for _ in parse_list_pages(lists, parser=name, workers=args.workers):
+            pass
+        rate = len(lists) / (time.perf_counter() - start)
+        print(f'{name:<12} 进程池（{args.workers} 个进程）列表页/秒 {rate:.1f}')
+
+    for name in backends:
+        start = time.perf_counter()
+        for _ in convert_pages(details, parser=name, options=options, workers=args.workers):
+            pass
+        rate = len(details) / (time.perf_counter() - start)
+        print(f'{name:<12} 进程池（{args.workers} 个进程）详情页正文+Markdown/秒 {rate:.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+比较生成列表页网址的速度：1.0.4 版本的 get_urls（每页 str.format + namedtuple）和 PageRange
+
+python benchmarks/bench_urls.py
+python benchmarks/bench_urls.py --pages 5000000
+"""
+import os
+import sys
+import time
+import argparse
+from collections import namedtuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spider_utils.urlgen import PageRange  # noqa
+
+LegacyPageContext = namedtuple('PageContext', ['name', 'page', 'url', ])
+
+
+def legacy_get_urls(base_url, page_max, name='', start_page=1):
+    """
+    1.0.4 版本的 BaseSpider.get_urls
+    """
+    start_url = '{base_url}/'
+    page_url = '{base_url}/page/{page}/'
+    if start_page == 1 and start_url:
+        start_page += 1
+        yield LegacyPageContext(name=name, page=1, url=start_url.format(base_url=base_url))
+    for i in range(start_page, page_max + 1):
+        yield LegacyPageContext(name=name, page=i, url=page_url.format(base_url=base_url, page=i))
+
+
+def urls_per_second(pages, count):
+    start = time.perf_counter()
+    for _ in pages:
+        pass
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=1000000, help='生成的网址数量')
+    args = parser.parse_args()
+
+    base_url = 'https://www.example.com'
+    page_range = PageRange('{base_url}/page/{page}/', end=args.pages, first_url='{base_url}/', base_url=base_url)
+    assert [tuple(page) for page in page_range[:3]] == [tuple(page) for page in legacy_get_urls(base_url, 3)]
+
+    legacy = urls_per_second(legacy_get_urls(base_url, args.pages), args.pages)
+    print(f'{"1.0.4 get_urls":<24} {legacy:12,.0f} 个/秒')
+    new = urls_per_second(page_range, args.pages)
+    print(f'{"PageRange":<24} {new:12,.0f} 个/秒  {new / legacy:.2f}x')
+    start = time.perf_counter()
+    next(page_range.iter_from(args.pages - 1))
+    print(f'{"iter_from(最后一页)":<24} {(time.perf_counter() - start) * 1e6:12,.1f} 微秒')
+
+
+if __name__ == '__main__':
+    main()
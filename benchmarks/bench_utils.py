@@ -0,0 +1,90 @@
+"""
+比较 url_to_dict、get_cookie_dict 和批量版本（urls_to_dicts、cookies_to_dicts、urls_to_columns）的速度
+
+测试数据里面没有 1.0.4 版本会出错的内容（值里面的 =、空的部分），这样才能比较。
+
+python benchmarks/bench_utils.py
+python benchmarks/bench_utils.py --rows 1000000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from urllib import parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spider_utils.utils import (  # noqa
+    url_to_dict, get_cookie_dict, urls_to_dicts, cookies_to_dicts, urls_to_columns, cookies_to_columns,
+)
+
+
+def legacy_url_to_dict(url):
+    """
+    1.0.4 版本的 url_to_dict
+    """
+    params = {}
+    url = parse.unquote(url)
+    for param in url.split('&'):
+        k, v = param.split('=')
+        params[k] = v
+    return params
+
+
+def legacy_get_cookie_dict(cookie):
+    """
+    1.0.4 版本的 get_cookie_dict
+    """
+    params = {}
+    cookie = cookie.strip()
+    if cookie.startswith('Cookie:'):
+        cookie = cookie[7:].strip()
+    for param in cookie.split(';'):
+        k, v = param.split('=')
+        params[k.strip()] = v.strip()
+    return params
+
+
+def make_queries(rows, seed=0):
+    rng = random.Random(seed)
+    words = ['search', 'list', 'detail', '%E4%B8%AD%E6%96%87', 'hello%20world', 'a%2Fb']
+    return [f'page={rng.randint(1, 1000)}&size=20&q={rng.choice(words)}&sort=time&ts={rng.randint(10 ** 9, 10 ** 10)}'
+            f'&from={rng.choice(words)}' for _ in range(rows)]
+
+
+def make_cookies(rows, seed=0):
+    rng = random.Random(seed)
+    return [f'Cookie: sid={rng.getrandbits(64):x}; theme=dark; lang=zh-CN; _ga=GA1.2.{rng.randint(1, 10 ** 9)}.16; '
+            f'uid={rng.randint(1, 10 ** 6)}' for _ in range(rows)]
+
+
+def rows_per_second(function, rows):
+    start = time.perf_counter()
+    function()
+    return rows / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000, help='测试的行数')
+    args = parser.parse_args()
+
+    queries = make_queries(args.rows)
+    cookies = make_cookies(args.rows)
+    cases = [
+        ('1.0.4 url_to_dict', lambda: [legacy_url_to_dict(query) for query in queries]),
+        ('url_to_dict', lambda: [url_to_dict(query) for query in queries]),
+        ('urls_to_dicts', lambda: list(urls_to_dicts(queries))),
+        ('urls_to_columns', lambda: urls_to_columns(queries)),
+        ('1.0.4 get_cookie_dict', lambda: [legacy_get_cookie_dict(cookie) for cookie in cookies]),
+        ('get_cookie_dict', lambda: [get_cookie_dict(cookie) for cookie in cookies]),
+        ('cookies_to_dicts', lambda: list(cookies_to_dicts(cookies))),
+        ('cookies_to_columns', lambda: cookies_to_columns(cookies)),
+    ]
+    for name, function in cases:
+        print(f'{name:<24} {rows_per_second(function, args.rows):12,.0f} 行/秒')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+生成基准测试用的列表页和详情页，格式和 BaseSpider 解析的格式一样
+"""
+import random
+
+WORDS = ('spider', 'utils', 'python', 'crawl', 'page', 'content', 'parse', 'network', 'cache', 'download')
+
+
+def sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def list_page(page, articles=20, base_url='http://127.0.0.1', seed=0):
+    """
+    列表页，每篇文章是 <article class="post"><h2><a href=...>标题</a></h2>...</article>
+    """
+    rng = random.Random(seed * 100003 + page)
+    items = []
+    for i in range(articles):
+        article_id = page * articles + i
+        items.append(
+            f'<article class="post type-post"><header><h2 class="entry-title">'
+            f'<a href="{base_url}/article/{article_id}/">{sentence(rng, 6)} {article_id}</a></h2></header>'
+            f'<div class="entry-summary"><p>{sentence(rng, 40)}</p></div>'
+            f'<footer><span class="tags">{sentence(rng, 3)}</span></footer></article>'
+        )
+    return (
+        f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>Page {page}</title></head><body>'
+        f'<nav>{"".join(f"<a href=/page/{n}/>{n}</a>" for n in range(1, 30))}</nav>'
+        f'<main>{"".join(items)}</main><footer>{sentence(rng, 20)}</footer></body></html>'
+    ).encode('utf-8')
+
+
+def detail_page(article_id, paragraphs=30, seed=0):
+    """
+    详情页，正文是 <div class="entry-content">...</div>
+    """
+    rng = random.Random(seed * 100003 + article_id)
+    body = []
+    for i in range(paragraphs):
+        body.append(f'<p>{sentence(rng, 60)} <a href="/tag/{i}/">{rng.choice(WORDS)}</a> '
+                    f'<strong>{sentence(rng, 3)}</strong></p>')
+        if i % 10 == 5:
+            body.append(f'<h3>{sentence(rng, 4)}</h3><ul>{"".join(f"<li>{sentence(rng, 5)}</li>" for _ in range(5))}</ul>')
+    return (
+        f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>Article {article_id}</title></head><body>'
+        f'<nav>{sentence(rng, 20)}</nav><article class="post"><h1>{sentence(rng, 6)}</h1>'
+        f'<div class="entry-content">{"".join(body)}</div></article><aside>{sentence(rng, 50)}</aside>'
+        f'</body></html>'
+    ).encode('utf-8')
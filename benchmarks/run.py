@@ -0,0 +1,275 @@
+"""
+离线基准测试：启动本地服务器，测量 BaseSpider.crawl、增量爬取（crawl_incremental）、BaseSpiderClient.load_page、
+download 和 download_progress
+
+每个测试在单独的子进程里面运行，这样峰值内存（peak_rss_mb）只包括这个测试。
+结果保存为 JSON（键排好序），可以直接用 diff 比较，也可以用 --compare 比较两个版本的结果。
+
+python benchmarks/run.py --output before.json
+python benchmarks/run.py --only crawl load_page --latency 0.01 --bandwidth 10000000 --output after.json
+python benchmarks/run.py --compare before.json after.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.server import BenchServer  # noqa
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def peak_rss_mb():
+    """
+    当前进程的峰值内存（MB），不支持的系统返回 None
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 的单位是 KB，macOS 是字节
+    if sys.platform == 'darwin':
+        return round(rss / 1024 / 1024, 1)
+    return round(rss / 1024, 1)
+
+
+def best_of(repeat, function):
+    """
+    运行 repeat 次，返回最快的秒数和最后一次的返回值
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def counter_total(metrics, name):
+    """
+    计数器所有标签的总数
+    """
+    return sum(value for key, value in metrics.snapshot()['counters'].items()
+               if key == name or key.startswith(name + '{'))
+
+
+def bench_crawl(base_url, args):
+    from spider_utils.spider import BaseSpider
+    from spider_utils.metrics import Metrics
+
+    metrics = Metrics()
+
+    def crawl():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            spider = BaseSpider(base_url, page_max=args.pages, save_dir=Path(tmp_dir), log_function=lambda *a: None,
+                                parser=args.parser, metrics=metrics)
+            return sum(1 for _ in spider.crawl(overlay_file=True, workers=args.workers))
+
+    elapsed, items = best_of(args.repeat, crawl)
+    # 实际发送的请求数：每次 get（包括出错的和 load_page 的重试）加上 urllib3 里面的重试
+    requests = (counter_total(metrics, 'http_requests_total') + counter_total(metrics, 'http_retries_total')) \
+        / args.repeat
+    return {
+        'pages': args.pages,
+        'items': items,
+        'requests': requests,
+        'seconds': round(elapsed, 4),
+        'pages_per_second': round(args.pages / elapsed, 1),
+        'requests_per_second': round(requests / elapsed, 1),
+        'items_per_second': round(items / elapsed, 1),
+    }
+
+
+def bench_crawl_incremental(base_url, args):
+    """
+    先完整爬取一次记录到 SeenIndex，再测量没有新内容时重新爬取的时间和请求的列表页数量
+    """
+    from spider_utils.spider import BaseSpider
+    from spider_utils.metrics import Metrics
+    from spider_utils.incremental import SeenIndex
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index = SeenIndex(Path(tmp_dir) / 'seen.sqlite')
+
+        def crawl(metrics=None):
+            spider = BaseSpider(base_url, page_max=args.pages, save_dir=Path(tmp_dir) / 'cache',
+                                log_function=lambda *a: None, parser=args.parser, seen_index=index, metrics=metrics)
+            return sum(1 for _ in spider.crawl(overlay_file=True, workers=args.workers))
+
+        crawl()
+        metrics = Metrics()
+        elapsed, items = best_of(args.repeat, lambda: crawl(metrics))
+        index.close()
+    return {
+        'pages': args.pages,
+        'items': items,
+        'seconds': round(elapsed, 4),
+        'pages_fetched': metrics.get('crawl_pages_total', status='ok') // args.repeat,
+    }
+
+
+def bench_load_page(base_url, args):
+    from spider_utils.client import BaseSpiderClient
+    from spider_utils.ratelimit import RateLimiter
+
+    # 设置了 rate_limiter 以后 load_page 不再 random_sleep，这里只测量客户端本身
+    client = BaseSpiderClient(rate_limiter=RateLimiter(rate=1e9, burst=1000), log_function=lambda *a: None)
+    urls = [f'{base_url}/article/{i}/' for i in range(args.requests)]
+
+    def load():
+        size = 0
+        for url in urls:
+            size += len(client.load_page(url).content)
+        return size
+
+    elapsed, size = best_of(args.repeat, load)
+    return {
+        'requests': args.requests,
+        'seconds': round(elapsed, 4),
+        'requests_per_second': round(args.requests / elapsed, 1),
+        'mb_per_second': round(size / elapsed / 1e6, 2),
+    }
+
+
+def _bench_download(function, base_url, args):
+    url = f'{base_url}/files/{args.size}.bin'
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dst = os.path.join(tmp_dir, 'file.bin')
+
+        def run():
+            size = function(url, dst, resume=False)
+            assert size == args.size, f'{function.__name__} 下载的文件大小不正确: {size}'
+            return size
+
+        elapsed, _ = best_of(args.repeat, run)
+    return {
+        'size': args.size,
+        'seconds': round(elapsed, 4),
+        'mb_per_second': round(args.size / elapsed / 1e6, 2),
+    }
+
+
+def bench_download(base_url, args):
+    from spider_utils.download import download
+    return _bench_download(download, base_url, args)
+
+
+def bench_download_progress(base_url, args):
+    from spider_utils.download import download_progress
+    return _bench_download(download_progress, base_url, args)
+
+
+BENCHMARKS = {
+    'crawl': bench_crawl,
+    'crawl_incremental': bench_crawl_incremental,
+    'load_page': bench_load_page,
+    'download': bench_download,
+    'download_progress': bench_download_progress,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_child(name, base_url, args):
+    """
+    在子进程里面运行一个测试，返回结果
+    """
+    command = [sys.executable, os.path.abspath(__file__), '--child', name, '--url', base_url,
+               '--repeat', str(args.repeat), '--pages', str(args.pages), '--workers', str(args.workers),
+               '--parser', args.parser, '--requests', str(args.requests), '--size', str(args.size)]
+    process = subprocess.run(command, stdout=subprocess.PIPE, check=True, text=True)
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def compare(old_file, new_file):
+    with open(old_file, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_file, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+
+    print(f'{"":<36} {old["meta"].get("commit") or old_file:>14} {new["meta"].get("commit") or new_file:>14}')
+    for name in sorted(set(old['results']) | set(new['results'])):
+        before = old['results'].get(name, {})
+        after = new['results'].get(name, {})
+        for key in sorted(set(before) | set(after)):
+            a, b = before.get(key), after.get(key)
+            if not isinstance(a, (int, float)) or not isinstance(b, (int, float)):
+                print(f'{name + "." + key:<36} {str(a):>14} {str(b):>14}')
+                continue
+            change = f'{b / a:6.2f}x' if a else ''
+            print(f'{name + "." + key:<36} {a:>14} {b:>14} {change}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='只运行这些测试')
+    parser.add_argument('--output', help='保存结果的 JSON 文件')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='比较两个结果文件')
+    parser.add_argument('--repeat', type=int, default=3, help='每个测试运行的次数，取最快的一次')
+    parser.add_argument('--pages', type=int, default=50, help='crawl 爬取的列表页数量')
+    parser.add_argument('--workers', type=int, default=4, help='crawl 的线程数')
+    parser.add_argument('--parser', default='bs4', help='crawl 使用的解析器')
+    parser.add_argument('--requests', type=int, default=200, help='load_page 请求的详情页数量')
+    parser.add_argument('--size', type=int, default=64 * 1024 * 1024, help='下载的文件大小（字节）')
+    parser.add_argument('--latency', type=float, default=0.0, help='服务器每个请求的延迟（秒）')
+    parser.add_argument('--bandwidth', type=int, default=None, help='服务器每个连接的带宽（字节/秒）')
+    parser.add_argument('--child', choices=list(BENCHMARKS), help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(*args.compare)
+
+    if args.child:
+        result = BENCHMARKS[args.child](args.url, args)
+        result['peak_rss_mb'] = peak_rss_mb()
+        print(json.dumps(result))
+        return
+
+    results = {}
+    with BenchServer(latency=args.latency, bandwidth=args.bandwidth, pages=args.pages) as server:
+        for name in args.only or BENCHMARKS:
+            results[name] = run_child(name, server.url(), args)
+            print(name, results[name], file=sys.stderr)
+
+    data = {
+        'meta': {
+            'commit': git_commit(),
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': {key: getattr(args, key) for key in
+                     ('repeat', 'pages', 'workers', 'parser', 'requests', 'size', 'latency', 'bandwidth')},
+        },
+        'results': results,
+    }
+    text = json.dumps(data, indent=2, sort_keys=True, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""
+基准测试用的本地 HTTP 服务器，不需要访问外网
+
+/                   列表页第 1 页（article.post 格式，见 pages.list_page）
+/page/{页码}/        列表页，超过 pages 页返回 404
+/article/{编号}/     详情页（entry-content 格式，见 pages.detail_page）
+/files/{大小}.bin    指定大小的二进制文件，支持 HEAD 和 Range
+
+latency 是每个请求返回响应头之前等待的秒数，bandwidth 是每个连接每秒最多发送的字节数，用来模拟真实的网络。
+"""
+import re
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from .pages import list_page, detail_page
+
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
+FILE_RE = re.compile(r'/files/(\d+)\.bin')
+PAGE_RE = re.compile(r'/page/(\d+)/')
+ARTICLE_RE = re.compile(r'/article/(\d+)/')
+
+# 限制带宽的时候每次发送的字节数
+THROTTLE_CHUNK = 16 * 1024
+
+# 生成文件内容用的数据块
+BLOCK = bytes(range(256)) * 4096
+
+
+def file_bytes(start, end):
+    """
+    生成文件 [start, end) 的内容，内容只和位置有关，方便检查下载结果
+    """
+    block_size = len(BLOCK)
+    offset = start % block_size
+    while start < end:
+        size = min(block_size - offset, end - start)
+        yield BLOCK[offset:offset + size]
+        start += size
+        offset = 0
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 响应头和内容分开发送，不关闭 Nagle 算法的时候每个请求会多等待 40 毫秒（延迟确认）
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def write_body(self, chunks):
+        """
+        发送响应内容，设置了 bandwidth 的时候按照带宽限制速度
+        """
+        bandwidth = self.server.bandwidth
+        try:
+            if not bandwidth:
+                for chunk in chunks:
+                    self.wfile.write(chunk)
+                return
+            start = time.perf_counter()
+            sent = 0
+            for chunk in chunks:
+                for i in range(0, len(chunk), THROTTLE_CHUNK):
+                    piece = chunk[i:i + THROTTLE_CHUNK]
+                    self.wfile.write(piece)
+                    sent += len(piece)
+                    delay = sent / bandwidth - (time.perf_counter() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def send_html(self, content, with_body=True):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if with_body:
+            self.write_body((content,))
+
+    def send_file(self, file_size, with_body=True):
+        start, end = 0, file_size
+        match = RANGE_RE.match(self.headers.get('Range', ''))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)) + 1, file_size)
+            else:
+                start = max(file_size - int(match.group(2)), 0)
+            if start >= file_size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{file_size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end - 1}/{file_size}')
+        else:
+            self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start))
+        self.end_headers()
+        if with_body:
+            self.write_body(file_bytes(start, end))
+
+    def route(self, with_body=True):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        match = FILE_RE.fullmatch(self.path)
+        if match:
+            return self.send_file(int(match.group(1)), with_body)
+
+        base_url = self.server.base_url
+        page = 1 if self.path == '/' else None
+        match = PAGE_RE.fullmatch(self.path)
+        if match:
+            page = int(match.group(1))
+        if page is not None and 1 <= page <= self.server.pages:
+            return self.send_html(list_page(page, base_url=base_url), with_body)
+
+        match = ARTICLE_RE.fullmatch(self.path)
+        if match:
+            return self.send_html(detail_page(int(match.group(1))), with_body)
+        self.send_error(404)
+
+    def do_HEAD(self):
+        self.route(with_body=False)
+
+    def do_GET(self):
+        self.route()
+
+
+class BenchServer:
+    """
+    在后台线程运行的本地服务器
+
+    with BenchServer(latency=0.02, bandwidth=10 * 1024 * 1024) as server:
+        url = server.url('/files/1048576.bin')
+        spider = BaseSpider(server.url(), page_max=server.pages)
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, bandwidth=None, pages=100):
+        """
+        :param latency: 每个请求返回响应头之前等待的秒数
+        :param bandwidth: 每个连接每秒最多发送的字节数，None 表示不限制
+        :param pages: 列表页的页数
+        """
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.bandwidth = bandwidth
+        self.httpd.pages = pages
+        self.httpd.base_url = self.url()
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def pages(self):
+        return self.httpd.pages
+
+    def url(self, path=''):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}{path}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.httpd.shutdown()
+        self.httpd.server_close()
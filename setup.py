@@ -76,7 +76,7 @@ setup(
         'License :: OSI Approved :: GNU General Public License (GPL)',
         'Operating System :: OS Independent',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
     ],
     # 需要安装的依赖包
     install_requires=[
@@ -85,12 +85,15 @@ setup(
         'tqdm>=4.64.0',
         'loguru>=0.6.0',
         'beautifulsoup4>=4.11.1',
+        'lxml>=4.6.0',
         'html2text>=2020.1.16',
     ],
     # data_files=[('', ['spider_utils/data/fake_useragent_0.1.11.json', 'spider_utils/data/mobile_user_agents.txt', ])],
     include_package_data=True,
-    extras_require={'dev': ['wheel', 'twine', ]},
-    python_requires='>=3.6',
+    extras_require={'dev': ['wheel', 'twine', ], 'async': ['aiohttp>=3.8', ],
+                    'fast': ['selectolax>=0.3.12', ], 'zstd': ['zstandard>=0.15', ],
+                    'redis': ['redis>=4.0', ]},
+    python_requires='>=3.7',
 
     zip_safe=False
 )
@@ -17,15 +17,53 @@ from .utils import (  # noqa
     get_cookie_dict,
 )
 
+# 不依赖 requests 的模块直接导入，其他的在第一次使用的时候再导入（PEP 562），
+# 只用到 url_to_dict、get_cookie_dict 等函数的时候不会加载 requests、html2text、bs4、lxml
 from .download import (  # noqa
     download,
     download_progress,
+    download_segmented,
+    download_many,
 )
 
-from .spider import (  # noqa
-    get_response,
-    requests_retry_session,
-    get_response_to_file,
-)
+# 名字 -> 模块
+_LAZY = {
+    'RateLimiter': '.ratelimit',
+    'AsyncRateLimiter': '.ratelimit',
+    'ResponseCache': '.cache',
+    'Metrics': '.metrics',
+    'RetryPolicy': '.retry',
+    'AIMDController': '.concurrency',
+    'ProxyPool': '.proxy',
+    'RecordBuffer': '.records',
+    'Frontier': '.frontier',
+    'SeenIndex': '.incremental',
+    'SQLiteWorkQueue': '.distributed',
+    'RedisWorkQueue': '.distributed',
+    'PageRange': '.urlgen',
+    'ConverterPool': '.converter',
+    'FileStorage': '.storage',
+    'SegmentStorage': '.storage',
+    'get_response': '.spider',
+    'requests_retry_session': '.spider',
+    'get_response_to_file': '.spider',
+}
+
+__all__ = ['random_sleep', 'url_to_dict', 'get_cookie_dict', 'download', 'download_progress', 'download_segmented',
+           'download_many', *_LAZY]
+
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    import importlib
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
 
 # from .useragent import get_user_agent  # noqa
@@ -0,0 +1,202 @@
+"""
+可以设置连接池大小和统计连接复用情况的 HTTPAdapter
+
+requests 默认每个主机最多保留 10 个连接，多于 10 个线程共用一个会话的时候，多出来的连接用完就会被丢掉，
+下次请求又要重新建立连接（包括 TLS 握手）。PoolAdapter 可以设置连接池大小，并统计：
+
+connections_opened  新建的连接数
+connections_reused  复用的连接数
+wait_time           等待空闲连接的总秒数（pool_block=True 的时候连接池用完需要等待）
+
+设置 adapter.stats.metrics 以后，还会把每个新建连接的 DNS 解析、TCP 连接、TLS 握手时间和等待空闲连接的时间
+记录到 Metrics（见 spider_utils.metrics）。
+
+例子：
+adapter = PoolAdapter(pool_maxsize=50, pool_block=True)
+session.mount('http://', adapter)
+session.mount('https://', adapter)
+print(adapter.stats.as_dict())
+"""
+import time
+import socket
+import threading
+
+from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE, DEFAULT_RETRIES, DEFAULT_POOLBLOCK
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+from urllib3.util.connection import allowed_gai_family
+
+from .ratelimit import get_host
+
+
+class PoolStats:
+    def __init__(self):
+        """
+        线程安全的连接池统计
+        """
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self.requests = 0
+        self.wait_time = 0.0
+        # 记录连接时间的 Metrics，None 表示不记录
+        self.metrics = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['metrics'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def got_connection(self, reused, wait_time):
+        with self._lock:
+            self.requests += 1
+            self.wait_time += wait_time
+            if reused:
+                self.connections_reused += 1
+            else:
+                self.connections_opened += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'connections_opened': self.connections_opened,
+                'connections_reused': self.connections_reused,
+                'requests': self.requests,
+                'wait_time': round(self.wait_time, 6),
+            }
+
+
+def host_label(host, port, default_port):
+    """
+    和网址里面的主机一样的写法，默认端口不写
+    """
+    if port is None or port == default_port:
+        return host
+    return f'{host}:{port}'
+
+
+class StatsPoolMixin:
+    """
+    记录新建连接、复用连接和等待时间的连接池
+    """
+    stats = None
+
+    def _get_conn(self, timeout=None):
+        start = time.monotonic()
+        conn = super()._get_conn(timeout)
+        wait_time = time.monotonic() - start
+        # 没有 socket 的连接在发送请求的时候才会建立 TCP 连接
+        self.stats.got_connection(getattr(conn, 'sock', None) is not None, wait_time)
+        if self.stats.metrics is not None:
+            self.stats.metrics.observe('http_pool_wait_seconds', wait_time,
+                                       host=host_label(self.host, self.port, self.ConnectionCls.default_port))
+        return conn
+
+
+class TimingConnectionMixin:
+    """
+    记录 DNS 解析、TCP 连接和 TLS 握手时间的连接
+
+    先自己解析域名并记录时间，再用解析出来的地址建立连接，不会重复解析。
+    """
+    stats = None
+    _connected_at = None
+
+    def _new_conn(self):
+        metrics = self.stats.metrics
+        if metrics is None:
+            return super()._new_conn()
+
+        host = host_label(self.host, self.port, self.default_port)
+        dns_host = self._dns_host
+        start = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(dns_host, self.port, allowed_gai_family(), socket.SOCK_STREAM)
+        except OSError:
+            # 解析失败的时候交给 urllib3 处理，抛出同样的错误
+            addresses = []
+        resolved = time.perf_counter()
+        metrics.observe('http_dns_seconds', resolved - start, host=host)
+
+        if addresses:
+            self._dns_host = addresses[0][4][0]
+        try:
+            conn = super()._new_conn()
+        except (NewConnectionError, ConnectTimeoutError):
+            if len({address[4][0] for address in addresses}) <= 1:
+                raise
+            # 第一个地址连接不上的时候，和 urllib3 一样依次尝试所有地址
+            self._dns_host = dns_host
+            conn = super()._new_conn()
+        finally:
+            self._dns_host = dns_host
+        self._connected_at = time.perf_counter()
+        metrics.observe('http_connect_seconds', self._connected_at - resolved, host=host)
+        return conn
+
+    def connect(self):
+        self._connected_at = None
+        super().connect()
+        metrics = self.stats.metrics
+        if metrics is not None and self._connected_at is not None and isinstance(self, HTTPSConnection):
+            metrics.observe('http_tls_seconds', time.perf_counter() - self._connected_at,
+                            host=host_label(self.host, self.port, self.default_port))
+
+
+class PoolAdapter(HTTPAdapter):
+    __attrs__ = HTTPAdapter.__attrs__ + ['stats', 'tcp_keepalive']
+
+    def __init__(self, pool_connections=DEFAULT_POOLSIZE, pool_maxsize=DEFAULT_POOLSIZE, max_retries=DEFAULT_RETRIES,
+                 pool_block=DEFAULT_POOLBLOCK, tcp_keepalive=False):
+        """
+        :param pool_connections: 保留连接池的主机数量
+        :param pool_maxsize: 每个主机最多保留的连接数
+        :param max_retries: 重试设置
+        :param pool_block: 连接池用完的时候是否等待空闲连接，False 表示新建一个用完就丢掉的连接
+        :param tcp_keepalive: 是否打开 TCP keepalive，长时间空闲的连接不会被中间设备断开
+        """
+        self.stats = PoolStats()
+        self.tcp_keepalive = tcp_keepalive
+        super().__init__(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=max_retries,
+                         pool_block=pool_block)
+
+    def send(self, request, **kwargs):
+        # max_retries 是 RetryPolicy.retry() 的时候，发送之前检查主机是否熔断，成功以后恢复
+        policy = getattr(self.max_retries, 'policy', None)
+        if policy is None:
+            return super().send(request, **kwargs)
+        host = get_host(request.url)
+        policy.before_request(host)
+        try:
+            response = super().send(request, **kwargs)
+        except BaseException:
+            # 失败已经记录的时候已经不是半开状态，没有记录的时候（比如代理出错）放下一个请求试探
+            policy.release_trial(host)
+            raise
+        if response.status_code in policy.status_forcelist:
+            policy.release_trial(host)
+        else:
+            policy.record_success(host)
+        return response
+
+    def init_poolmanager(self, connections, maxsize, block=DEFAULT_POOLBLOCK, **pool_kwargs):
+        if self.tcp_keepalive:
+            pool_kwargs.setdefault(
+                'socket_options', HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+            )
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        attrs = {'stats': self.stats}
+        http_connection = type('TimingHTTPConnection', (TimingConnectionMixin, HTTPConnection), attrs)
+        https_connection = type('TimingHTTPSConnection', (TimingConnectionMixin, HTTPSConnection), attrs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('StatsHTTPConnectionPool', (StatsPoolMixin, HTTPConnectionPool),
+                         dict(attrs, ConnectionCls=http_connection)),
+            'https': type('StatsHTTPSConnectionPool', (StatsPoolMixin, HTTPSConnectionPool),
+                          dict(attrs, ConnectionCls=https_connection)),
+        }
@@ -0,0 +1,249 @@
+"""
+HTTP 响应缓存，保存在 SQLite 文件里面
+
+在有效期（ttl）内直接返回缓存，过期以后带上 If-None-Match / If-Modified-Since 请求，
+服务器返回 304 的时候使用缓存的内容，这样重复爬取的时候不用重新下载没有变化的页面。
+响应头里面有 Cache-Control: no-store / private 的时候不缓存，有 Vary 的时候对应的请求头也是缓存键的一部分。
+
+例子：
+from spider_utils.cache import ResponseCache
+from spider_utils.spider import BaseSpider
+
+cache = ResponseCache(Path('cache') / 'http_cache.sqlite', ttl=3600, max_size=500 * 1024 * 1024)
+spider = BaseSpider('https://www.example.com', cache=cache, is_update=True)
+...
+print(cache.stats())
+"""
+import json
+import time
+import sqlite3
+import threading
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# 304 响应里面需要更新到缓存的响应头
+REVALIDATE_HEADERS = ('ETag', 'Last-Modified', 'Date', 'Expires', 'Cache-Control')
+# 缓存的是解压以后的 response.content，这些响应头和内容对不上，不保存
+SKIP_HEADERS = ('Content-Encoding', 'Content-Length', 'Transfer-Encoding', 'Connection', 'Keep-Alive')
+# Cache-Control 里面有这些指令的时候不缓存
+NO_STORE_DIRECTIVES = ('no-store', 'private')
+
+
+def cache_directives(headers):
+    """
+    解析 Cache-Control 的指令名称（小写）
+    """
+    value = headers.get('Cache-Control') or ''
+    return {item.split('=', 1)[0].strip().lower() for item in value.split(',') if item.strip()}
+
+
+def vary_names(headers):
+    """
+    解析 Vary 响应头，返回排序以后的小写请求头名称，Vary: * 返回 None
+    """
+    names = set()
+    for name in (headers.get('Vary') or '').split(','):
+        name = name.strip().lower()
+        if name == '*':
+            return None
+        if name:
+            names.add(name)
+    return sorted(names)
+
+
+def cache_key(url, names, headers):
+    """
+    缓存键：网址加上 Vary 里面的请求头的值
+    """
+    if not names:
+        return url
+    headers = CaseInsensitiveDict(headers or {})
+    return '\n'.join([url] + ['{}: {}'.format(name, headers.get(name, '')) for name in names])
+
+
+class ResponseCache:
+    def __init__(self, path, ttl=None, max_size=None):
+        """
+        :param path: SQLite 文件路径
+        :param ttl: 缓存有效期（秒），有效期内不发送请求，None 表示每次都向服务器确认
+        :param max_size: 缓存内容的最大字节数，超过以后删除最久没有使用的缓存，None 表示不限制
+        """
+        self.path = str(path)
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        columns = [row[1] for row in self._db.execute('PRAGMA table_info(responses)')]
+        if columns and 'key' not in columns:
+            # 旧版本以网址为键的缓存，直接删除
+            self._db.execute('DROP TABLE responses')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, url TEXT, status INTEGER, headers TEXT, body BLOB, size INTEGER, '
+            'stored REAL, accessed REAL)'
+        )
+        # 每个网址最近一次响应的 Vary 请求头名称
+        self._db.execute('CREATE TABLE IF NOT EXISTS vary (url TEXT PRIMARY KEY, names TEXT)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self._db.commit()
+        self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _key(self, url, headers):
+        row = self._db.execute('SELECT names FROM vary WHERE url = ?', (url,)).fetchone()
+        return cache_key(url, json.loads(row[0]) if row is not None else [], headers)
+
+    def _load(self, key):
+        row = self._db.execute(
+            'SELECT url, status, headers, body, stored FROM responses WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        url, status, headers, body, stored = row
+        return {'key': key, 'url': url, 'status': status, 'headers': json.loads(headers), 'body': body,
+                'stored': stored}
+
+    def _store(self, key, url, status, headers, body):
+        now = time.time()
+        old = self._db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+        if old is not None:
+            self._size -= old[0]
+        self._db.execute(
+            'INSERT OR REPLACE INTO responses (key, url, status, headers, body, size, stored, accessed) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (key, url, status, json.dumps(headers), body, len(body), now, now)
+        )
+        self._size += len(body)
+        self._evict()
+        self._db.commit()
+
+    def _evict(self):
+        """
+        删除最久没有使用的缓存，直到总大小不超过 max_size
+        """
+        if self.max_size is None:
+            return
+        while self._size > self.max_size:
+            rows = self._db.execute('SELECT key, size FROM responses ORDER BY accessed LIMIT 100').fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._size -= size
+                if self._size <= self.max_size:
+                    break
+
+    def is_fresh(self, entry):
+        """
+        缓存是否还在有效期内
+        """
+        return self.ttl is not None and time.time() - entry['stored'] < self.ttl
+
+    @staticmethod
+    def conditional_headers(entry):
+        """
+        根据缓存的 ETag 和 Last-Modified 生成条件请求头
+        """
+        headers = {}
+        cached_headers = CaseInsensitiveDict(entry['headers'])
+        if 'ETag' in cached_headers:
+            headers['If-None-Match'] = cached_headers['ETag']
+        if 'Last-Modified' in cached_headers:
+            headers['If-Modified-Since'] = cached_headers['Last-Modified']
+        return headers
+
+    @staticmethod
+    def to_response(entry):
+        """
+        把缓存转换为 requests.Response，from_cache 属性为 True
+        """
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response._content = entry['body']
+        response.url = entry['url']
+        response.reason = 'OK'
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.from_cache = True
+        return response
+
+    def request(self, url, send, headers=None, request_headers=None):
+        """
+        使用缓存发送请求
+
+        :param url: 包括参数的完整网址，用来作为缓存的键
+        :param send: 发送请求的函数，参数是请求头，返回 requests.Response
+        :param headers: 请求头
+        :param request_headers: 实际发送的全部请求头（包括 Session 的请求头和 Cookie），用来匹配 Vary，默认是 headers
+        :return: requests.Response
+        """
+        headers = dict(headers or {})
+        if request_headers is None:
+            request_headers = headers
+        with self._lock:
+            key = self._key(url, request_headers)
+            entry = self._load(key)
+            if entry is not None and self.is_fresh(entry):
+                self.hits += 1
+                self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+                self._db.commit()
+                return self.to_response(entry)
+
+        if entry is not None:
+            headers.update(self.conditional_headers(entry))
+        response = send(headers)
+
+        with self._lock:
+            if response.status_code == 304 and entry is not None:
+                self.revalidated += 1
+                # 使用服务器返回的新的 ETag、Last-Modified 等响应头
+                cached_headers = CaseInsensitiveDict(entry['headers'])
+                for name in REVALIDATE_HEADERS:
+                    if name in response.headers:
+                        cached_headers[name] = response.headers[name]
+                entry['headers'] = dict(cached_headers)
+                self._store(key, url, entry['status'], entry['headers'], entry['body'])
+                return self.to_response(entry)
+
+            self.misses += 1
+            if response.status_code == 200:
+                self._store_response(url, response, request_headers)
+        response.from_cache = False
+        return response
+
+    def _store_response(self, url, response, request_headers):
+        """
+        保存 200 响应，no-store、private 和 Vary: * 的响应不保存
+        """
+        if cache_directives(response.headers) & set(NO_STORE_DIRECTIVES):
+            return
+        names = vary_names(response.headers)
+        if names is None:
+            return
+        self._db.execute('INSERT OR REPLACE INTO vary (url, names) VALUES (?, ?)', (url, json.dumps(names)))
+        headers = {name: value for name, value in response.headers.items()
+                   if name.lower() not in {skip.lower() for skip in SKIP_HEADERS}}
+        self._store(cache_key(url, names, request_headers), url, response.status_code, headers, response.content)
+
+    def stats(self):
+        """
+        缓存统计
+
+        :return: Dict(hits, revalidated, misses, size)
+        """
+        return {
+            'hits': self.hits,
+            'revalidated': self.revalidated,
+            'misses': self.misses,
+            'size': self._size,
+        }
@@ -1,6 +1,9 @@
 import os
 import sys
 import json
+import time
+import hashlib
+import threading
 
 import requests
 import requests.adapters
@@ -8,6 +11,11 @@ import urllib3
 from requests.exceptions import ConnectTimeout, ConnectionError, ProxyError
 # from loguru import logger
 from spider_utils.utils import random_sleep
+from spider_utils.adapters import PoolAdapter
+from spider_utils.retry import RetryPolicy, CircuitOpenError
+from spider_utils.download import get_chunk_size, parse_range_response, record_download
+from spider_utils.metrics import get_host, record_response, record_error
+from spider_utils.records import RecordBuffer
 
 # config = {
 #     "handlers": [
@@ -23,6 +31,7 @@ from spider_utils.utils import random_sleep
 # }
 # logger.configure(**config)
 
+# 以前的全局重试设置，现在默认使用 RetryPolicy，需要以前的行为时传入 retry=RETRY
 RETRY = requests.adapters.Retry(
     total=3,  # 允许的重试总次数，优先于其他计数
     read=3,  # 重试读取错误的次数
@@ -42,10 +51,33 @@ def dict_to_pretty_string_py(the_dict):
 
 
 class BaseSpiderClient:
-    def __init__(self, retry=None, retries=None, log_function=print, wx_thread=None, debug=False):
+    def __init__(self, retry=None, retries=None, log_function=print, wx_thread=None, debug=False, rate_limiter=None,
+                 cache=None, pool_connections=10, pool_maxsize=10, pool_block=False, keep_alive=True,
+                 tcp_keepalive=False, metrics=None, retry_policy=None, concurrency=None,
+                 proxy_pool=None, max_errors=1000, max_infos=1000, error_log=None):
         """
         爬虫客户端，这是获取所有类的入口。
 
+        一个客户端可以在多个线程里面共用，多于 10 个线程的时候需要把 pool_maxsize 设置为线程数，
+        否则多出来的连接用完就会被丢掉，下次请求又要重新建立连接。
+
+        :param rate_limiter: 按主机限速的 RateLimiter，设置以后 load_page 不再使用 random_sleep
+        :param cache: 响应缓存 ResponseCache，None 表示不使用缓存
+        :param pool_connections: 保留连接池的主机数量
+        :param pool_maxsize: 每个主机最多保留的连接数
+        :param pool_block: 连接池用完的时候是否等待空闲连接，这样可以限制每个主机的连接数
+        :param keep_alive: 是否复用连接（HTTP keep-alive），False 的时候每个请求都带上 Connection: close
+        :param tcp_keepalive: 是否打开 TCP keepalive
+        :param metrics: 记录请求时间、字节数、状态码的 Metrics，None 表示不记录
+        :param retry_policy: 重试策略 RetryPolicy（Retry-After、退避时间、按主机的重试预算和熔断），
+          None 的时候如果没有传入 retry 就使用默认的 RetryPolicy()
+        :param concurrency: 按主机自动调整同时请求数的 AIMDController，None 表示不限制
+        :param proxy_pool: 代理池 ProxyPool，每个请求从代理池选择代理（请求传入 proxies 的时候不使用），None 表示不使用
+        :param max_errors: errors 最多保留的错误数，None 表示不限制
+        :param max_infos: infos 最多保留的信息数，None 表示不限制
+        :param error_log: 保存超出 max_errors 的旧错误的文件（JSONL），None 表示丢掉
+        :param retry: urllib3 的 Retry，只有在没有传入 retry_policy 的时候使用
+        :param retries: load_page 请求出错的时候最多请求的次数
         """
         self._session = requests.session()
 
@@ -65,20 +97,60 @@ class BaseSpiderClient:
         self.log_function = log_function
         self.wx_thread = wx_thread
         self.debug = debug
-        self.infos = []
-        self.errors = []
+        self.infos = RecordBuffer(max_infos)
+        self.errors = RecordBuffer(max_errors, spill_path=error_log)
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.concurrency = concurrency
+        self.proxy_pool = proxy_pool
+        self._lock = threading.Lock()
 
         # 删除SSL验证
         self._session.verify = False
         urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
         # 添加会话自动重试
-        if retry is None:
-            adapter_with_retry = requests.adapters.HTTPAdapter(max_retries=RETRY)
-        else:
-            adapter_with_retry = requests.adapters.HTTPAdapter(max_retries=retry)
-        self._session.mount('http://', adapter_with_retry)
-        self._session.mount('https://', adapter_with_retry)
+        if retry_policy is None and retry is None:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy if retry_policy is not None else getattr(retry, 'policy', None)
+        self._adapter = PoolAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry if retry_policy is None else retry_policy.retry(),
+            pool_block=pool_block,
+            tcp_keepalive=tcp_keepalive,
+        )
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+        if not keep_alive:
+            self._session.headers['Connection'] = 'close'
+
+        self.set_metrics(metrics)
+
+    def add_error(self, error, url=None, attempt=None, kind=None):
+        """
+        记录错误（线程安全）
+
+        :param error: 错误信息或者异常
+        :param url: 出错的网址
+        :param attempt: 第几次请求
+        :param kind: 错误的类型，None 的时候异常使用异常的类名
+        """
+        self.errors.append(error, url=url, kind=kind, attempt=attempt)
+
+    def add_info(self, info, url=None):
+        """
+        记录信息（线程安全）
+        """
+        self.infos.append(info, url=url)
+
+    def pool_stats(self):
+        """
+        连接池统计：新建的连接数、复用的连接数、请求数、等待空闲连接的总秒数
+
+        :return: Dict(connections_opened, connections_reused, requests, wait_time)
+        """
+        return self._adapter.stats.as_dict()
 
     def set_proxy(self, proxy):
         """ 设置 http 和 https 代理或者 sock5代理（requests 已经可以支持 socks 代理）
@@ -100,6 +172,14 @@ class BaseSpiderClient:
         else:
             self._session.proxies.update({'http': proxy, 'https': proxy})
 
+    def set_proxy_pool(self, proxy_pool):
+        """
+        设置代理池 ProxyPool，传入 None 表示不使用代理池
+
+        :return: None
+        """
+        self.proxy_pool = proxy_pool
+
     def set_headers(self, headers):
         """
         设置 headers（全局），如果是 None，清除数据
@@ -138,6 +218,39 @@ class BaseSpiderClient:
         """
         return requests.utils.dict_from_cookiejar(self._session.cookies)
 
+    def set_rate_limiter(self, rate_limiter):
+        """
+        设置按主机限速的 RateLimiter，传入 None 表示清除限速设置
+
+        :return: None
+        """
+        self.rate_limiter = rate_limiter
+
+    def set_cache(self, cache):
+        """
+        设置响应缓存 ResponseCache，传入 None 表示不使用缓存
+
+        :return: None
+        """
+        self.cache = cache
+
+    def set_concurrency(self, concurrency):
+        """
+        设置按主机自动调整同时请求数的 AIMDController，传入 None 表示不限制
+
+        :return: None
+        """
+        self.concurrency = concurrency
+
+    def set_metrics(self, metrics):
+        """
+        设置记录请求统计的 Metrics，传入 None 表示不记录
+
+        :return: None
+        """
+        self.metrics = metrics
+        self._adapter.stats.metrics = metrics
+
     def set_params(self, params):
         """
         设置 params（全局），如果是 None，清除数据
@@ -164,37 +277,160 @@ class BaseSpiderClient:
             params.update(kwargs['params'])
             del kwargs['params']
 
-        return self._session.get(url, params=params, **kwargs)
+        # 下载文件（stream）的时候不使用缓存
+        if self.cache is not None and not kwargs.get('stream'):
+            headers = kwargs.pop('headers', None)
+            # 合并 Session 的请求头和 Cookie，用来匹配缓存的 Vary
+            prepared = self._session.prepare_request(requests.Request('GET', url, params=params, headers=headers))
+            return self.cache.request(prepared.url, lambda h: self._send(url, params=params, headers=h, **kwargs),
+                                      headers, prepared.headers)
 
-    def download(self, url, dst, **kwargs):
+        return self._send(url, params=params, **kwargs)
+
+    def _send(self, url, **kwargs):
         """
-        下载文件
+        发送GET请求（不经过缓存）
         """
-
-        req = self.get(url, **kwargs)
-
-        with open(dst, 'ab') as f:
-            f.write(req.content)
-
-        file_size = os.path.getsize(dst)
-        # 检查文件大小判断是否下载成功
-        if file_size >= int(req.headers.get('content-length', 0)):
-            return file_size
-        else:
-            os.remove(dst)
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait(url)
+
+        metrics = self.metrics
+        concurrency = self.concurrency
+        proxy_pool = self.proxy_pool if 'proxies' not in kwargs else None
+        if metrics is None and concurrency is None and proxy_pool is None:
+            return self._session.get(url, **kwargs)
+
+        host = get_host(url)
+        proxy = None
+        if proxy_pool is not None:
+            proxy = proxy_pool.get(host)
+            if proxy is not None:
+                kwargs['proxies'] = {'http': proxy, 'https': proxy}
+        if concurrency is not None:
+            concurrency.acquire(host)
+        start = time.perf_counter()
+        r = None
+        error = None
+        try:
+            r = self._session.get(url, **kwargs)
+        except Exception as e:
+            error = e
+            if metrics is not None:
+                record_error(metrics, url, e)
+            raise
+        finally:
+            latency = time.perf_counter() - start
+            if concurrency is not None:
+                concurrency.release(host, latency, None if r is None else r.status_code)
+            if proxy is not None:
+                if r is not None:
+                    proxy_pool.record(proxy, latency, status=r.status_code)
+                elif isinstance(error, (ProxyError, ConnectTimeout)):
+                    # 连接不上代理（使用代理的时候连接超时也是连接代理超时）才是代理的失败
+                    proxy_pool.record(proxy, ok=False)
+                else:
+                    # 主机熔断（请求没有发送）、目标网站超时或者一直返回错误状态码，不是代理的问题
+                    proxy_pool.release(proxy)
+        if metrics is not None:
+            record_response(metrics, r, None if kwargs.get('stream') else time.perf_counter() - start)
+        return r
+
+    def download(self, url, dst, resume=True, checksum=None, hash_name='md5', **kwargs):
+        """
+        下载文件，边下载边写入文件，占用的内存和文件大小无关
+
+        先下载到 {dst}.part 临时文件，检查文件大小和校验值以后再重命名为 dst。
+        下载中断的时候保留临时文件，下次调用从中断的位置继续下载。
+
+        :param url: 下载文件的网址
+        :param dst: 文件的保存路径
+        :param resume: 是否需要下载续传
+        :param checksum: 文件的校验值（十六进制字符串），None 表示不检查
+        :param hash_name: 校验算法，hashlib 支持的名字，比如 md5、sha256
+        :param kwargs: get 的参数
+        :return: 文件大小，下载失败返回 None
+        """
+        start = time.perf_counter()
+        part = f'{dst}.part'
+        first_byte = os.path.getsize(part) if resume and os.path.exists(part) else 0
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        headers['Range'] = f'bytes={first_byte}-'
+        kwargs['stream'] = True
+        req, first_byte, file_size = parse_range_response(self.get(url, headers=headers, **kwargs), first_byte)
+
+        hasher = hashlib.new(hash_name) if checksum else None
+        if hasher is not None and first_byte:
+            # 续传的时候先计算已经下载的内容
+            with open(part, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    hasher.update(chunk)
+
+        with open(part, 'ab' if first_byte else 'wb') as f:
+            if req is not None:
+                chunk_size = get_chunk_size(file_size)
+                with req:
+                    req.raw.decode_content = True
+                    read = req.raw.read
+                    while True:
+                        chunk = read(chunk_size)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        if hasher is not None:
+                            hasher.update(chunk)
+
+        size = os.path.getsize(part)
+        record_download(self.metrics, url, size - first_byte, start)
+        # 检查文件大小判断是否下载成功，大小不够的时候保留临时文件用来续传
+        if 0 <= file_size != size:
+            self.add_error(f'{url} 文件大小不正确: {size} != {file_size}', url=url, kind='SizeMismatch')
+            if size > file_size:
+                os.remove(part)
+            return None
+        if hasher is not None and hasher.hexdigest().lower() != checksum.lower():
+            self.add_error(f'{url} 校验值不正确: {hasher.hexdigest()} != {checksum}', url=url, kind='ChecksumMismatch')
+            os.remove(part)
+            return None
+
+        os.replace(part, dst)
+        return size
 
     def load_page(self, url, **kwargs):
 
         self.parse_data = {}
-        self.load_count += 1
-        self.log_function(f'[{self.load_count:05}] Starting {url}')
+        with self._lock:
+            self.load_count += 1
+            load_count = self.load_count
+        self.log_function(f'[{load_count:05}] Starting {url}')
 
+        previous = None
         for i in range(self.retries):
+            if i and self.metrics is not None:
+                self.metrics.inc('http_retries_total', host=get_host(url))
             try:
                 r = self.get(url, **kwargs)
-                random_sleep()
+                if self.rate_limiter is None:
+                    random_sleep()
+            except CircuitOpenError as e:
+                # 主机已经熔断，不再重试
+                self.add_error(e, url=url, attempt=i + 1)
+                return None
+            except ProxyError as e:
+                # 代理的问题，不是主机的问题，使用代理池的时候马上换一个代理重试
+                self.add_error(e, url=url, attempt=i + 1)
+                if self.proxy_pool is None and i + 1 < self.retries:
+                    previous = self.retry_policy.backoff(previous) if self.retry_policy is not None else 0
+                    time.sleep(previous)
             except (ConnectTimeout, ConnectionError) as e:
-                self.errors.append(str(e))
+                self.add_error(e, url=url, attempt=i + 1)
+                # 按照重试策略等待，没有重试预算的时候不再重试
+                policy = self.retry_policy
+                if policy is not None and i + 1 < self.retries:
+                    if not policy.consume_retry(get_host(url)):
+                        return None
+                    previous = policy.backoff(previous)
+                    time.sleep(previous)
             else:
                 return r
 
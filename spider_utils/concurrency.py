@@ -0,0 +1,152 @@
+"""
+按主机自动调整同时进行的请求数（AIMD：加性增、乘性减，和 TCP 的拥塞控制一样）
+
+每个请求完成以后：
+- 成功并且延迟正常：并发数增加 increase / 并发数，也就是每一轮（并发数个请求）增加 increase
+- 出错、返回 429/503 等状态码，或者延迟超过基准延迟的 latency_factor 倍（或者超过 latency_target）：
+  并发数乘以 decrease，一个基准延迟内最多减少一次，同时失败的请求不会让并发数一下子降到最低
+
+并发数始终在 [floor, ceiling] 之间。基准延迟是最小延迟，每个请求允许上升 1%，服务器变慢以后基准也会跟着变化。
+
+例子：
+from spider_utils.concurrency import AIMDController
+
+controller = AIMDController(initial=2, floor=1, ceiling=32, metrics=metrics)
+spider = BaseSpider('https://www.example.com', concurrency=controller, pool_maxsize=32)
+for data in spider.crawl():  # 线程数使用 controller.ceiling，同时进行的请求数由 controller 控制
+    ...
+print(controller.stats())
+"""
+import time
+import threading
+
+# 表示服务器过载的状态码
+OVERLOAD_STATUSES = (429, 503)
+
+
+class _HostWindow:
+    __slots__ = ('limit', 'in_flight', 'min_latency', 'last_decrease', 'increases', 'decreases')
+
+    def __init__(self, limit):
+        self.limit = float(limit)
+        self.in_flight = 0
+        self.min_latency = None
+        self.last_decrease = 0.0
+        self.increases = 0
+        self.decreases = 0
+
+
+class AIMDController:
+    def __init__(self, initial=2, floor=1, ceiling=32, increase=1.0, decrease=0.5, latency_factor=2.0,
+                 latency_target=None, overload_statuses=OVERLOAD_STATUSES, metrics=None):
+        """
+        :param initial: 每个主机开始的并发数
+        :param floor: 最小并发数
+        :param ceiling: 最大并发数
+        :param increase: 每一轮增加的并发数
+        :param decrease: 减少的时候乘以的倍数
+        :param latency_factor: 延迟超过基准延迟多少倍的时候认为过载，None 表示不使用基准延迟
+        :param latency_target: 延迟超过多少秒的时候认为过载，None 表示不限制
+        :param overload_statuses: 表示过载的状态码
+        :param metrics: 记录每个主机并发数的 Metrics（concurrency_limit、concurrency_in_flight）
+        """
+        if not 1 <= floor <= ceiling:
+            raise ValueError('需要 1 <= floor <= ceiling')
+        self.initial = min(max(initial, floor), ceiling)
+        self.floor = floor
+        self.ceiling = ceiling
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.latency_target = latency_target
+        self.overload_statuses = frozenset(overload_statuses)
+        self.metrics = metrics
+
+        self._hosts = {}
+        self._condition = threading.Condition()
+
+    def _window(self, host):
+        window = self._hosts.get(host)
+        if window is None:
+            window = self._hosts[host] = _HostWindow(self.initial)
+        return window
+
+    def limit(self, host):
+        """
+        这个主机现在允许的并发数
+        """
+        with self._condition:
+            return int(self._window(host).limit)
+
+    def acquire(self, host):
+        """
+        等待到这个主机的请求数少于并发数，占用一个位置
+        """
+        with self._condition:
+            window = self._window(host)
+            while window.in_flight >= int(window.limit):
+                self._condition.wait()
+            window.in_flight += 1
+            in_flight = window.in_flight
+        if self.metrics is not None:
+            self.metrics.set('concurrency_in_flight', in_flight, host=host)
+
+    def release(self, host, latency, status=None):
+        """
+        请求完成，释放位置并调整并发数
+
+        :param latency: 请求的秒数
+        :param status: 状态码，None 表示请求出错
+        """
+        now = time.monotonic()
+        with self._condition:
+            window = self._window(host)
+            window.in_flight -= 1
+            overloaded = status is None or status in self.overload_statuses or self._slow(window, latency)
+            if status is not None and status not in self.overload_statuses:
+                # 基准延迟是最小延迟，允许慢慢上升
+                if window.min_latency is None or latency < window.min_latency:
+                    window.min_latency = latency
+                else:
+                    window.min_latency *= 1.01
+
+            if overloaded:
+                # 一个基准延迟内只减少一次
+                if now - window.last_decrease >= (window.min_latency or 0.0):
+                    window.limit = max(self.floor, window.limit * self.decrease)
+                    window.last_decrease = now
+                    window.decreases += 1
+            elif window.in_flight + 1 >= int(window.limit):
+                # 只有并发数用满的时候才增加，请求少的时候不会无限增加
+                window.limit = min(self.ceiling, window.limit + self.increase / window.limit)
+                window.increases += 1
+            limit, in_flight = window.limit, window.in_flight
+            self._condition.notify_all()
+
+        if self.metrics is not None:
+            self.metrics.set('concurrency_limit', round(limit, 2), host=host)
+            self.metrics.set('concurrency_in_flight', in_flight, host=host)
+
+    def _slow(self, window, latency):
+        if self.latency_target is not None and latency > self.latency_target:
+            return True
+        return (self.latency_factor is not None and window.min_latency is not None
+                and latency > window.min_latency * self.latency_factor)
+
+    def stats(self):
+        """
+        每个主机的并发数
+
+        :return: Dict(主机 -> Dict(limit, in_flight, min_latency, increases, decreases))
+        """
+        with self._condition:
+            return {
+                host: {
+                    'limit': round(window.limit, 2),
+                    'in_flight': window.in_flight,
+                    'min_latency': None if window.min_latency is None else round(window.min_latency, 6),
+                    'increases': window.increases,
+                    'decreases': window.decreases,
+                }
+                for host, window in self._hosts.items()
+            }
@@ -0,0 +1,170 @@
+"""
+HTML 转换为 Markdown 的转换器池
+
+HTML2Text 里面保存着转换的状态（链接编号、缩写、列表等），多个线程共用一个会出错，
+上一次转换的状态也会带到下一次（比如链接的编号一直增加），但是每次新建一个又比较慢。
+
+ConverterPool 给每个线程创建一个 HTML2Text（第一次使用的时候创建），每次转换之前恢复到刚创建时的状态。
+进程池里面每个进程有自己的 ConverterPool，所以多进程转换的速度和 CPU 核心数成正比（convert_pages）。
+使用 lxml 的时候可以直接转换 lxml 元素（convert_element），不用先转换为 HTML 再解析一次。
+
+例子：
+from spider_utils.converter import ConverterPool
+
+converters = ConverterPool({'body_width': 0})
+markdown = converters.convert('<p>Hello <a href="/a">world</a></p>')
+markdown = converters.convert_element(lxml_element)
+"""
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# HTMLParser 不会收到结束标签的元素
+VOID_ELEMENTS = frozenset(('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param',
+                           'source', 'track', 'wbr'))
+
+# HTML2Text 里面表示 &nbsp; 的文字，转换完成以后替换为空格
+NBSP_PLACEHOLDER = '&nbsp_place_holder;'
+
+
+def make_text_maker(options):
+    """
+    创建 HTML 转换为 Markdown 的 HTML2Text
+
+    :param options: HTML2Text 的属性，比如 {'body_width': 0}
+    """
+    import html2text
+
+    text_maker = html2text.HTML2Text()
+    for name, value in options.items():
+        setattr(text_maker, name, value)
+    return text_maker
+
+
+class ConverterPool:
+    def __init__(self, options=None):
+        """
+        :param options: HTML2Text 的属性，比如 {'body_width': 0}
+        """
+        self.options = dict(options or {})
+        self._local = threading.local()
+
+    def __getstate__(self):
+        # 传给其他进程的时候只传设置，转换器在那个进程里面重新创建
+        return {'options': self.options}
+
+    def __setstate__(self, state):
+        self.options = state['options']
+        self._local = threading.local()
+
+    def get(self):
+        """
+        当前线程的 HTML2Text
+        """
+        local = self._local
+        text_maker = getattr(local, 'text_maker', None)
+        if text_maker is None:
+            text_maker = local.text_maker = make_text_maker(self.options)
+            # 刚创建时的状态，每次转换之前恢复
+            local.state = dict(text_maker.__dict__)
+        return text_maker
+
+    def reset(self):
+        """
+        把当前线程的 HTML2Text 恢复到刚创建时的状态，返回 HTML2Text
+        """
+        text_maker = self.get()
+        state = self._local.state
+        text_maker.__dict__.clear()
+        for name, value in state.items():
+            # 列表、字典等可以修改的状态需要复制
+            if isinstance(value, (list, dict, set)):
+                value = value.copy()
+            text_maker.__dict__[name] = value
+        return text_maker
+
+    def convert(self, html):
+        """
+        把 HTML 转换为 Markdown
+        """
+        return self.reset().handle(html or '')
+
+    def convert_element(self, element):
+        """
+        直接把 lxml 元素（不包括后面的文字）转换为 Markdown，结果和转换 etree.tostring(element, method='html') 一样，
+        只是源码里面直接写的不换行空格（不是 &nbsp;）也会转换为空格
+        """
+        from html2text.utils import pad_tables_in_text
+
+        text_maker = self.reset()
+        if element is None:
+            return text_maker.handle('')
+        text_maker.start = True
+        _walk(text_maker, element)
+        markdown = text_maker.optwrap(text_maker.finish())
+        if text_maker.pad_tables:
+            return pad_tables_in_text(markdown)
+        return markdown
+
+
+def _data(text_maker, text):
+    if '\xa0' in text:
+        text = text.replace('\xa0', NBSP_PLACEHOLDER)
+    text_maker.handle_data(text)
+
+
+def _walk(text_maker, element):
+    """
+    按照 HTMLParser 的顺序调用 HTML2Text 的 handle_starttag、handle_data、handle_endtag
+    """
+    tag = element.tag
+    if isinstance(tag, str):
+        text_maker.handle_starttag(tag, list(element.attrib.items()))
+        if element.text:
+            _data(text_maker, element.text)
+        for child in element:
+            _walk(text_maker, child)
+            if child.tail:
+                _data(text_maker, child.tail)
+        if tag not in VOID_ELEMENTS:
+            text_maker.handle_endtag(tag)
+
+
+# 进程池里面每个进程的解析器和转换器
+_worker_parser = None
+_worker_converters = None
+
+
+def _init_worker(parser_name, options):
+    global _worker_parser, _worker_converters
+    from .parsers import get_parser
+    _worker_parser = get_parser(parser_name)
+    _worker_converters = ConverterPool(options)
+
+
+def convert_detail(parser, converters, content):
+    """
+    解析详情页的正文并转换为 Markdown，解析器可以返回 lxml 元素（detail_element）的时候直接转换元素
+    """
+    detail_element = getattr(parser, 'detail_element', None)
+    if detail_element is not None:
+        return converters.convert_element(detail_element(content))
+    return converters.convert(parser.detail_html(content))
+
+
+def _convert_worker(content):
+    return convert_detail(_worker_parser, _worker_converters, content)
+
+
+def convert_pages(contents, parser='lxml', options=None, workers=None, chunksize=8):
+    """
+    在进程池里面解析多个详情页并转换为 Markdown，按顺序返回
+
+    :param contents: 详情页的内容
+    :param parser: 解析器的名字
+    :param options: HTML2Text 的属性
+    :param workers: 进程数，None 表示 CPU 核心数
+    :param chunksize: 每次发送给子进程的网页数量
+    """
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(parser, dict(options or {}))) as executor:
+        yield from executor.map(_convert_worker, contents, chunksize=chunksize)
@@ -0,0 +1,528 @@
+"""
+分布式爬取：多个进程或者多台电脑共用一个任务队列
+
+任务队列可以是 SQLite 文件（SQLiteWorkQueue，同一台电脑的多个进程）或者 Redis（RedisWorkQueue，多台电脑，
+只使用基本的命令，可以使用 redis-py 兼容的客户端，比如测试的时候使用 fakeredis）。
+
+1. seed 把 spider.get_urls() 的列表页加入队列
+2. 每个进程运行 run_worker：租用（lease）任务，下载并使用 spider 的 parse_list / parse_detail 解析，
+   结果和错误发送到队列，完成以后确认（ack）。租用超过 visibility_timeout 秒没有确认的任务会交给其他进程
+3. 一个进程运行 collect，收集所有进程的结果和错误，所有任务完成以后结束
+
+任务按主机（或者网址）的哈希分成 shards 份，run_worker 可以只处理其中几份，
+这样同一个主机只由一个进程爬取，限速（rate_limiter）和 Cookie 在进程里面仍然有效。
+BaseSpider 的子类不需要修改。
+
+例子：
+from spider_utils.distributed import SQLiteWorkQueue, seed, run_worker, collect, start_workers
+
+queue = SQLiteWorkQueue('cache/work.sqlite', shards=4)
+seed(MySpider(), queue)
+processes = start_workers(MySpider, queue, processes=4, detail=True)
+for kind, data in collect(queue):
+    ...  # kind 是 item（列表页数据）、detail（合并了详情的数据）或者 error
+
+# 多台电脑使用 Redis：每台电脑运行 run_worker(MySpider(), RedisWorkQueue.from_url('redis://host:6379/0'))
+"""
+import os
+import json
+import time
+import uuid
+import zlib
+import socket
+import sqlite3
+import threading
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+from .frontier import url_fingerprint
+
+Job = namedtuple('Job', ['id', 'url', 'queue', 'data', 'attempts', ])
+
+# 队列名字，和 spider.LIST_QUEUE、spider.DETAIL_QUEUE 相同
+LIST_QUEUE = 'list'
+DETAIL_QUEUE = 'detail'
+
+# 任务的状态
+PENDING = 0
+LEASED = 1
+DONE = 2
+FAILED = 3
+
+
+def shard_of(url, shards, by='host'):
+    """
+    网址属于哪一份（0 到 shards - 1）
+
+    :param by: host 表示按主机分，同一个主机的网址在同一份；url 表示按网址分
+    """
+    if shards <= 1:
+        return 0
+    key = urlsplit(url).netloc.lower() if by == 'host' else url
+    return zlib.crc32(key.encode('utf-8')) % shards
+
+
+class SQLiteWorkQueue:
+    def __init__(self, path, shards=1, shard_by='host', visibility_timeout=60.0, max_attempts=3):
+        """
+        保存在 SQLite 文件里面的任务队列，同一台电脑的多个进程可以同时使用（每个进程打开自己的连接）
+
+        :param path: SQLite 文件路径
+        :param shards: 任务分成多少份
+        :param shard_by: host 或者 url，见 shard_of
+        :param visibility_timeout: 租用任务的秒数，超过时间没有 ack 的任务交给其他进程
+        :param max_attempts: 每个任务最多租用的次数，超过以后作为错误发送到结果
+        """
+        self.path = str(path)
+        self.shards = shards
+        self.shard_by = shard_by
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = None
+        self._connect()
+
+    def __getstate__(self):
+        # 连接不能传给其他进程，在新的进程里面重新打开
+        state = self.__dict__.copy()
+        del state['_lock']
+        del state['_db']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._db = None
+        self._connect()
+
+    def _connect(self):
+        self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id INTEGER PRIMARY KEY, fingerprint BLOB, queue TEXT, shard INTEGER, url TEXT, data TEXT, '
+            'state INTEGER, lease_until REAL, attempts INTEGER, worker TEXT, UNIQUE (queue, fingerprint))'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (queue, state, shard, id)')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY, kind TEXT, data TEXT, worker TEXT)'
+        )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def put(self, url, data=None, queue=LIST_QUEUE):
+        """
+        添加任务，同一个队列里面重复的网址会被忽略
+
+        :return: 是否是新的任务
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT OR IGNORE INTO jobs (fingerprint, queue, shard, url, data, state, lease_until, attempts) '
+                'VALUES (?, ?, ?, ?, ?, ?, 0, 0)',
+                (url_fingerprint(url), queue, shard_of(url, self.shards, self.shard_by), url, json.dumps(data),
+                 PENDING)
+            )
+            return cursor.rowcount > 0
+
+    def lease(self, queue=LIST_QUEUE, worker=None, shards=None):
+        """
+        租用一个任务
+
+        :param worker: 进程的名字，只用来记录
+        :param shards: 只租用这几份的任务，None 表示所有
+        :return: Job，没有可以租用的任务时返回 None
+        """
+        now = time.time()
+        where = ''
+        params = [queue, PENDING, LEASED, now]
+        if shards is not None:
+            shards = list(shards)
+            where = f' AND shard IN ({",".join("?" * len(shards))})'
+            params.extend(shards)
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                # 超过最大次数的任务标记为失败
+                expired = self._db.execute(
+                    'SELECT id, url, data FROM jobs WHERE queue = ? AND state = ? AND lease_until < ? '
+                    'AND attempts >= ?', (queue, LEASED, now, self.max_attempts)
+                ).fetchall()
+                for job_id, url, data in expired:
+                    self._finish(job_id, FAILED)
+                    self._add_result('error', {'url': url, 'data': json.loads(data), 'error': '租用超时'}, worker)
+                row = self._db.execute(
+                    'SELECT id, url, data, attempts FROM jobs WHERE queue = ? '
+                    f'AND (state = ? OR (state = ? AND lease_until < ?)){where} ORDER BY id LIMIT 1', params
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        'UPDATE jobs SET state = ?, lease_until = ?, attempts = attempts + 1, worker = ? WHERE id = ?',
+                        (LEASED, now + self.visibility_timeout, worker, row[0])
+                    )
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        return Job(id=row[0], url=row[1], queue=queue, data=json.loads(row[2]), attempts=row[3] + 1)
+
+    def extend(self, job, seconds=None):
+        """
+        延长租用时间，处理时间很长的任务需要定时调用
+        """
+        with self._lock:
+            self._db.execute('UPDATE jobs SET lease_until = ? WHERE id = ? AND state = ?',
+                             (time.time() + (seconds or self.visibility_timeout), job.id, LEASED))
+
+    def _finish(self, job_id, state):
+        self._db.execute('UPDATE jobs SET state = ?, lease_until = 0 WHERE id = ?', (state, job_id))
+
+    def ack(self, job):
+        """
+        任务完成
+        """
+        with self._lock:
+            self._finish(job.id, DONE)
+
+    def fail(self, job, error, worker=None, retry=True):
+        """
+        任务失败，没有超过最大次数并且 retry 为 True 的时候重新加入队列，否则作为错误发送到结果
+        """
+        with self._lock:
+            if retry and job.attempts < self.max_attempts:
+                self._db.execute('UPDATE jobs SET state = ?, lease_until = 0 WHERE id = ?', (PENDING, job.id))
+                return
+            self._db.execute('BEGIN IMMEDIATE')
+            self._finish(job.id, FAILED)
+            self._add_result('error', {'url': job.url, 'data': job.data, 'error': error}, worker)
+            self._db.execute('COMMIT')
+
+    def _add_result(self, kind, data, worker):
+        self._db.execute('INSERT INTO results (kind, data, worker) VALUES (?, ?, ?)',
+                         (kind, json.dumps(data, ensure_ascii=False), worker))
+
+    def push_results(self, results, worker=None):
+        """
+        发送结果
+
+        :param results: (类型, 数据) 的列表，数据可以转换为 JSON
+        """
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            for kind, data in results:
+                self._add_result(kind, data, worker)
+            self._db.execute('COMMIT')
+
+    def pop_results(self, limit=1000):
+        """
+        取出结果
+
+        :return: (类型, 数据) 的列表
+        """
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            rows = self._db.execute('SELECT id, kind, data FROM results ORDER BY id LIMIT ?', (limit,)).fetchall()
+            if rows:
+                self._db.execute('DELETE FROM results WHERE id <= ?', (rows[-1][0],))
+            self._db.execute('COMMIT')
+        return [(kind, json.loads(data)) for _, kind, data in rows]
+
+    def unfinished(self):
+        """
+        等待和正在处理的任务数量
+        """
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)', (PENDING, LEASED)).fetchone()[0]
+
+    def stats(self):
+        """
+        每个队列各种状态的任务数量
+
+        :return: Dict(queue -> Dict(pending, leased, done, failed))
+        """
+        names = {PENDING: 'pending', LEASED: 'leased', DONE: 'done', FAILED: 'failed'}
+        stats = {}
+        with self._lock:
+            for queue, state, count in self._db.execute('SELECT queue, state, COUNT(*) FROM jobs GROUP BY queue, state'):
+                stats.setdefault(queue, dict.fromkeys(names.values(), 0))[names[state]] = count
+        return stats
+
+
+class RedisWorkQueue:
+    def __init__(self, client, name='spider', shards=1, shard_by='host', visibility_timeout=60.0, max_attempts=3):
+        """
+        保存在 Redis 里面的任务队列，多台电脑可以同时使用
+
+        只使用 SADD、HSET、RPUSH、LPOP、ZADD、ZREM 等基本命令，所以可以使用 redis-py 兼容的客户端（比如 fakeredis）。
+        租用和确认不是原子操作，进程在 LPOP 和 ZADD 之间崩溃的时候这个任务会丢失，其他情况下任务至少处理一次。
+
+        :param client: redis.Redis 或者兼容的客户端
+        :param name: 键的前缀，不同的爬取使用不同的名字
+        其他参数见 SQLiteWorkQueue
+        """
+        self.client = client
+        self.name = name
+        self.shards = shards
+        self.shard_by = shard_by
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """
+        使用 redis-py 连接，需要安装 redis：pip install spider-utils[redis]
+
+        :param url: 比如 redis://localhost:6379/0
+        """
+        import redis
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _key(self, *parts):
+        return ':'.join((self.name, *map(str, parts)))
+
+    @staticmethod
+    def _text(value):
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def put(self, url, data=None, queue=LIST_QUEUE):
+        job_id = f'{queue}:{url_fingerprint(url).hex()}'
+        if not self.client.sadd(self._key('seen', queue), job_id):
+            return False
+        job = {'url': url, 'queue': queue, 'data': data, 'attempts': 0,
+               'shard': shard_of(url, self.shards, self.shard_by)}
+        self.client.hset(self._key('jobs'), job_id, json.dumps(job))
+        self.client.incr(self._key('unfinished'))
+        self.client.rpush(self._key('pending', queue, job['shard']), job_id)
+        return True
+
+    def _load(self, job_id):
+        value = self.client.hget(self._key('jobs'), job_id)
+        return None if value is None else json.loads(value)
+
+    def _requeue_expired(self, worker):
+        """
+        租用超时的任务重新加入队列，ZREM 成功的进程负责重新加入，所以不会重复加入
+        """
+        for job_id in self.client.zrangebyscore(self._key('leases'), 0, time.time()):
+            job_id = self._text(job_id)
+            if not self.client.zrem(self._key('leases'), job_id):
+                continue
+            job = self._load(job_id)
+            if job is None:
+                continue
+            if job['attempts'] >= self.max_attempts:
+                self._drop(job_id, job, '租用超时', worker)
+            else:
+                self.client.rpush(self._key('pending', job['queue'], job['shard']), job_id)
+
+    def lease(self, queue=LIST_QUEUE, worker=None, shards=None):
+        self._requeue_expired(worker)
+        for shard in (range(self.shards) if shards is None else shards):
+            job = None
+            while job is None:
+                job_id = self.client.lpop(self._key('pending', queue, shard))
+                if job_id is None:
+                    break
+                job_id = self._text(job_id)
+                # 任务的数据已经被删除（或者过期）的时候，这个 id 已经从队列取出，直接跳过
+                job = self._load(job_id)
+            if job is None:
+                continue
+            self.client.zadd(self._key('leases'), {job_id: time.time() + self.visibility_timeout})
+            job['attempts'] += 1
+            self.client.hset(self._key('jobs'), job_id, json.dumps(job))
+            return Job(id=job_id, url=job['url'], queue=queue, data=job['data'], attempts=job['attempts'])
+        return None
+
+    def extend(self, job, seconds=None):
+        self.client.zadd(self._key('leases'), {job.id: time.time() + (seconds or self.visibility_timeout)}, xx=True)
+
+    def ack(self, job):
+        # 租用超时以后已经重新加入队列的任务由下一个进程确认
+        if self.client.zrem(self._key('leases'), job.id):
+            self.client.hdel(self._key('jobs'), job.id)
+            self.client.decr(self._key('unfinished'))
+
+    def _drop(self, job_id, job, error, worker):
+        self.client.hdel(self._key('jobs'), job_id)
+        self.push_results([('error', {'url': job['url'], 'data': job['data'], 'error': error})], worker)
+        self.client.decr(self._key('unfinished'))
+
+    def fail(self, job, error, worker=None, retry=True):
+        if not self.client.zrem(self._key('leases'), job.id):
+            return
+        stored = self._load(job.id)
+        if retry and job.attempts < self.max_attempts and stored is not None:
+            self.client.rpush(self._key('pending', job.queue, stored['shard']), job.id)
+        else:
+            self._drop(job.id, stored or {'url': job.url, 'data': job.data}, error, worker)
+
+    def push_results(self, results, worker=None):
+        values = [json.dumps({'kind': kind, 'data': data, 'worker': worker}, ensure_ascii=False)
+                  for kind, data in results]
+        if values:
+            self.client.rpush(self._key('results'), *values)
+
+    def pop_results(self, limit=1000):
+        key = self._key('results')
+        values = self.client.lrange(key, 0, limit - 1)
+        if values:
+            self.client.ltrim(key, len(values), -1)
+        results = []
+        for value in values:
+            value = json.loads(value)
+            results.append((value['kind'], value['data']))
+        return results
+
+    def unfinished(self):
+        return int(self.client.get(self._key('unfinished')) or 0)
+
+    def stats(self):
+        """
+        :return: Dict(unfinished, leased, results)
+        """
+        return {
+            'unfinished': self.unfinished(),
+            'leased': self.client.zcard(self._key('leases')),
+            'results': self.client.llen(self._key('results')),
+        }
+
+
+def seed(spider, queue):
+    """
+    把 spider.get_urls() 的列表页加入队列
+
+    :return: 新加入的任务数量
+    """
+    return sum(queue.put(page.url, {'name': page.name, 'page': page.page}, queue=LIST_QUEUE)
+               for page in spider.get_urls())
+
+
+def _new_errors(spider, total):
+    return [('error', {'error': record.message, 'url': record.url, 'kind': record.kind})
+            for record in spider.errors.since(total)]
+
+
+def run_worker(spider, queue, worker=None, shards=None, detail=False, overlay_file=True, idle_timeout=None,
+               poll_interval=0.5):
+    """
+    处理队列里面的任务，直到所有任务完成
+
+    列表页使用 spider.fetch_page 下载，process_list_page 解析，每个数据作为 item 发送；
+    detail 为 True 的时候详情页网址加入详情页队列，下载以后使用 parse_detail 解析，合并的数据作为 detail 发送。
+    spider.errors 里面新的错误作为 error 发送。
+
+    :param spider: BaseSpider，每个进程使用自己的 spider
+    :param queue: SQLiteWorkQueue 或者 RedisWorkQueue
+    :param worker: 进程的名字，None 表示使用主机名和进程号
+    :param shards: 只处理这几份的任务，None 表示所有
+    :param detail: 是否爬取详情页
+    :param overlay_file: 列表页已经保存过的时候是否重新下载
+    :param idle_timeout: 没有任务的时候最多等待的秒数，None 表示等到所有任务完成
+    :param poll_interval: 没有任务的时候等待的秒数
+    :return: 处理的任务数量
+    """
+    from .spider import PageContext
+
+    worker = worker or f'{socket.gethostname()}-{os.getpid()}'
+    queues = (LIST_QUEUE, DETAIL_QUEUE) if detail else (LIST_QUEUE,)
+    processed = 0
+    idle_since = None
+    while True:
+        job = None
+        for name in queues:
+            job = queue.lease(name, worker=worker, shards=shards)
+            if job is not None:
+                break
+        if job is None:
+            if not queue.unfinished():
+                break
+            idle_since = idle_since or time.monotonic()
+            if idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+                break
+            time.sleep(poll_interval)
+            continue
+        idle_since = None
+
+        error_count = spider.errors.total
+        results = []
+        if job.queue == LIST_QUEUE:
+            page = PageContext(name=job.data['name'], page=job.data['page'], url=job.url)
+            content = spider.fetch_page(page, overlay_file)
+            if content is not None:
+                for data in spider._process_content(content, job.url):
+                    results.append(('item', data))
+                    if detail and data.get('url'):
+                        queue.put(data['url'], data, queue=DETAIL_QUEUE)
+        else:
+            try:
+                content = spider.get(job.url).content
+                results.append(('detail', dict(job.data or {}, **spider.parse_detail(content))))
+            except Exception as e:
+                spider.log_function(f'错误:{e}')
+                spider.add_error(e, url=job.url)
+                content = None
+
+        errors = _new_errors(spider, error_count)
+        queue.push_results(results + errors, worker)
+        if content is None:
+            queue.fail(job, errors[-1][1]['error'] if errors else '下载失败', worker)
+        else:
+            queue.ack(job)
+        processed += 1
+    return processed
+
+
+def _worker_main(spider_factory, queue, kwargs):
+    run_worker(spider_factory(), queue, **kwargs)
+
+
+def start_workers(spider_factory, queue, processes=2, **kwargs):
+    """
+    启动多个进程运行 run_worker
+
+    :param spider_factory: 创建 spider 的函数（比如 BaseSpider 的子类），在每个进程里面调用
+    :param queue: 可以传给其他进程的队列（SQLiteWorkQueue）
+    :param processes: 进程数
+    :param kwargs: run_worker 的其他参数，shards 为 None 的时候第 i 个进程处理 shard % processes == i 的任务
+    :return: multiprocessing.Process 的列表
+    """
+    import multiprocessing
+
+    workers = []
+    for i in range(processes):
+        options = dict(kwargs)
+        if options.get('shards') is None and queue.shards >= processes:
+            options['shards'] = [shard for shard in range(queue.shards) if shard % processes == i]
+        options.setdefault('worker', f'worker-{i}-{uuid.uuid4().hex[:6]}')
+        process = multiprocessing.Process(target=_worker_main, args=(spider_factory, queue, options), daemon=True)
+        process.start()
+        workers.append(process)
+    return workers
+
+
+def collect(queue, poll_interval=0.5, timeout=None):
+    """
+    收集所有进程的结果，所有任务完成并且结果取完以后结束
+
+    :param timeout: 最多等待的秒数，None 表示一直等待
+    :return: (类型, 数据) 的迭代器，类型是 item、detail 或者 error
+    """
+    start = time.monotonic()
+    while True:
+        results = queue.pop_results()
+        yield from results
+        if results:
+            continue
+        if not queue.unfinished():
+            # 最后一个任务确认之前发送的结果
+            yield from queue.pop_results()
+            return
+        if timeout is not None and time.monotonic() - start >= timeout:
+            return
+        time.sleep(poll_interval)
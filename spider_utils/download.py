@@ -1,50 +1,171 @@
 import os
 import re
-from urllib.request import urlopen
+import json
+import time
+import shutil
+import threading
 
-from tqdm import tqdm
-import requests
+from .metrics import get_host, record_response
 
 
-def download(url, dst, resume=True, **kwargs):
+# 下载共用的会话，重复使用连接池里面的连接
+_session = None
+_session_lock = threading.Lock()
+
+# 连接池大小
+POOL_MAXSIZE = 32
+
+# 每次读取的字节数范围，根据文件大小调整
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+
+CONTENT_RANGE_RE = re.compile(r'bytes\s+(?:(\d+)-(\d+)|\*)/(\d+|\*)')
+
+
+def get_session():
+    """
+    获取下载共用的会话，使用 RetryPolicy 重试，一个主机出问题的时候熔断
+    """
+    global _session
+    if _session is None:
+        # 用到的时候再导入 requests，只使用 get_chunk_size 等函数的时候不需要加载
+        import requests
+        from .adapters import PoolAdapter
+        from .retry import RetryPolicy
+
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = PoolAdapter(pool_connections=POOL_MAXSIZE, pool_maxsize=POOL_MAXSIZE,
+                                      max_retries=RetryPolicy().retry())
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def get_chunk_size(file_size):
+    """
+    根据文件大小计算每次读取的字节数，大约读取 64 次，在 64 KiB 和 8 MiB 之间
+    """
+    if file_size <= 0:
+        return MIN_CHUNK_SIZE
+    return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, file_size // 64))
+
+
+def parse_content_range(value):
+    """
+    解析 Content-Range，返回 (开始位置, 结束位置, 文件大小)，不知道的值为 None
+
+    'bytes 0-499/1234' -> (0, 499, 1234)
+    'bytes */1234' -> (None, None, 1234)
+    """
+    match = CONTENT_RANGE_RE.match(value or '')
+    if match is None:
+        return None, None, None
+    start, end, total = match.groups()
+    return (
+        None if start is None else int(start),
+        None if end is None else int(end),
+        None if total == '*' else int(total),
+    )
+
+
+def open_range(url, first_byte=0, session=None, metrics=None, **kwargs):
+    """
+    请求从 first_byte 开始的内容，不需要单独请求文件大小
+
+    请求头带上 Range 以后，文件大小从响应的 Content-Range 获取。
+    服务器不支持 Range 的时候会返回全部内容，这时开始位置是 0。
+
+    :param metrics: 记录请求统计的 Metrics
+    :return: (响应, 开始位置, 文件大小)，文件已经下载完成的时候响应为 None，不知道文件大小的时候为 -1
+    """
+    session = session or get_session()
+    headers = dict(kwargs.pop('headers', None) or {})
+    headers['Range'] = f'bytes={first_byte}-'
+    kwargs['stream'] = True
+
+    req = session.get(url, headers=headers, **kwargs)
+    if metrics is not None:
+        record_response(metrics, req)
+    return parse_range_response(req, first_byte)
+
+
+def create_empty(dst, first_byte):
+    """
+    open_range 返回的响应为 None（416）并且是从 0 开始请求的时候，文件的大小是 0，创建空文件
+    """
+    if not first_byte:
+        open(dst, 'wb').close()
+
+
+def record_download(metrics, url, size, start):
+    """
+    记录下载的字节数和时间
+
+    :param size: 这次下载的字节数
+    :param start: 开始下载的时间（time.perf_counter()）
+    """
+    if metrics is not None:
+        metrics.inc('download_bytes_total', size, host=get_host(url))
+        metrics.observe('download_seconds', time.perf_counter() - start, host=get_host(url))
+
+
+def parse_range_response(req, first_byte):
+    """
+    解析 Range 请求的响应，返回值和 open_range 一样
+    """
+    if req.status_code == 416:
+        # 请求的开始位置超过了文件大小，说明已经下载完成
+        req.close()
+        file_size = parse_content_range(req.headers.get('Content-Range'))[2]
+        return None, first_byte, first_byte if file_size is None else file_size
+    req.raise_for_status()
+
+    if req.status_code == 206:
+        start, _, file_size = parse_content_range(req.headers.get('Content-Range'))
+        if start is None:
+            # Content-Range 没有开始位置（或者不能解析）的时候认为是从请求的位置开始，不能丢掉已经下载的内容
+            start = first_byte
+        return req, start, -1 if file_size is None else file_size
+
+    return req, 0, int(req.headers.get('Content-Length', -1))
+
+
+def download(url, dst, resume=True, session=None, metrics=None, **kwargs):
     """
     下载文件，支持下载续传（没有进度条）
 
     :param url: 下载文件的网址
     :param dst: 文件的保存路径
     :param resume: 是否需要下载续传
+    :param session: 使用的 requests.Session，None 的时候使用共用的会话
+    :param metrics: 记录下载统计的 Metrics，None 表示不记录
     :param kwargs:
-    :return:
+    :return: 文件大小
     """
-
+    start = time.perf_counter()
+    first_byte = 0
     # 下载续传
-    if resume:
-        if os.path.exists(dst):
-            first_byte = os.path.getsize(dst)
-        else:
-            first_byte = 0
-        file_size = int(urlopen(url).info().get('Content-Length', -1))
-
-        if first_byte >= file_size:
-            return file_size
+    if resume and os.path.exists(dst):
+        first_byte = os.path.getsize(dst)
 
-        if 'headers' in kwargs:
-            kwargs['headers']['Range'] = 'bytes=%s-%s' % (first_byte, file_size)
-        else:
-            kwargs['headers'] = {'Range': 'bytes=%s-%s' % (first_byte, file_size)}
-
-    kwargs['stream'] = True
+    req, first_byte, file_size = open_range(url, first_byte, session=session, metrics=metrics, **kwargs)
+    if req is None:
+        create_empty(dst, first_byte)
+        return file_size
 
-    req = requests.get(url, **kwargs)
-    with(open(dst, 'ab')) as f:
-        for chunk in req.iter_content(chunk_size=1024):
-            if chunk:
-                f.write(chunk)
+    with req, open(dst, 'ab' if first_byte else 'wb') as f:
+        req.raw.decode_content = True
+        shutil.copyfileobj(req.raw, f, get_chunk_size(file_size))
 
-    return int(req.headers['content-length'])
+    size = os.path.getsize(dst)
+    record_download(metrics, url, size - first_byte, start)
+    return size
 
 
-def download_progress(url, dst, resume=True, **kwargs):
+def download_progress(url, dst, resume=True, session=None, metrics=None, **kwargs):
     """
     下载文件，支持下载续传和进度条
 
@@ -61,38 +182,372 @@ def download_progress(url, dst, resume=True, **kwargs):
     :param url: 下载文件的网址
     :param dst: 文件的保存路径
     :param resume: 是否需要下载续传
+    :param session: 使用的 requests.Session，None 的时候使用共用的会话
+    :param metrics: 记录下载统计的 Metrics，None 表示不记录
     :param kwargs:
-    :return:
+    :return: 文件大小
     """
+    start = time.perf_counter()
     first_byte = 0
-    file_size = int(urlopen(url).info().get('Content-Length', -1))
-
     # 下载续传
-    if resume:
-        if os.path.exists(dst):
-            first_byte = os.path.getsize(dst)
-
-        if first_byte >= file_size:
-            return file_size
+    if resume and os.path.exists(dst):
+        first_byte = os.path.getsize(dst)
 
-        if 'headers' in kwargs:
-            kwargs['headers']['Range'] = 'bytes=%s-%s' % (first_byte, file_size)
-        else:
-            kwargs['headers'] = {'Range': 'bytes=%s-%s' % (first_byte, file_size)}
-
-    kwargs['stream'] = True
+    req, first_byte, file_size = open_range(url, first_byte, session=session, metrics=metrics, **kwargs)
+    if req is None:
+        create_empty(dst, first_byte)
+        return file_size
 
+    from tqdm import tqdm
     pbar = tqdm(
-        total=file_size, initial=first_byte,
+        total=file_size if file_size >= 0 else None, initial=first_byte,
         unit='B', unit_scale=True, desc=url.split('/')[-1]
     )
 
-    req = requests.get(url, **kwargs)
-    with(open(dst, 'ab')) as f:
-        for chunk in req.iter_content(chunk_size=1024):
-            if chunk:
-                f.write(chunk)
-                pbar.update(1024)
+    chunk_size = get_chunk_size(file_size)
+    with req, open(dst, 'ab' if first_byte else 'wb') as f:
+        req.raw.decode_content = True
+        read = req.raw.read
+        while True:
+            chunk = read(chunk_size)
+            if not chunk:
+                break
+            f.write(chunk)
+            pbar.update(len(chunk))
     pbar.close()
 
+    size = os.path.getsize(dst)
+    record_download(metrics, url, size - first_byte, start)
+    return size
+
+
+def _load_segments(state_file, file_size):
+    """
+    读取分段下载的状态文件，文件大小不一致的时候返回 None
+    """
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get('size') != file_size:
+        return None
+    return state['segments']
+
+
+def _save_segments(state_file, file_size, segments):
+    """
+    保存分段下载的状态，先写临时文件再替换，防止中断时状态文件损坏
+    """
+    tmp_file = f'{state_file}.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({'size': file_size, 'segments': segments}, f)
+    os.replace(tmp_file, state_file)
+
+
+def _split_segments(file_size, segments):
+    """
+    把文件分成 segments 段，返回 [开始位置, 结束位置, 已经下载的字节数] 列表
+    """
+    segment_size = -(-file_size // segments)
+    return [[start, min(start + segment_size, file_size) - 1, 0] for start in range(0, file_size, segment_size)]
+
+
+def download_segmented(url, dst, segments=4, chunk_size=1024 * 1024, session=None, progress=False, metrics=None,
+                       **kwargs):
+    """
+    多线程分段下载文件，每一段使用一个连接，支持每一段单独续传
+
+    先用一次 HEAD 请求获取文件大小和 Accept-Ranges，服务器不支持 Range 的时候使用 download 下载。
+    下载前预先分配文件大小，每个线程把自己那一段写到文件的对应位置。
+    下载进度保存在 {dst}.segments 状态文件里面，中断以后再次调用会从每一段中断的位置继续下载，
+    下载完成以后删除状态文件。
+    会话使用 RetryPolicy 的时候，一段在下载中途断开会按照策略（预算、退避时间、熔断）从断开的位置重试。
+
+    例子：
+    download_segmented(url, dst, segments=8, headers=headers, proxies=proxies, progress=True)
+
+    :param url: 下载文件的网址
+    :param dst: 文件的保存路径
+    :param segments: 分段数量（同时下载的连接数）
+    :param chunk_size: 每次读取的字节数
+    :param session: 使用的 requests.Session，None 的时候使用共用的会话
+    :param progress: 是否显示进度条
+    :param metrics: 记录下载统计的 Metrics，None 表示不记录
+    :param kwargs: requests 的参数
+    :return: 文件大小
+    """
+    import requests
+    from .retry import CircuitOpenError, session_policy, get_host
+
+    start = time.perf_counter()
+    session = session or get_session()
+    policy = session_policy(session, url)
+
+    headers = dict(kwargs.pop('headers', None) or {})
+    head = session.head(url, headers=headers, allow_redirects=True, **kwargs)
+    if metrics is not None:
+        record_response(metrics, head)
+    head.raise_for_status()
+    file_size = int(head.headers.get('Content-Length', -1))
+    if segments <= 1 or file_size <= 0 or head.headers.get('Accept-Ranges', '').lower() != 'bytes':
+        return download(url, dst, session=session, metrics=metrics, headers=headers, **kwargs)
+
+    state_file = f'{dst}.segments'
+    parts = _load_segments(state_file, file_size) if os.path.exists(dst) else None
+    if parts is None:
+        if os.path.exists(dst) and not os.path.exists(state_file) and os.path.getsize(dst) == file_size:
+            return file_size
+        parts = _split_segments(file_size, segments)
+        # 预先分配文件大小
+        with open(dst, 'wb') as f:
+            f.truncate(file_size)
+        _save_segments(state_file, file_size, parts)
+
+    lock = threading.Lock()
+    downloaded = sum(part[2] for part in parts)
+    last_save = [time.monotonic()]
+    pbar = None
+    if progress:
+        from tqdm import tqdm
+        pbar = tqdm(
+            total=file_size, initial=sum(part[2] for part in parts),
+            unit='B', unit_scale=True, desc=url.split('/')[-1]
+        )
+
+    def fetch(part):
+        previous = None
+        while True:
+            try:
+                return fetch_range(part)
+            except CircuitOpenError:
+                raise
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError):
+                # 下载中途断开，按照重试策略从断开的位置继续
+                if policy is None:
+                    raise
+                policy.record_failure(get_host(url))
+                if policy.is_open(get_host(url)) or not policy.consume_retry(get_host(url)):
+                    raise
+                previous = policy.backoff(previous)
+                time.sleep(previous)
+
+    def fetch_range(part):
+        start, end, done = part
+        if start + done > end:
+            return
+        part_headers = dict(headers)
+        part_headers['Range'] = f'bytes={start + done}-{end}'
+        with session.get(url, headers=part_headers, stream=True, **kwargs) as req:
+            if metrics is not None:
+                record_response(metrics, req)
+            if req.status_code != 206:
+                raise requests.HTTPError(f'服务器不支持分段下载，状态码 {req.status_code}', response=req)
+            # 不使用缓冲，写入的内容直接交给系统，保存的进度才不会超过实际写入的内容
+            with open(dst, 'r+b', buffering=0) as f:
+                f.seek(start + done)
+                for chunk in req.iter_content(chunk_size=chunk_size):
+                    if not chunk:
+                        continue
+                    f.write(chunk)
+                    with lock:
+                        part[2] += len(chunk)
+                        if pbar is not None:
+                            pbar.update(len(chunk))
+                        # 每秒最多保存一次状态
+                        if time.monotonic() - last_save[0] >= 1:
+                            _save_segments(state_file, file_size, parts)
+                            last_save[0] = time.monotonic()
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(parts)) as executor:
+            for future in [executor.submit(fetch, part) for part in parts]:
+                future.result()
+    finally:
+        with lock:
+            _save_segments(state_file, file_size, parts)
+        if pbar is not None:
+            pbar.close()
+        record_download(metrics, url, sum(part[2] for part in parts) - downloaded, start)
+
+    if sum(part[2] for part in parts) < file_size:
+        return None
+    os.remove(state_file)
     return file_size
+
+
+def _load_manifest(manifest):
+    """
+    读取批量下载的任务清单（JSON Lines），返回 {保存路径: 记录}，后面的记录覆盖前面的
+    """
+    records = {}
+    if manifest is None or not os.path.exists(manifest):
+        return records
+    with open(manifest, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 程序崩溃时没有写完的一行
+                continue
+            records.setdefault(record['dst'], {}).update(record)
+    return records
+
+
+def download_many(jobs, workers=8, order='size', progress=True, manifest=None, session=None, metrics=None,
+                  **kwargs):
+    """
+    批量下载文件，所有文件共用一个连接池，同时最多下载 workers 个，显示一个总的进度条（字节数和速度）
+
+    manifest 是任务清单文件，记录每个文件的大小和已经下载完成的文件。中断以后使用同一个清单再次调用，
+    已经完成的文件直接跳过，没有完成的文件从中断的位置继续下载。
+
+    例子：
+    jobs = [(url, f'images/{i}.jpg') for i, url in enumerate(urls)]
+    result = download_many(jobs, workers=16, manifest='images/manifest.jsonl', headers=headers)
+    for url, dst, error in result['failed']:
+        print(url, error)
+
+    :param jobs: (网址, 保存路径) 的可迭代对象
+    :param workers: 同时下载的文件数，超过 POOL_MAXSIZE 的时候需要传入连接池更大的 session
+    :param order: 下载顺序，'size' 表示先下载小文件（用 HEAD 请求获取文件大小），None 表示按照 jobs 的顺序，
+      也可以是函数 key(url, dst)，按照返回值从小到大下载
+    :param progress: 是否显示进度条
+    :param manifest: 任务清单文件的路径，None 表示不保存
+    :param session: 使用的 requests.Session，None 的时候使用共用的会话
+    :param metrics: 记录下载统计的 Metrics，None 表示不记录
+    :param kwargs: requests 的参数
+    :return: Dict(done, skipped, failed, bytes)，done 是这次下载完成的文件数，skipped 是已经完成跳过的文件数，
+      failed 是 [(网址, 保存路径, 错误)]，bytes 是这次下载的字节数
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    session = session or get_session()
+    records = _load_manifest(manifest)
+    lock = threading.Lock()
+    manifest_file = None
+    if manifest is not None:
+        if os.path.dirname(manifest):
+            os.makedirs(os.path.dirname(manifest), exist_ok=True)
+        manifest_file = open(manifest, 'a', encoding='utf-8')
+
+    def write_record(record):
+        if manifest_file is not None:
+            with lock:
+                manifest_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+                manifest_file.flush()
+
+    def is_done(url, dst):
+        record = records.get(dst)
+        return (record is not None and record.get('done') and record.get('url') == url
+                and os.path.exists(dst) and os.path.getsize(dst) == record.get('size'))
+
+    todo = []
+    skipped = 0
+    for url, dst in jobs:
+        dst = str(dst)
+        if is_done(url, dst):
+            skipped += 1
+        else:
+            todo.append((url, dst))
+    # 文件大小，-1 表示不知道
+    sizes = {dst: records.get(dst, {}).get('size', -1) for _, dst in todo}
+
+    result = {'done': 0, 'skipped': skipped, 'failed': [], 'bytes': 0}
+    pbar = None
+
+    def head(url, dst):
+        try:
+            r = session.head(url, allow_redirects=True, **kwargs)
+            size = int(r.headers.get('Content-Length', -1)) if r.ok else -1
+        except Exception:
+            size = -1
+        if size >= 0:
+            write_record({'dst': dst, 'url': url, 'size': size})
+        return size
+
+    def fetch(url, dst):
+        start = time.perf_counter()
+        directory = os.path.dirname(dst)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        first_byte = os.path.getsize(dst) if os.path.exists(dst) else 0
+        req, first_byte, file_size = open_range(url, first_byte, session=session, metrics=metrics, **kwargs)
+        with lock:
+            if sizes[dst] < 0 <= file_size and pbar is not None:
+                # 下载以前不知道大小的文件，加到进度条的总数
+                pbar.total += file_size
+                pbar.refresh()
+            sizes[dst] = file_size
+            if pbar is not None and first_byte:
+                pbar.update(first_byte)
+
+        if req is None:
+            create_empty(dst, first_byte)
+        else:
+            chunk_size = get_chunk_size(file_size)
+            with req, open(dst, 'ab' if first_byte else 'wb') as f:
+                req.raw.decode_content = True
+                read = req.raw.read
+                while True:
+                    chunk = read(chunk_size)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    with lock:
+                        result['bytes'] += len(chunk)
+                        if pbar is not None:
+                            pbar.update(len(chunk))
+
+        size = os.path.getsize(dst)
+        record_download(metrics, url, size - first_byte, start)
+        if 0 <= file_size != size:
+            raise IOError(f'文件大小不正确: {size} != {file_size}')
+        write_record({'dst': dst, 'url': url, 'size': size, 'done': True})
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            if order == 'size':
+                unknown = [(url, dst) for url, dst in todo if sizes[dst] < 0]
+                for (url, dst), size in zip(unknown, executor.map(lambda job: head(*job), unknown)):
+                    sizes[dst] = size
+                # 不知道大小的文件最后下载
+                todo.sort(key=lambda job: (sizes[job[1]] < 0, sizes[job[1]]))
+            elif callable(order):
+                todo.sort(key=lambda job: order(*job))
+
+            if progress:
+                from tqdm import tqdm
+                pbar = tqdm(total=sum(size for size in sizes.values() if size > 0), unit='B', unit_scale=True,
+                            desc=f'{len(todo)} 个文件')
+
+            # 同时最多提交 workers * 2 个任务，jobs 很多的时候不会一次创建所有的 Future
+            jobs = iter(todo)
+            running = {}
+            for url, dst in jobs:
+                running[executor.submit(fetch, url, dst)] = (url, dst)
+                if len(running) >= workers * 2:
+                    break
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    url, dst = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        result['done'] += 1
+                    else:
+                        result['failed'].append((url, dst, error))
+                    if pbar is not None:
+                        pbar.set_postfix_str(f'完成 {result["done"] + skipped}/{len(todo) + skipped}', refresh=False)
+                    for url, dst in jobs:
+                        running[executor.submit(fetch, url, dst)] = (url, dst)
+                        break
+    finally:
+        if pbar is not None:
+            pbar.close()
+        if manifest_file is not None:
+            manifest_file.close()
+
+    return result
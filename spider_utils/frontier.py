@@ -0,0 +1,261 @@
+"""
+保存在 SQLite 里面的待爬取网址队列（frontier），自动去重，程序重启以后从中断的地方继续
+
+网址先规范化（大小写、默认端口、参数顺序、#后面的内容）再计算指纹去重，
+同一个队列里面按优先级取出网址，不同的主机轮流取出。
+
+例子：
+from spider_utils.frontier import Frontier
+
+frontier = Frontier('cache/frontier.sqlite')
+frontier.add('https://www.example.com/page/2/', priority=1)
+item = frontier.pop()
+...
+frontier.done(item.url)
+frontier.checkpoint()
+"""
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import namedtuple, deque
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+FrontierItem = namedtuple('FrontierItem', ['url', 'host', 'priority', 'data', ])
+
+# 网址的状态
+PENDING = 0
+IN_PROGRESS = 1
+DONE = 2
+FAILED = 3
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+PERCENT_RE = re.compile(r'%[0-9a-fA-F]{2}')
+
+
+def normalize_url(url):
+    """
+    规范化网址，同一个页面的不同写法得到相同的结果
+
+    'HTTP://Example.com:80/a?b=2&a=1#top' -> 'http://example.com/a?a=1&b=2'
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    netloc = host
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f'{host}:{parts.port}'
+    if parts.username:
+        netloc = f'{parts.username}:{parts.password}@{netloc}' if parts.password else f'{parts.username}@{netloc}'
+    path = PERCENT_RE.sub(lambda m: m.group(0).upper(), parts.path) or '/'
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+
+def url_fingerprint(url):
+    """
+    规范化以后网址的指纹（8 字节）
+    """
+    return hashlib.sha1(normalize_url(url).encode('utf-8')).digest()[:8]
+
+
+class Frontier:
+    def __init__(self, path, checkpoint_interval=1000, retry_failed=True):
+        """
+        :param path: SQLite 文件路径
+        :param checkpoint_interval: 每修改多少次自动保存一次
+        :param retry_failed: 打开的时候是否把失败的网址重新加入队列
+        """
+        self.path = str(path)
+        self.checkpoint_interval = checkpoint_interval
+        self._changes = 0
+        # 每个队列轮流取出的主机
+        self._hosts = {}
+        self._host_sets = {}
+        self._lock = threading.RLock()
+
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS urls ('
+            'id INTEGER PRIMARY KEY, fingerprint BLOB UNIQUE, url TEXT, queue TEXT, host TEXT, '
+            'priority INTEGER, state INTEGER, data TEXT, added REAL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS urls_pending ON urls (queue, state, host, priority DESC, id)')
+        # 上次中断的时候正在爬取的网址重新加入队列
+        states = (IN_PROGRESS, FAILED) if retry_failed else (IN_PROGRESS,)
+        self._db.execute(f'UPDATE urls SET state = ? WHERE state IN ({",".join("?" * len(states))})',
+                         (PENDING, *states))
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+    def checkpoint(self):
+        """
+        保存修改，程序崩溃以后可以从这里继续
+        """
+        with self._lock:
+            self._db.commit()
+            self._changes = 0
+
+    def _changed(self, count=1):
+        self._changes += count
+        if self._changes >= self.checkpoint_interval:
+            self._db.commit()
+            self._changes = 0
+
+    def add(self, url, priority=0, data=None, queue='default'):
+        """
+        添加网址，已经添加过的网址（包括已经爬取的）会被忽略
+
+        :param url: 网址
+        :param priority: 优先级，越大越先取出
+        :param data: 和网址一起保存的数据，可以转换为 JSON 的对象
+        :param queue: 队列名字，比如列表页和详情页使用不同的队列
+        :return: 是否是新的网址
+        """
+        return self._insert(url, priority, data, queue, PENDING)
+
+    def mark_done(self, url, data=None, queue='default'):
+        """
+        记录已经处理完的网址（状态直接是 DONE，不会被 pop 取出），用来给不需要排队的网址去重
+
+        :return: 是否是新的网址
+        """
+        return self._insert(url, 0, data, queue, DONE)
+
+    def _insert(self, url, priority, data, queue, state):
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT OR IGNORE INTO urls (fingerprint, url, queue, host, priority, state, data, added) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (url_fingerprint(url), url, queue, host, priority, state,
+                 json.dumps(data), time.time())
+            )
+            if not cursor.rowcount:
+                return False
+            if state == PENDING:
+                host_set = self._host_sets.get(queue)
+                if host_set is not None and host not in host_set:
+                    host_set.add(host)
+                    self._hosts[queue].append(host)
+            self._changed()
+            return True
+
+    def add_many(self, urls, priority=0, queue='default'):
+        """
+        添加多个网址，返回新网址的数量
+        """
+        return sum(self.add(url, priority=priority, queue=queue) for url in urls)
+
+    def seen(self, url):
+        """
+        网址是否已经添加过
+        """
+        with self._lock:
+            return self._db.execute(
+                'SELECT 1 FROM urls WHERE fingerprint = ?', (url_fingerprint(url),)
+            ).fetchone() is not None
+
+    def __contains__(self, url):
+        return self.seen(url)
+
+    def state(self, url):
+        """
+        网址的状态（PENDING、IN_PROGRESS、DONE、FAILED），没有添加过的时候返回 None
+        """
+        with self._lock:
+            row = self._db.execute('SELECT state FROM urls WHERE fingerprint = ?', (url_fingerprint(url),)).fetchone()
+        return None if row is None else row[0]
+
+    def pop(self, queue='default'):
+        """
+        取出下一个网址，不同的主机轮流取出，同一个主机按优先级取出
+
+        :return: FrontierItem，队列为空的时候返回 None
+        """
+        with self._lock:
+            hosts = self._hosts.setdefault(queue, deque())
+            host_set = self._host_sets.setdefault(queue, set())
+            for refresh in (not hosts, True):
+                if refresh:
+                    host_set.clear()
+                    host_set.update(row[0] for row in self._db.execute(
+                        'SELECT DISTINCT host FROM urls WHERE queue = ? AND state = ?', (queue, PENDING)))
+                    hosts.clear()
+                    hosts.extend(host_set)
+                while hosts:
+                    host = hosts.popleft()
+                    row = self._db.execute(
+                        'SELECT id, url, priority, data FROM urls WHERE queue = ? AND state = ? AND host = ? '
+                        'ORDER BY priority DESC, id LIMIT 1', (queue, PENDING, host)
+                    ).fetchone()
+                    if row is None:
+                        host_set.discard(host)
+                        continue
+                    hosts.append(host)
+                    self._db.execute('UPDATE urls SET state = ? WHERE id = ?', (IN_PROGRESS, row[0]))
+                    self._changed()
+                    return FrontierItem(url=row[1], host=host, priority=row[2], data=json.loads(row[3]))
+            return None
+
+    def _set_state(self, url, state):
+        with self._lock:
+            self._db.execute('UPDATE urls SET state = ? WHERE fingerprint = ?', (state, url_fingerprint(url)))
+            self._changed()
+
+    def done(self, url):
+        """
+        标记网址已经爬取
+        """
+        self._set_state(url, DONE)
+
+    def failed(self, url):
+        """
+        标记网址爬取失败，retry_failed 为 True 的时候下次打开会重新加入队列
+        """
+        self._set_state(url, FAILED)
+
+    def retry(self, url):
+        """
+        把网址重新加入队列
+        """
+        self._set_state(url, PENDING)
+
+    def skip_pending(self, queue='default'):
+        """
+        把队列里面还没有爬取的网址标记为已经爬取（比如增量爬取提前停止的时候，剩下的网址这次不需要爬取）
+        """
+        with self._lock:
+            cursor = self._db.execute('UPDATE urls SET state = ? WHERE queue = ? AND state IN (?, ?)',
+                                      (DONE, queue, PENDING, IN_PROGRESS))
+            self._changed(cursor.rowcount)
+
+    def __len__(self):
+        """
+        等待爬取的网址数量
+        """
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM urls WHERE state = ?', (PENDING,)).fetchone()[0]
+
+    def stats(self):
+        """
+        每个队列各种状态的网址数量
+
+        :return: Dict(queue -> Dict(pending, in_progress, done, failed))
+        """
+        names = {PENDING: 'pending', IN_PROGRESS: 'in_progress', DONE: 'done', FAILED: 'failed'}
+        stats = {}
+        with self._lock:
+            for queue, state, count in self._db.execute(
+                    'SELECT queue, state, COUNT(*) FROM urls GROUP BY queue, state'):
+                stats.setdefault(queue, dict.fromkeys(names.values(), 0))[names[state]] = count
+        return stats
@@ -0,0 +1,179 @@
+"""
+增量爬取：保存在 SQLite 里面的已爬取内容索引
+
+每个详情页网址保存列表页数据的指纹（list_hash）和详情内容的指纹（detail_hash），再次爬取的时候：
+
+- 没有见过的网址是 new
+- 见过但是列表页数据变了（比如标题、更新时间、回复数）是 changed，需要重新爬取详情页
+- 见过并且没有变化是 unchanged，不用再爬取详情页
+
+BaseSpider.crawl 连续遇到 max_exist 个 unchanged 的时候不再爬取后面的列表页，
+所以每天重新爬取的时间只和新增的内容有关，和网站的大小无关。
+
+例子：
+from spider_utils.incremental import SeenIndex
+
+index = SeenIndex('cache/seen.sqlite')
+spider = BaseSpider('https://www.example.com', seen_index=index)
+for data in spider.crawl(max_exist=10):  # 只返回新的和变化了的数据
+    ...
+print(index.stats())
+"""
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from .frontier import url_fingerprint
+
+# check 的结果
+NEW = 'new'
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'
+
+
+def content_hash(value):
+    """
+    内容的指纹（8 字节），value 可以是 bytes、str 或者可以转换为 JSON 的对象（字典的键不分顺序）
+    """
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    elif not isinstance(value, (bytes, bytearray)):
+        value = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')
+    return hashlib.sha1(value).digest()[:8]
+
+
+class SeenIndex:
+    def __init__(self, path, checkpoint_interval=1000, require_detail=False):
+        """
+        :param path: SQLite 文件路径
+        :param checkpoint_interval: 每修改多少次自动保存一次
+        :param require_detail: 是否只有 record_detail 记录过详情的网址才算 unchanged，
+          这样详情页下载失败的网址下次还会返回
+        """
+        self.path = str(path)
+        self.checkpoint_interval = checkpoint_interval
+        self.require_detail = require_detail
+        self._changes = 0
+        self._counts = {NEW: 0, CHANGED: 0, UNCHANGED: 0}
+        self._lock = threading.RLock()
+
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS items ('
+            'fingerprint BLOB PRIMARY KEY, url TEXT, list_hash BLOB, detail_hash BLOB, '
+            'first_seen REAL, last_seen REAL, changed REAL) WITHOUT ROWID'
+        )
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+    def checkpoint(self):
+        """
+        保存修改
+        """
+        with self._lock:
+            self._db.commit()
+            self._changes = 0
+
+    def _changed(self):
+        self._changes += 1
+        if self._changes >= self.checkpoint_interval:
+            self._db.commit()
+            self._changes = 0
+
+    def check(self, url, list_hash=None):
+        """
+        检查网址是否爬取过，并记录这次看到的列表页指纹
+
+        :param url: 详情页网址
+        :param list_hash: 列表页数据的指纹（content_hash），None 表示不比较
+        :return: NEW、CHANGED 或者 UNCHANGED
+        """
+        fingerprint = url_fingerprint(url)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT list_hash, detail_hash FROM items WHERE fingerprint = ?', (fingerprint,)
+            ).fetchone()
+            if row is None:
+                self._db.execute(
+                    'INSERT INTO items (fingerprint, url, list_hash, first_seen, last_seen, changed) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', (fingerprint, url, list_hash, now, now, now)
+                )
+                status = NEW
+            elif list_hash is not None and row[0] != list_hash:
+                self._db.execute('UPDATE items SET list_hash = ?, last_seen = ?, changed = ? WHERE fingerprint = ?',
+                                 (list_hash, now, now, fingerprint))
+                status = CHANGED
+            else:
+                self._db.execute('UPDATE items SET last_seen = ? WHERE fingerprint = ?', (now, fingerprint))
+                # 详情页还没有爬取成功的时候需要再爬取
+                status = CHANGED if self.require_detail and row[1] is None else UNCHANGED
+            self._changed()
+            self._counts[status] += 1
+        return status
+
+    def record_detail(self, url, detail_hash):
+        """
+        记录详情内容的指纹
+
+        :param detail_hash: 详情内容的指纹（content_hash）
+        :return: 详情内容是否变化（包括第一次记录）
+        """
+        fingerprint = url_fingerprint(url)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT detail_hash FROM items WHERE fingerprint = ?', (fingerprint,)).fetchone()
+            if row is None:
+                self._db.execute(
+                    'INSERT INTO items (fingerprint, url, detail_hash, first_seen, last_seen, changed) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', (fingerprint, url, detail_hash, now, now, now)
+                )
+            elif row[0] == detail_hash:
+                return False
+            else:
+                self._db.execute('UPDATE items SET detail_hash = ?, changed = ? WHERE fingerprint = ?',
+                                 (detail_hash, now, fingerprint))
+            self._changed()
+        return True
+
+    def get(self, url):
+        """
+        网址的记录
+
+        :return: Dict(url, list_hash, detail_hash, first_seen, last_seen, changed)，没有记录的时候返回 None
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT url, list_hash, detail_hash, first_seen, last_seen, changed FROM items WHERE fingerprint = ?',
+                (url_fingerprint(url),)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('url', 'list_hash', 'detail_hash', 'first_seen', 'last_seen', 'changed'), row))
+
+    def __contains__(self, url):
+        with self._lock:
+            return self._db.execute(
+                'SELECT 1 FROM items WHERE fingerprint = ?', (url_fingerprint(url),)
+            ).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+
+    def stats(self):
+        """
+        打开以后 check 的结果数量和保存的网址数量
+
+        :return: Dict(new, changed, unchanged, total)
+        """
+        with self._lock:
+            return dict(self._counts, total=len(self))
@@ -0,0 +1,331 @@
+"""
+请求的统计和跟踪
+
+BaseSpiderClient、BaseSpider 和 download 函数都可以传入同一个 Metrics，没有传入的时候不做任何统计。
+延迟使用固定桶的直方图保存，占用的内存不会随着请求数量增加。
+
+统计的内容（标签 host 是主机）：
+
+http_requests_total{host, status}       请求数（status 为 error 表示请求出错）
+http_errors_total{host, error}          出错的请求数，error 是异常的类名
+http_retries_total{host}                重试次数
+http_dns_seconds{host}                  DNS 解析时间
+http_connect_seconds{host}              TCP 连接时间
+http_tls_seconds{host}                  TLS 握手时间
+http_pool_wait_seconds{host}            等待空闲连接的时间
+http_ttfb_seconds{host}                 发送请求到收到响应头的时间
+http_body_seconds{host}                 读取响应内容的时间
+http_request_bytes_total{host}          发送的字节数（请求头和请求体）
+http_response_bytes_total{host}         收到的响应内容字节数
+parse_seconds{stage}                    解析时间，stage 是 list 或者 detail
+crawl_pages_total{status}               crawl 爬取的列表页数量，status 是 ok、skipped（已经保存过）或者 error
+crawl_items_total{status}               设置了 seen_index 时列表页数据的数量，status 是 new、changed 或者 unchanged
+download_bytes_total{host}              下载的字节数
+download_seconds{host}                  下载一个文件的时间
+proxy_requests_total{proxy, status}     ProxyPool 每个代理的请求数，status 是 ok 或者 error
+
+例子：
+from spider_utils.metrics import Metrics
+
+metrics = Metrics()
+metrics.add_hook(lambda kind, name, value, labels: print(kind, name, value, labels))
+spider = BaseSpider('https://www.example.com', metrics=metrics)
+...
+print(metrics.to_prometheus())
+metrics.write_prometheus('/var/lib/node_exporter/spider.prom')
+"""
+import os
+import time
+import threading
+from bisect import bisect_left
+
+from .ratelimit import get_host  # noqa
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _key(name, labels):
+    """
+    统计的键，标签的值转换为字符串（status=200 和 status='error' 可以一起排序，200 和 '200' 是同一个）
+    """
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape_label(value):
+    """
+    Prometheus 标签值的转义
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        固定桶的直方图，counts[i] 是小于等于 buckets[i] 的数量（不累加），最后一个是大于所有桶的数量
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        估计分位数（返回所在桶的上限）
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        for bucket, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bucket
+        return float('inf')
+
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        线程安全的计数器和直方图
+
+        :param buckets: 直方图的桶（秒）
+        """
+        self.buckets = buckets
+        # (名字, ((标签, 值), ...)) -> 值
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        """
+        添加回调函数，每次记录的时候调用 hook(kind, name, value, labels)，kind 是 counter、gauge 或者 histogram
+        """
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def _call_hooks(self, kind, name, value, labels):
+        for hook in self._hooks:
+            hook(kind, name, value, labels)
+
+    def inc(self, name, value=1, **labels):
+        """
+        计数器增加 value
+        """
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        if self._hooks:
+            self._call_hooks('counter', name, value, labels)
+
+    def set(self, name, value, **labels):
+        """
+        设置当前值，比如并发数
+        """
+        key = _key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+        if self._hooks:
+            self._call_hooks('gauge', name, value, labels)
+
+    def observe(self, name, value, **labels):
+        """
+        直方图记录一个值
+        """
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+        if self._hooks:
+            self._call_hooks('histogram', name, value, labels)
+
+    def get(self, name, **labels):
+        """
+        获取计数器或者当前值
+        """
+        key = _key(name, labels)
+        with self._lock:
+            if key in self._gauges:
+                return self._gauges[key]
+            return self._counters.get(key, 0)
+
+    def histogram(self, name, **labels):
+        """
+        获取直方图，没有记录过的时候返回 None
+        """
+        with self._lock:
+            return self._histograms.get(_key(name, labels))
+
+    def snapshot(self):
+        """
+        所有统计的副本
+
+        :return: Dict(counters, gauges, histograms)，直方图是 Dict(count, sum, p50, p90, p99)
+        """
+        def label_key(name, labels):
+            if not labels:
+                return name
+            return name + '{' + ','.join(f'{k}={v}' for k, v in labels) + '}'
+
+        with self._lock:
+            return {
+                'counters': {label_key(*key): value for key, value in self._counters.items()},
+                'gauges': {label_key(*key): value for key, value in self._gauges.items()},
+                'histograms': {
+                    label_key(*key): {
+                        'count': h.count,
+                        'sum': round(h.sum, 6),
+                        'p50': h.quantile(0.5),
+                        'p90': h.quantile(0.9),
+                        'p99': h.quantile(0.99),
+                    }
+                    for key, h in self._histograms.items()
+                },
+            }
+
+    def to_prometheus(self, prefix='spider_'):
+        """
+        转换为 Prometheus 的文本格式
+        """
+        def format_labels(labels, extra=()):
+            items = [*labels, *extra]
+            if not items:
+                return ''
+            return '{' + ','.join(f'{k}="{_escape_label(v)}"' for k, v in items) + '}'
+
+        lines = []
+        with self._lock:
+            for kind, values in (('counter', self._counters), ('gauge', self._gauges)):
+                seen = set()
+                for (name, labels), value in sorted(values.items()):
+                    if name not in seen:
+                        lines.append(f'# TYPE {prefix}{name} {kind}')
+                        seen.add(name)
+                    lines.append(f'{prefix}{name}{format_labels(labels)} {value}')
+            seen = set()
+            for (name, labels), h in sorted(self._histograms.items(), key=lambda item: item[0]):
+                if name not in seen:
+                    lines.append(f'# TYPE {prefix}{name} histogram')
+                    seen.add(name)
+                total = 0
+                for bucket, count in zip(h.buckets, h.counts):
+                    total += count
+                    lines.append(f'{prefix}{name}_bucket{format_labels(labels, [("le", bucket)])} {total}')
+                lines.append(f'{prefix}{name}_bucket{format_labels(labels, [("le", "+Inf")])} {h.count}')
+                lines.append(f'{prefix}{name}_sum{format_labels(labels)} {h.sum}')
+                lines.append(f'{prefix}{name}_count{format_labels(labels)} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, prefix='spider_'):
+        """
+        写入 Prometheus 文本文件（可以给 node_exporter 的 textfile collector 使用），先写临时文件再替换
+        """
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus(prefix))
+        os.replace(tmp_path, path)
+
+
+def request_size(request):
+    """
+    估计请求发送的字节数（请求行、请求头和请求体）
+    """
+    size = len(request.method) + len(request.path_url) + 12
+    size += sum(len(name) + len(value) + 4 for name, value in request.headers.items()) + 2
+    body = request.body
+    if isinstance(body, (bytes, str)):
+        size += len(body)
+    return size
+
+
+def record_response(metrics, response, seconds=None):
+    """
+    记录一个 requests 的响应：状态码、重试次数、发送的字节数、收到响应头的时间
+
+    :param seconds: 请求的总时间（包括读取响应内容），None 表示响应内容还没有读取（stream），不记录响应内容
+    """
+    host = get_host(response.url)
+    for r in (*response.history, response):
+        metrics.inc('http_requests_total', host=get_host(r.url), status=r.status_code)
+        metrics.inc('http_request_bytes_total', request_size(r.request), host=get_host(r.url))
+    ttfb = response.elapsed.total_seconds()
+    metrics.observe('http_ttfb_seconds', ttfb, host=host)
+
+    retries = getattr(response.raw, 'retries', None)
+    if retries is not None and retries.history:
+        metrics.inc('http_retries_total', len(retries.history), host=host)
+
+    if seconds is not None:
+        metrics.observe('http_body_seconds', max(seconds - ttfb, 0.0), host=host)
+        metrics.inc('http_response_bytes_total', len(response.content), host=host)
+
+
+def record_error(metrics, url, error):
+    """
+    记录出错的请求
+    """
+    host = get_host(url)
+    metrics.inc('http_requests_total', host=host, status='error')
+    metrics.inc('http_errors_total', host=host, error=type(error).__name__)
+
+
+def timed_iter(metrics, name, iterable, **labels):
+    """
+    返回和 iterable 一样的迭代器，把生成所有元素的时间（不包括调用者处理元素的时间）记录到直方图
+
+    metrics 为 None 的时候直接返回 iterable
+    """
+    if metrics is None:
+        return iterable
+    return _timed_iter(metrics, name, iterable, labels)
+
+
+def _timed_iter(metrics, name, iterable, labels):
+    iterator = iter(iterable)
+    elapsed = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        metrics.observe(name, elapsed, **labels)
+
+
+class Timer:
+    """
+    记录一段代码的运行时间到直方图，metrics 为 None 的时候什么都不做
+
+    with Timer(metrics, 'parse_seconds', stage='list'):
+        ...
+    """
+    __slots__ = ('metrics', 'name', 'labels', 'start')
+
+    def __init__(self, metrics, name, **labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        if self.metrics is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.metrics is not None:
+            self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
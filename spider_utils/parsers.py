@@ -0,0 +1,210 @@
+"""
+解析列表页和详情页的后端，BaseSpider 通过 parser 参数选择
+
+bs4         BeautifulSoup（默认，和以前的结果一样）
+lxml        直接使用 lxml 的树和预先编译的 XPath，速度比 bs4 快很多
+selectolax  使用 selectolax 的 CSS 选择器，需要安装 selectolax
+
+解析器按名字创建，可以在进程池里面使用：
+
+from spider_utils.parsers import parse_list_pages
+
+for data_list in parse_list_pages(contents, parser='lxml', workers=4):
+    ...
+"""
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+
+class BaseParser:
+    """
+    解析器的基类，子类实现 parse_list 和 detail_html
+    """
+    name = ''
+
+    def parse_list(self, content):
+        """
+        解析列表页
+
+        :return: [{'title': 标题, 'url': 详情页网址}, ...]
+        """
+        raise NotImplementedError
+
+    def detail_html(self, content):
+        """
+        获取详情页正文的 HTML，找不到正文的时候返回 None
+        """
+        raise NotImplementedError
+
+
+class Bs4Parser(BaseParser):
+    name = 'bs4'
+
+    def __init__(self):
+        from bs4 import BeautifulSoup
+        self.BeautifulSoup = BeautifulSoup
+
+    def parse_list(self, content):
+        soup = self.BeautifulSoup(content, 'lxml')
+        data_list = []
+        for article in soup.find_all('article', class_='post'):
+            data_list.append({
+                'title': article.h2.text,
+                'url': article.h2.a.get('href'),
+            })
+        return data_list
+
+    def detail_html(self, content):
+        soup = self.BeautifulSoup(content, 'lxml')
+        article = soup.find('div', class_='entry-content')
+        if article is None:
+            return None
+        return str(article)
+
+
+def _class_xpath(tag, class_name):
+    return f"//{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')]"
+
+
+class LxmlParser(BaseParser):
+    name = 'lxml'
+
+    def __init__(self):
+        import lxml.html
+        from lxml import etree
+        self.lxml_html = lxml.html
+        self.etree = etree
+        # 预先编译 XPath
+        self.articles = etree.XPath(_class_xpath('article', 'post'))
+        self.title = etree.XPath('string((.//h2)[1])')
+        self.href = etree.XPath('((.//h2)[1]//a)[1]/@href')
+        self.entry_content = etree.XPath(f"({_class_xpath('div', 'entry-content')})[1]")
+
+    def tree(self, content):
+        """
+        解析 HTML，内容为空的时候返回 None
+        """
+        if not content or not content.strip():
+            return None
+        return self.lxml_html.document_fromstring(content)
+
+    def parse_list(self, content):
+        tree = self.tree(content)
+        if tree is None:
+            return []
+        data_list = []
+        for article in self.articles(tree):
+            href = self.href(article)
+            data_list.append({
+                'title': self.title(article),
+                'url': str(href[0]) if href else None,
+            })
+        return data_list
+
+    def detail_element(self, content):
+        """
+        获取详情页正文的 lxml 元素，找不到正文的时候返回 None
+        """
+        tree = self.tree(content)
+        if tree is None:
+            return None
+        elements = self.entry_content(tree)
+        return elements[0] if elements else None
+
+    def detail_html(self, content):
+        element = self.detail_element(content)
+        if element is None:
+            return None
+        return self.etree.tostring(element, encoding='unicode', method='html', with_tail=False)
+
+
+class SelectolaxParser(BaseParser):
+    name = 'selectolax'
+
+    def __init__(self):
+        try:
+            from selectolax.lexbor import LexborHTMLParser as HTMLParser
+        except ImportError:
+            from selectolax.parser import HTMLParser
+        self.HTMLParser = HTMLParser
+
+    def parse_list(self, content):
+        tree = self.HTMLParser(content)
+        data_list = []
+        for article in tree.css('article.post'):
+            h2 = article.css_first('h2')
+            a = h2.css_first('a') if h2 is not None else None
+            data_list.append({
+                'title': h2.text() if h2 is not None else '',
+                'url': a.attributes.get('href') if a is not None else None,
+            })
+        return data_list
+
+    def detail_html(self, content):
+        article = self.HTMLParser(content).css_first('div.entry-content')
+        if article is None:
+            return None
+        return article.html
+
+
+PARSERS = {
+    Bs4Parser.name: Bs4Parser,
+    LxmlParser.name: LxmlParser,
+    SelectolaxParser.name: SelectolaxParser,
+}
+
+# 每个进程里面已经创建的解析器
+_parsers = {}
+
+
+def register_parser(parser_class):
+    """
+    注册自定义的解析器，注册以后可以通过名字使用
+    """
+    PARSERS[parser_class.name] = parser_class
+    return parser_class
+
+
+def get_parser(parser='bs4'):
+    """
+    按名字获取解析器，同一个进程里面同一个名字只创建一次
+
+    :param parser: 解析器的名字或者 BaseParser 对象
+    :return: BaseParser
+    """
+    if isinstance(parser, BaseParser):
+        return parser
+    if parser not in _parsers:
+        if parser not in PARSERS:
+            raise ValueError(f'没有这个解析器: {parser}，可以使用 {", ".join(PARSERS)}')
+        _parsers[parser] = PARSERS[parser]()
+    return _parsers[parser]
+
+
+def _parse_list(parser, content):
+    return get_parser(parser).parse_list(content)
+
+
+def _detail_html(parser, content):
+    return get_parser(parser).detail_html(content)
+
+
+def parse_list_pages(contents, parser='lxml', workers=None, chunksize=8):
+    """
+    在进程池里面解析多个列表页，解析的时候不会占用主进程的 GIL，按 contents 的顺序返回结果
+
+    :param contents: 网页内容的可迭代对象
+    :param parser: 解析器的名字
+    :param workers: 进程数，None 表示 CPU 核心数
+    :param chunksize: 每次发送给子进程的网页数量
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_parse_list, repeat(parser), contents, chunksize=chunksize)
+
+
+def detail_html_pages(contents, parser='lxml', workers=None, chunksize=8):
+    """
+    在进程池里面获取多个详情页正文的 HTML，按 contents 的顺序返回结果
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_detail_html, repeat(parser), contents, chunksize=chunksize)
@@ -0,0 +1,387 @@
+"""
+下载、解析、输出分开进行的爬取流水线
+
+下载（线程池） -> 有界队列 -> 解析（进程池） -> 有界队列 -> 输出（调用者迭代）
+
+队列满了的时候前面的阶段会等待，所以解析慢的时候不会无限制地下载，下载慢的时候解析进程也不会占用资源。
+每个解析进程有自己的 HTML2Text，stats() 返回每个阶段的队列长度和速度，用来调整线程数和进程数。
+解析阶段出错（比如进程池不能使用）的时候，异常在调用者迭代结果的地方重新抛出。
+
+例子：
+spider = BaseSpider('https://www.example.com', parser='lxml')
+pipeline = spider.pipeline(fetch_workers=8, parse_workers=4, report_interval=10)
+items = list(pipeline.crawl())
+for data in pipeline.crawl_details(items):
+    print(data['title'], len(data['content']))
+print(pipeline.stats())
+"""
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .parsers import PARSERS, get_parser
+from .spider import BaseSpider, LIST_QUEUE
+from .converter import ConverterPool, convert_detail
+from .incremental import content_hash
+
+# 队列结束的标记
+_END = object()
+
+# 解析进程里面使用的解析器和 HTML2Text 转换器
+_worker_parser = None
+_worker_converters = None
+
+
+def _init_worker(parser, text_maker_options):
+    global _worker_parser, _worker_converters
+    # parser 是注册过的解析器的名字，或者自定义的解析器类（在子进程里面创建）
+    _worker_parser = parser() if isinstance(parser, type) else get_parser(parser)
+    _worker_converters = ConverterPool(text_maker_options)
+
+
+def _parse_list_worker(content):
+    return _worker_parser.parse_list(content)
+
+
+def _parse_detail_worker(content):
+    return {'content': convert_detail(_worker_parser, _worker_converters, content)}
+
+
+class StageStats:
+    def __init__(self, name):
+        """
+        流水线一个阶段的统计
+        """
+        self.name = name
+        self.processed = 0
+        self.errors = 0
+        self.started = None
+        self._lock = threading.Lock()
+
+    def add(self, error=False):
+        with self._lock:
+            if self.started is None:
+                self.started = time.monotonic()
+            self.processed += 1
+            if error:
+                self.errors += 1
+
+    def per_second(self):
+        if self.started is None:
+            return 0.0
+        elapsed = time.monotonic() - self.started
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+
+class CrawlPipeline:
+    def __init__(self, spider, fetch_workers=4, parse_workers=None, queue_size=64, use_processes=True,
+                 report_interval=None, mp_context=None):
+        """
+        :param spider: BaseSpider
+        :param fetch_workers: 下载的线程数
+        :param parse_workers: 解析的进程数，None 表示 CPU 核心数
+        :param queue_size: 每个队列的最大长度
+        :param use_processes: 是否在进程池里面解析。子类重写了 parse_list、process_list_page 或者 parse_detail 的时候，
+          使用一个解析线程调用子类的方法
+        :param report_interval: 每隔多少秒使用 spider.log_function 输出一次统计，None 表示不输出
+        :param mp_context: 解析进程的启动方式（'fork'、'spawn'、'forkserver'），None 表示系统默认。
+          调用的程序里面有别的线程在运行的时候可以使用 'spawn' 或者 'forkserver'
+        """
+        self.spider = spider
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.use_processes = use_processes
+        self.report_interval = report_interval
+        self.mp_context = mp_context
+
+        self._parse_queue = None
+        self._sink_queue = None
+        self._in_flight = deque()
+        self._stop = threading.Event()
+        # 解析线程出错（比如进程池不能使用）时的异常，在 _run 里面重新抛出
+        self._error = None
+        self._fetch_stats = StageStats('fetch')
+        self._parse_stats = StageStats('parse')
+        self._sink_stats = StageStats('sink')
+
+    def _overridden(self, *names):
+        """
+        子类是否重写了 BaseSpider 的方法
+        """
+        return any(getattr(type(self.spider), name) is not getattr(BaseSpider, name) for name in names)
+
+    def _worker_parser_spec(self):
+        """
+        传给解析进程的解析器：注册过的解析器传名字，其他的解析器（比如 LxmlParser 的子类）传类，
+        在子进程里面不带参数创建
+        """
+        parser = self.spider.parser
+        if PARSERS.get(parser.name) is type(parser):
+            return parser.name
+        return type(parser)
+
+    def _executor(self, overridden):
+        if self.use_processes and not overridden:
+            executor = ProcessPoolExecutor(
+                max_workers=self.parse_workers,
+                mp_context=multiprocessing.get_context(self.mp_context),
+                initializer=_init_worker,
+                initargs=(self._worker_parser_spec(), self.spider.text_maker_options),
+            )
+            # 进程池在第一次 submit 的时候才创建子进程，fork 的时候如果下载线程已经在运行，
+            # 子进程可能复制到被别的线程持有的锁而卡住，所以在启动下载线程之前先创建好子进程
+            try:
+                executor.submit(os.getpid).result()
+            except BaseException:
+                executor.shutdown(wait=False)
+                raise
+            return executor, True
+        # 子类的方法在一个线程里面运行，和下载分开进行
+        return ThreadPoolExecutor(max_workers=1), False
+
+    def _put(self, q, item):
+        """
+        放入队列，队列满了的时候等待，停止以后返回 False
+        """
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        """
+        从队列取出，停止以后返回 _END
+        """
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _END
+
+    def _fetch_loop(self, jobs, jobs_lock, fetch, active, failed):
+        while not self._stop.is_set():
+            with jobs_lock:
+                job = next(jobs, _END)
+            if job is _END:
+                break
+            content = fetch(job)
+            self._fetch_stats.add(error=content is None)
+            if content is None:
+                if failed is not None:
+                    failed(job)
+            elif not self._put(self._parse_queue, (job, content)):
+                break
+        with jobs_lock:
+            active[0] -= 1
+            if active[0] == 0:
+                self._put(self._parse_queue, _END)
+
+    def _parse_loop(self, executor, parse, failed):
+        try:
+            self._parse_all(executor, parse, failed)
+        except BaseException as e:
+            # 比如 BrokenProcessPool，交给 _run 抛出，不能让调用者一直等待 _END
+            self._error = e
+            self._stop.set()
+        finally:
+            self._put(self._sink_queue, _END)
+
+    def _parse_all(self, executor, parse, failed):
+        in_flight = self._in_flight
+        max_in_flight = self.parse_workers * 2
+
+        def emit():
+            job, future = in_flight.popleft()
+            try:
+                result = future.result()
+            except Exception as e:
+                self._parse_stats.add(error=True)
+                self.spider.log_function(f'错误:{e}')
+                url = job.get('url') if isinstance(job, dict) else getattr(job, 'url', None)
+                self.spider.add_error(e, url=url, kind=f'Parse{type(e).__name__}')
+                if failed is not None:
+                    failed(job)
+                return True
+            self._parse_stats.add()
+            return self._put(self._sink_queue, (job, result))
+
+        while True:
+            item = self._get(self._parse_queue)
+            if item is _END:
+                break
+            job, content = item
+            in_flight.append((job, executor.submit(parse, content)))
+            while len(in_flight) >= max_in_flight or (in_flight and in_flight[0][1].done()):
+                if not emit():
+                    return
+        while in_flight:
+            if not emit():
+                return
+
+    def _run(self, jobs, fetch, executor, parse, failed=None):
+        """
+        运行流水线，返回 (任务, 解析结果)
+
+        :param failed: 下载失败或者解析出错时调用 failed(任务)
+        """
+        self._stop.clear()
+        self._error = None
+        self._parse_queue = queue.Queue(self.queue_size)
+        self._sink_queue = queue.Queue(self.queue_size)
+        self._in_flight.clear()
+        self._fetch_stats = StageStats('fetch')
+        self._parse_stats = StageStats('parse')
+        self._sink_stats = StageStats('sink')
+
+        jobs_lock = threading.Lock()
+        active = [self.fetch_workers]
+        jobs = iter(jobs)
+        threads = [threading.Thread(target=self._fetch_loop, args=(jobs, jobs_lock, fetch, active, failed),
+                                    daemon=True)
+                   for _ in range(self.fetch_workers)]
+        threads.append(threading.Thread(target=self._parse_loop, args=(executor, parse, failed), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        last_report = time.monotonic()
+        try:
+            while True:
+                item = self._get(self._sink_queue)
+                if item is _END:
+                    break
+                self._sink_stats.add()
+                yield item
+                if self.report_interval is not None and time.monotonic() - last_report >= self.report_interval:
+                    self.spider.log_function(self.format_stats())
+                    last_report = time.monotonic()
+            if self._error is not None:
+                raise self._error
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            executor.shutdown(wait=True)
+            if self.report_interval is not None:
+                self.spider.log_function(self.format_stats())
+
+    def crawl(self, overlay_file=False, pages=None, max_exist=3):
+        """
+        爬取列表页，返回列表页里面的详情数据
+
+        和 BaseSpider.crawl 一样使用 spider 的 frontier（跳过已经爬取的列表页和重复的详情页网址）、
+        seen_index，结束的时候写入 storage 和 errors
+
+        :param overlay_file: 如果文件已经存在是否重新下载
+        :param pages: PageContext 的可迭代对象，None 表示使用 spider.get_urls()
+        :param max_exist: spider 设置了 seen_index 的时候，连续遇到这么多个没有变化的数据就停止，见 BaseSpider.crawl
+        """
+        spider = self.spider
+        frontier = spider.frontier
+        exist_count = 0
+        executor, in_process = self._executor(self._overridden('parse_list', 'process_list_page'))
+        parse = _parse_list_worker if in_process else lambda content: list(self.spider.process_list_page(content))
+        completed = stopped = False
+        if frontier is not None:
+            pages = spider._frontier_pages(pages, restart=overlay_file)
+        elif pages is None:
+            pages = spider.get_urls()
+        failed = (lambda page: frontier.failed(page.url)) if frontier is not None else None
+        results = self._run(pages, lambda page: spider.fetch_page(page, overlay_file), executor, parse, failed)
+
+        try:
+            for page, data_list in results:
+                for data in data_list:
+                    if spider._detail_seen(data):
+                        continue
+                    if spider.is_unchanged(data):
+                        exist_count += 1
+                        continue
+                    exist_count = 0
+                    yield data
+                    spider._mark_detail(data)
+                if frontier is not None:
+                    frontier.done(page.url)
+                if not spider.is_update and max_exist is not None and exist_count >= max_exist:
+                    stopped = True
+                    break
+            completed = True
+        except GeneratorExit:
+            completed = True
+            raise
+        finally:
+            # 先停止下载线程，再把剩下的列表页标记为这次不需要爬取
+            results.close()
+            if frontier is not None and stopped:
+                frontier.skip_pending(LIST_QUEUE)
+            spider.storage.flush()
+            spider.errors.flush()
+            if spider.seen_index is not None:
+                spider.seen_index.checkpoint()
+            if frontier is not None and completed:
+                frontier.checkpoint()
+
+    def _fetch_detail(self, item):
+        try:
+            return self.spider.get(item['url']).content
+        except Exception as e:
+            self.spider.log_function(f'错误:{e}')
+            self.spider.add_error(e, url=item['url'])
+            return None
+
+    def crawl_details(self, items):
+        """
+        爬取详情页，返回合并了 parse_detail 结果的数据
+
+        :param items: 带有 url 的字典的可迭代对象，比如 crawl 的结果。spider 设置了 seen_index 的时候记录详情内容的指纹
+        """
+        seen_index = self.spider.seen_index
+        executor, in_process = self._executor(self._overridden('parse_detail'))
+        parse = _parse_detail_worker if in_process else self.spider.parse_detail
+
+        try:
+            for item, data in self._run(items, self._fetch_detail, executor, parse):
+                if seen_index is not None:
+                    seen_index.record_detail(item['url'], content_hash(data))
+                yield dict(item, **data)
+        finally:
+            self.spider.errors.flush()
+            if seen_index is not None:
+                seen_index.checkpoint()
+
+    def stats(self):
+        """
+        每个阶段的统计
+
+        queue 是等待这个阶段处理的数量（下载阶段没有队列，为 None），processed 是已经处理的数量，per_second 是每秒处理的数量
+
+        :return: Dict(阶段 -> Dict(queue, processed, errors, per_second))
+        """
+        queues = {
+            'fetch': None,
+            'parse': (self._parse_queue.qsize() if self._parse_queue else 0) + len(self._in_flight),
+            'sink': self._sink_queue.qsize() if self._sink_queue else 0,
+        }
+        return {
+            stage.name: {
+                'queue': queues[stage.name],
+                'processed': stage.processed,
+                'errors': stage.errors,
+                'per_second': round(stage.per_second(), 2),
+            }
+            for stage in (self._fetch_stats, self._parse_stats, self._sink_stats)
+        }
+
+    def format_stats(self):
+        return '  '.join(
+            f'{name}: 队列 {stats["queue"]} 已处理 {stats["processed"]} 错误 {stats["errors"]} {stats["per_second"]}/秒'
+            for name, stats in self.stats().items()
+        )
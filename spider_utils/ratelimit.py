@@ -0,0 +1,118 @@
+"""
+按主机限速（令牌桶），用来代替 random_sleep
+
+每个主机一个令牌桶，只有访问同一个主机的请求才需要排队等待，访问其他主机的请求不受影响。
+
+例子：
+from spider_utils.client import BaseSpiderClient
+from spider_utils.ratelimit import RateLimiter
+
+# 每个主机每秒 2 个请求，允许突发 5 个，每次额外随机延迟 0~0.5 秒
+limiter = RateLimiter(rate=2, burst=5, jitter=0.5)
+# 单独设置某个主机的速度
+limiter.set_host_rate('www.example.com', rate=0.5, burst=1)
+client = BaseSpiderClient(rate_limiter=limiter)
+"""
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+
+
+# 不写在主机里面的默认端口
+DEFAULT_PORTS = {'http': ':80', 'https': ':443'}
+
+
+def get_host(url):
+    """
+    获取网址的主机（包括端口），如果传入的已经是主机就直接返回
+
+    主机转换为小写，去掉用户名、密码和默认端口，所以 http://User@Example.com:80/ 的主机是 example.com
+    """
+    if '://' not in url:
+        return url
+    parts = urlsplit(url)
+    host = parts.netloc.rpartition('@')[2].lower()
+    default_port = DEFAULT_PORTS.get(parts.scheme)
+    if default_port is not None and host.endswith(default_port):
+        host = host[:-len(default_port)]
+    return host
+
+
+class RateLimiter:
+    def __init__(self, rate=1.0, burst=1, jitter=0.0):
+        """
+        线程安全的按主机限速器
+
+        :param rate: 每个主机每秒允许的请求数
+        :param burst: 每个主机允许突发的请求数（令牌桶容量）
+        :param jitter: 每次请求额外随机延迟的最大秒数，0 表示不添加
+        """
+        if rate <= 0:
+            raise ValueError('rate 必须大于 0')
+        self.rate = rate
+        self.burst = burst
+        self.jitter = jitter
+        self._host_rates = {}
+        # host -> [剩余令牌数, 上次更新时间]
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def set_host_rate(self, host, rate, burst=1):
+        """
+        单独设置某个主机的速度
+        """
+        if rate <= 0:
+            raise ValueError('rate 必须大于 0')
+        with self._lock:
+            self._host_rates[get_host(host)] = (rate, burst)
+
+    def reserve(self, url):
+        """
+        预订一个令牌，返回需要等待的秒数
+
+        令牌不够的时候允许欠账（令牌数变成负数），这样每个请求只需要在锁里面算出自己的等待时间，
+        等待的时候不占用锁，其他主机的请求可以继续进行。
+        """
+        host = get_host(url)
+        now = time.monotonic()
+        with self._lock:
+            rate, burst = self._host_rates.get(host, (self.rate, self.burst))
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = [burst, now]
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate) - 1
+            bucket[0] = tokens
+            bucket[1] = now
+
+        delay = -tokens / rate if tokens < 0 else 0.0
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        return delay
+
+    def wait(self, url):
+        """
+        等待到可以访问这个主机，返回等待的秒数
+        """
+        delay = self.reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class AsyncRateLimiter(RateLimiter):
+    """
+    asyncio 版本的按主机限速器，等待的时候不阻塞事件循环
+    """
+
+    async def wait(self, url):
+        """
+        等待到可以访问这个主机，返回等待的秒数
+        """
+        # 事件循环运行的时候 asyncio 已经导入，这里导入不需要时间，同步使用的时候不用加载 asyncio
+        import asyncio
+
+        delay = self.reserve(url)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
@@ -0,0 +1,239 @@
+"""
+有界的错误和信息记录
+
+BaseSpiderClient.errors 和 infos 是 RecordBuffer：只保留最近的 maxlen 条记录（环形缓冲区），
+另外按异常类型和主机累计数量，所以长时间爬取的时候占用的内存不会增加，也可以随时查看错误率。
+设置了 spill_path 的时候，被挤出去的旧记录追加写入这个文件（每行一个 JSON），maxlen=0 表示不保留、全部写入文件。
+按主机的计数最多 max_hosts 个主机，之后出现的新主机都计入 OTHER_HOSTS。
+
+RecordBuffer 的用法和列表一样（append、len、迭代、下标、切片），每条记录是 Record，str(record) 是错误信息。
+
+例子：
+client = BaseSpiderClient(max_errors=500, error_log='logs/errors.jsonl')
+...
+print(client.errors.stats())  # {'total': 1234, 'retained': 500, 'spilled': 734, 'by_kind': {...}, 'by_host': {...}}
+print(client.errors.rate(60))  # 最近 60 秒每秒的错误数
+for record in client.errors[-10:]:
+    print(record.time, record.host, record.kind, record.message)
+"""
+import os
+import json
+import time
+import threading
+from collections import deque, Counter
+from urllib.parse import urlsplit
+
+# 错误信息最多保存的字符数
+MAX_MESSAGE = 500
+# by_host 里面超过 max_hosts 以后的主机合并计数的键
+OTHER_HOSTS = '<other>'
+
+
+class Record:
+    __slots__ = ('time', 'url', 'host', 'kind', 'message', 'attempt')
+
+    def __init__(self, message, url=None, kind=None, attempt=None, time_=None):
+        self.time = time.time() if time_ is None else time_
+        self.url = url
+        self.host = urlsplit(url).netloc if url else None
+        self.kind = kind
+        self.message = message
+        self.attempt = attempt
+
+    def __str__(self):
+        return self.message
+
+    def __repr__(self):
+        return f'<Record {self.kind} {self.url} {self.message!r}>'
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def make_record(value, url=None, kind=None, attempt=None):
+    """
+    把字符串或者异常转换为 Record
+
+    异常的 kind 是异常的类名，没有传入 url 的时候使用 requests 异常里面的网址
+    """
+    if isinstance(value, Record):
+        return value
+    if isinstance(value, BaseException):
+        if url is None:
+            url = getattr(getattr(value, 'request', None), 'url', None)
+        kind = kind or type(value).__name__
+        message = str(value) or type(value).__name__
+    else:
+        message = str(value)
+    return Record(message[:MAX_MESSAGE], url=url, kind=kind, attempt=attempt)
+
+
+class RecordBuffer:
+    def __init__(self, maxlen=1000, spill_path=None, rate_window=3600, max_hosts=1000):
+        """
+        :param maxlen: 最多保留的记录数，None 表示不限制，0 表示不保留
+        :param spill_path: 保存被挤出去的记录的文件（JSONL），None 表示直接丢掉
+        :param rate_window: rate 最多可以计算多少秒
+        :param max_hosts: by_host 最多单独计数的主机数，None 表示不限制
+        """
+        if maxlen is not None and maxlen < 0:
+            raise ValueError('maxlen must be None or >= 0')
+        self.maxlen = maxlen
+        self.max_hosts = max_hosts
+        self.spill_path = spill_path
+        self.total = 0
+        self.spilled = 0
+        self._records = deque(maxlen=maxlen)
+        self._by_kind = Counter()
+        self._by_host = Counter()
+        # 每秒的数量 [秒, 数量]
+        self._seconds = deque(maxlen=rate_window)
+        self._spill_file = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_spill_file'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def append(self, value, url=None, kind=None, attempt=None):
+        """
+        添加记录
+
+        :param value: 字符串、异常或者 Record
+        :param url: 出错的网址
+        :param kind: 记录的类型，None 的时候异常使用异常的类名
+        :param attempt: 第几次请求
+        :return: Record
+        """
+        record = make_record(value, url=url, kind=kind, attempt=attempt)
+        second = int(record.time)
+        with self._lock:
+            if self.maxlen == 0:
+                self._spill(record)
+            else:
+                if self.maxlen is not None and len(self._records) == self.maxlen:
+                    self._spill(self._records[0])
+                self._records.append(record)
+            self.total += 1
+            self._by_kind[record.kind] += 1
+            if record.host:
+                host = record.host
+                if (self.max_hosts is not None and host not in self._by_host
+                        and len(self._by_host) >= self.max_hosts):
+                    host = OTHER_HOSTS
+                self._by_host[host] += 1
+            if self._seconds and self._seconds[-1][0] == second:
+                self._seconds[-1][1] += 1
+            else:
+                self._seconds.append([second, 1])
+        return record
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def _spill(self, record):
+        self.spilled += 1
+        if self.spill_path is None:
+            return
+        if self._spill_file is None:
+            directory = os.path.dirname(str(self.spill_path))
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._spill_file = open(self.spill_path, 'a', encoding='utf-8')
+        self._spill_file.write(json.dumps(record.to_dict(), ensure_ascii=False) + '\n')
+
+    def flush(self):
+        """
+        把被挤出去的记录写入文件
+        """
+        with self._lock:
+            if self._spill_file is not None:
+                self._spill_file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+
+    def clear(self):
+        """
+        清空保留的记录和统计
+        """
+        with self._lock:
+            self._records.clear()
+            self._by_kind.clear()
+            self._by_host.clear()
+            self._seconds.clear()
+            self.total = 0
+            self.spilled = 0
+
+    def since(self, total):
+        """
+        之前记下的 self.total 以后添加的、还保留着的记录
+
+        :param total: 之前的 self.total
+        """
+        with self._lock:
+            count = min(self.total - total, len(self._records))
+            return list(self._records)[len(self._records) - count:] if count > 0 else []
+
+    def __len__(self):
+        return len(self._records)
+
+    def __bool__(self):
+        return bool(self._records)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._records))
+
+    def __getitem__(self, index):
+        with self._lock:
+            if isinstance(index, slice):
+                return list(self._records)[index]
+            return self._records[index]
+
+    def __repr__(self):
+        return f'<RecordBuffer total={self.total} retained={len(self._records)}>'
+
+    def by_kind(self):
+        with self._lock:
+            return dict(self._by_kind)
+
+    def by_host(self):
+        with self._lock:
+            return dict(self._by_host)
+
+    def rate(self, seconds=60):
+        """
+        最近 seconds 秒每秒的记录数
+        """
+        start = int(time.time()) - seconds
+        with self._lock:
+            count = 0
+            for second, number in reversed(self._seconds):
+                if second <= start:
+                    break
+                count += number
+        return count / seconds
+
+    def stats(self):
+        """
+        :return: Dict(total, retained, spilled, by_kind, by_host)
+        """
+        with self._lock:
+            return {
+                'total': self.total,
+                'retained': len(self._records),
+                'spilled': self.spilled,
+                'by_kind': dict(self._by_kind),
+                'by_host': dict(self._by_host),
+            }
@@ -0,0 +1,316 @@
+"""
+统一的重试策略：Retry-After、去相关抖动（decorrelated jitter）的退避时间、按主机的重试预算和熔断
+
+BaseSpiderClient、requests_retry_session 和 download 的共用会话都使用 RetryPolicy，
+重试在 urllib3 里面进行（RetryPolicy.retry() 返回绑定了策略的 urllib3 Retry），
+PoolAdapter 发送请求之前检查熔断，所以一个主机出问题的时候：
+
+1. 这个主机的重试次数受到预算限制（令牌桶），不会每个线程都把所有重试用完
+2. 连续失败 failure_threshold 次以后熔断，reset_timeout 秒内的请求直接抛出 CircuitOpenError，不再发送
+3. 时间到了以后放一个请求试探（半开），成功就恢复，失败就再熔断（时间加倍，最多 max_reset_timeout）
+4. 返回的 Retry-After 超过 max_retry_after 的时候不在线程里面等待，直接让这个主机暂停 Retry-After 秒
+
+其他主机不受影响。
+
+例子：
+from spider_utils.retry import RetryPolicy
+
+policy = RetryPolicy(total=5, failure_threshold=10, reset_timeout=60)
+client = BaseSpiderClient(retry_policy=policy)
+...
+print(policy.stats())
+"""
+import time
+import random
+import threading
+
+from requests.exceptions import ConnectionError
+from urllib3.util.retry import Retry
+from urllib3.exceptions import MaxRetryError, ResponseError, ProxyError
+
+from .ratelimit import get_host  # noqa
+
+# 熔断器的状态
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# 默认重试的状态码，不包括 403（被禁止的时候重试只会更糟）
+STATUS_FORCELIST = (408, 429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(ConnectionError):
+    """
+    主机已经熔断，请求没有发送
+    """
+
+
+def _request_host(url, pool):
+    """
+    请求的目标主机，和 PoolAdapter.send 一样使用 get_host
+
+    通过 HTTP 代理请求的时候 pool 是代理的连接池，url 是完整的网址，所以先使用 url 的主机；
+    直接请求（包括 HTTPS 代理的隧道）的时候 url 只有路径，使用连接池的主机
+    """
+    if url and '://' in url:
+        return get_host(url)
+    if pool is None:
+        return None
+    host = f'[{pool.host}]' if ':' in pool.host else pool.host
+    return get_host(f'{pool.scheme}://{host}' if pool.port is None else f'{pool.scheme}://{host}:{pool.port}')
+
+
+class _HostState:
+    __slots__ = ('tokens', 'updated', 'state', 'failures', 'opened_at', 'open_for', 'trial', 'retries', 'rejected')
+
+    def __init__(self, burst):
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.open_for = 0.0
+        self.trial = False
+        self.retries = 0
+        self.rejected = 0
+
+
+class RetryPolicy:
+    def __init__(self, total=3, backoff_factor=0.3, max_backoff=30.0, status_forcelist=STATUS_FORCELIST,
+                 respect_retry_after=True, max_retry_after=60.0, retry_budget=1.0, retry_burst=10,
+                 failure_threshold=5, reset_timeout=30.0, max_reset_timeout=600.0):
+        """
+        :param total: 每个请求最多重试的次数
+        :param backoff_factor: 退避时间的基数（秒），每次重试等待 [backoff_factor, 上次等待时间 * 3] 之间的随机时间
+        :param max_backoff: 最长的退避时间（秒）
+        :param status_forcelist: 需要重试的状态码
+        :param respect_retry_after: 是否按照响应的 Retry-After 等待
+        :param max_retry_after: Retry-After 超过这个秒数的时候不等待，让这个主机暂停
+        :param retry_budget: 每个主机每秒增加的重试次数（重试预算），None 表示不限制
+        :param retry_burst: 每个主机最多累积的重试次数
+        :param failure_threshold: 连续失败多少次以后熔断，None 表示不熔断
+        :param reset_timeout: 熔断的秒数
+        :param max_reset_timeout: 多次熔断的时候最长的熔断秒数
+        """
+        self.total = total
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.status_forcelist = frozenset(status_forcelist)
+        self.respect_retry_after = respect_retry_after
+        self.max_retry_after = max_retry_after
+        self.retry_budget = retry_budget
+        self.retry_burst = retry_burst
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _host(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState(self.retry_burst)
+        return state
+
+    def retry(self, **kwargs):
+        """
+        绑定了这个策略的 urllib3 Retry，可以传给 HTTPAdapter 的 max_retries
+
+        :param kwargs: Retry 的其他参数
+        """
+        kwargs.setdefault('total', self.total)
+        kwargs.setdefault('backoff_factor', self.backoff_factor)
+        kwargs.setdefault('status_forcelist', self.status_forcelist)
+        kwargs.setdefault('respect_retry_after_header', self.respect_retry_after)
+        return PolicyRetry(policy=self, **kwargs)
+
+    def backoff(self, previous=None):
+        """
+        去相关抖动的退避时间：在 [backoff_factor, previous * 3] 之间随机，不超过 max_backoff
+
+        :param previous: 上次的退避时间，None 表示第一次重试
+        """
+        base = self.backoff_factor
+        if base <= 0:
+            return 0.0
+        return min(self.max_backoff, random.uniform(base, max(previous or base, base) * 3))
+
+    def before_request(self, host):
+        """
+        发送请求之前检查熔断，熔断的时候抛出 CircuitOpenError
+        """
+        if self.failure_threshold is None:
+            return
+        with self._lock:
+            state = self._host(host)
+            if state.state == CLOSED:
+                return
+            now = time.monotonic()
+            remaining = state.opened_at + state.open_for - now
+            if state.state == OPEN and remaining <= 0:
+                state.state = HALF_OPEN
+                state.trial = False
+            if state.state == HALF_OPEN and not state.trial:
+                # 只放一个请求试探
+                state.trial = True
+                return
+            state.rejected += 1
+        raise CircuitOpenError(f'{host} 已经熔断，{max(remaining, 0):.1f} 秒后重试')
+
+    def record_success(self, host):
+        with self._lock:
+            state = self._host(host)
+            state.failures = 0
+            if state.state != CLOSED:
+                state.state = CLOSED
+                state.open_for = 0.0
+                state.trial = False
+
+    def record_failure(self, host):
+        """
+        记录一次失败（包括每次重试），连续失败达到 failure_threshold 的时候熔断
+        """
+        with self._lock:
+            state = self._host(host)
+            state.failures += 1
+            if self.failure_threshold is None:
+                return
+            if state.state == HALF_OPEN:
+                # 试探失败，熔断时间加倍
+                self._open(state, min(max(state.open_for, self.reset_timeout) * 2, self.max_reset_timeout))
+            elif state.state == CLOSED and state.failures >= self.failure_threshold:
+                self._open(state, self.reset_timeout)
+
+    def release_trial(self, host):
+        """
+        半开状态试探的请求没有结果（比如请求抛出了异常但是没有记录失败），让下一个请求再试探，
+        否则这个主机会一直停在半开状态
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is not None and state.state == HALF_OPEN:
+                state.trial = False
+
+    def _open(self, state, seconds):
+        state.state = OPEN
+        state.opened_at = time.monotonic()
+        state.open_for = seconds
+        state.trial = False
+
+    def pause(self, host, seconds):
+        """
+        让这个主机暂停 seconds 秒（比如 Retry-After 很长的时候），期间的请求抛出 CircuitOpenError
+        """
+        with self._lock:
+            state = self._host(host)
+            remaining = state.opened_at + state.open_for - time.monotonic() if state.state == OPEN else 0
+            if seconds > remaining:
+                self._open(state, seconds)
+
+    def is_open(self, host):
+        """
+        这个主机是否熔断（不包括可以试探的半开状态）
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            return (state is not None and state.state == OPEN
+                    and time.monotonic() < state.opened_at + state.open_for)
+
+    def consume_retry(self, host):
+        """
+        使用一次这个主机的重试预算，没有预算的时候返回 False
+        """
+        with self._lock:
+            state = self._host(host)
+            if self.retry_budget is not None:
+                now = time.monotonic()
+                state.tokens = min(self.retry_burst, state.tokens + (now - state.updated) * self.retry_budget)
+                state.updated = now
+                if state.tokens < 1:
+                    return False
+                state.tokens -= 1
+            state.retries += 1
+            return True
+
+    def stats(self):
+        """
+        每个主机的状态
+
+        :return: Dict(主机 -> Dict(state, failures, retries, rejected))
+        """
+        with self._lock:
+            return {
+                host: {
+                    'state': state.state,
+                    'failures': state.failures,
+                    'retries': state.retries,
+                    'rejected': state.rejected,
+                }
+                for host, state in self._hosts.items()
+            }
+
+
+class PolicyRetry(Retry):
+    """
+    使用 RetryPolicy 的 urllib3 Retry：退避时间使用去相关抖动，重试之前检查主机的预算和熔断
+    """
+
+    def __init__(self, *args, policy=None, previous_backoff=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.policy = policy
+        self.previous_backoff = previous_backoff
+
+    def new(self, **kw):
+        retry = super().new(**kw)
+        retry.policy = self.policy
+        retry.previous_backoff = self.previous_backoff
+        return retry
+
+    def get_backoff_time(self):
+        if self.policy is None:
+            return super().get_backoff_time()
+        return self.previous_backoff or 0.0
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        policy = self.policy
+        host = _request_host(url, _pool)
+        if policy is None or host is None or (response is not None and response.get_redirect_location()):
+            return super().increment(method, url, response, error, _pool, _stacktrace)
+
+        if isinstance(error, ProxyError):
+            # 代理出错不是主机的问题，不算主机的失败，但是半开状态的试探没有结果，换代理以后再试探
+            policy.release_trial(host)
+        else:
+            policy.record_failure(host)
+        reason = error or ResponseError(f'状态码 {response.status if response is not None else None}')
+
+        retry_after = self.get_retry_after(response) if response is not None and self.respect_retry_after_header \
+            else None
+        if retry_after is not None and retry_after > policy.max_retry_after:
+            # 不在线程里面等这么久，这个主机暂停，其他主机继续
+            policy.pause(host, retry_after)
+            raise MaxRetryError(_pool, url, reason)
+
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        if policy.is_open(host) or not policy.consume_retry(host):
+            raise MaxRetryError(_pool, url, reason)
+        retry.previous_backoff = policy.backoff(self.previous_backoff)
+        return retry
+
+
+def session_policy(session, url):
+    """
+    会话里面处理这个网址的 HTTPAdapter 使用的 RetryPolicy，没有的时候返回 None
+    """
+    adapter = session.get_adapter(url)
+    return getattr(getattr(adapter, 'max_retries', None), 'policy', None)
@@ -1,18 +1,25 @@
 import re
 from pathlib import Path
-from datetime import datetime
-from collections import namedtuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
 from requests.exceptions import RequestException
-import html2text
-from bs4 import BeautifulSoup
 
 from .client import BaseSpiderClient  # , logger
+from .adapters import PoolAdapter
+from .retry import RetryPolicy
+from .parsers import get_parser
+from .storage import FileStorage
+from .metrics import Timer, timed_iter
+from .incremental import UNCHANGED, content_hash
+from .urlgen import PageContext, PageRange
+from .converter import ConverterPool, convert_detail, make_text_maker  # noqa
+from .frontier import PENDING, IN_PROGRESS, DONE, FAILED
 
-PageContext = namedtuple('PageContext', ['name', 'page', 'url', ])
+# frontier 里面列表页和详情页的队列名字
+LIST_QUEUE = 'list'
+DETAIL_QUEUE = 'detail'
 
 
 def get_response(url, params=None, **kwargs):
@@ -36,7 +43,11 @@ def requests_retry_session(
         retries=3,
         backoff_factor=0.3,
         status_forcelist=(500, 502, 504),
-        session=None, ):
+        session=None,
+        pool_connections=10,
+        pool_maxsize=10,
+        pool_block=False,
+        retry_policy=None, ):
     """
     长链接会话，支持重试
 
@@ -67,17 +78,21 @@ def requests_retry_session(
     :param backoff_factor:
     :param status_forcelist:
     :param session:
+    :param pool_connections: 保留连接池的主机数量
+    :param pool_maxsize: 每个主机最多保留的连接数，多个线程共用会话的时候设置为线程数
+    :param pool_block: 连接池用完的时候是否等待空闲连接
+    :param retry_policy: 重试策略 RetryPolicy，None 表示使用 retries、backoff_factor、status_forcelist 创建
     :return:
     """
     session = session or requests.Session()
-    retry = Retry(
-        total=retries,  # 允许的重试总次数，优先于其他计数
+    if retry_policy is None:
+        retry_policy = RetryPolicy(total=retries, backoff_factor=backoff_factor, status_forcelist=status_forcelist)
+    retry = retry_policy.retry(
         read=retries,  # 重试读取错误的次数
         connect=retries,
-        backoff_factor=backoff_factor,  # 休眠时间： {backoff_factor} * (2 ** ({重试总次数} - 1))
-        status_forcelist=status_forcelist,  # 强制重试的状态码
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = PoolAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry,
+                          pool_block=pool_block)
     session.mount('http://', adapter)
     session.mount('https://', adapter)
     return session
@@ -107,12 +122,54 @@ def get_response_to_file(url, file_name=None, params=None, **kwargs):
 
 
 class BaseSpider(BaseSpiderClient):
+    # HTML2Text 的设置
+    text_maker_options = {
+        'body_width': 0,
+        # 'ignore_links': True,  # 忽略链接
+        # 'kypass_tables': False,  # 循环表
+        'kypass_tables': True,
+    }
+    # 计算列表页数据指纹使用的字段，None 表示所有字段。列表页里面有阅读数之类经常变化的字段时，只使用标题、更新时间等字段
+    fingerprint_fields = None
 
     def __init__(self, base_url, start_page=1, page_max=100, name='', save_dir=Path('cache'), is_update=False,
                  log_function=print, wx_thread=None, debug=False,
                  retry=None,
-                 retries=None):
-        super().__init__(retry, retries)
+                 retries=None,
+                 rate_limiter=None,
+                 cache=None,
+                 frontier=None,
+                 parser='bs4',
+                 storage=None,
+                 pool_maxsize=10,
+                 metrics=None,
+                 retry_policy=None,
+                 concurrency=None,
+                 seen_index=None,
+                 proxy_pool=None,
+                 max_errors=1000,
+                 error_log=None):
+        """
+        :param rate_limiter: 按主机限速的 RateLimiter
+        :param cache: 响应缓存 ResponseCache
+        :param frontier: 保存爬取进度的 Frontier，程序中断以后再运行不再爬取这次已经爬取的列表页，
+          已经返回并且被处理的详情页网址不再返回（见 crawl）
+        :param parser: 解析器的名字（bs4、lxml、selectolax）或者 BaseParser 对象
+        :param storage: 保存列表页的 FileStorage 或者 SegmentStorage，None 表示每个列表页保存为 save_dir 里面的一个文件
+        :param pool_maxsize: 每个主机最多保留的连接数，crawl 的 workers 大于 10 的时候设置为 workers
+        :param metrics: 记录请求和解析统计的 Metrics，None 表示不记录
+        :param retry_policy: 重试策略 RetryPolicy，见 BaseSpiderClient
+        :param concurrency: 按主机自动调整同时请求数的 AIMDController，设置以后 crawl 的线程数使用 concurrency.ceiling
+        :param is_update: 是否是更新所有内容，True 的时候 crawl 爬取所有列表页，不因为连续遇到已经爬取过的数据而停止
+        :param proxy_pool: 代理池 ProxyPool，见 BaseSpiderClient
+        :param max_errors: errors 最多保留的错误数，见 BaseSpiderClient
+        :param error_log: 保存超出 max_errors 的旧错误的文件（JSONL），None 表示丢掉
+        :param seen_index: 增量爬取使用的 SeenIndex，设置以后 crawl 只返回新的和列表页数据变化了的数据，
+          连续 max_exist 个没有变化的数据以后不再爬取后面的列表页
+        """
+        super().__init__(retry, retries, rate_limiter=rate_limiter, cache=cache, pool_maxsize=pool_maxsize,
+                         metrics=metrics, retry_policy=retry_policy, concurrency=concurrency,
+                         proxy_pool=proxy_pool, max_errors=max_errors, error_log=error_log)
         self.name = name
         self.base_url = base_url
         self.page_url = '{base_url}/page/{page}/'
@@ -121,86 +178,153 @@ class BaseSpider(BaseSpiderClient):
         self.start_page = start_page
         self.page_max = page_max
         self.is_update = is_update
+        self.frontier = frontier
+        self.seen_index = seen_index
+        self.parser = get_parser(parser)
 
         self.log_function = log_function
         self.wx_thread = wx_thread
         self.debug = debug
-        self.infos = []
-        self.errors = []
 
-        text_maker = html2text.HTML2Text()
-        text_maker.body_width = 0
-        # text_maker.ignore_links = True # 忽略链接
-        # text_maker.kypass_tables = False # 循环表
-        text_maker.kypass_tables = True
-        self.text_maker = text_maker
+        # 每个线程的 HTML2Text 在第一次使用的时候再创建，不需要解析详情页的时候不用加载 html2text
+        self.converters = ConverterPool(self.text_maker_options)
+        self._text_maker = None
 
         if not self.save_dir.exists():
             self.save_dir.mkdir()
 
-    def get_urls(self):
+        self.storage = FileStorage(self.save_dir) if storage is None else storage
+
+    @property
+    def text_maker(self):
         """
-        获取需要爬取的 url
+        HTML 转换为 Markdown 的 HTML2Text，没有设置的时候是当前线程的 HTML2Text（见 converters）
         """
-        if self.start_page == 1 and self.start_url:
-            self.start_page += 1
-            yield PageContext(name=self.name, page=1, url=self.start_url.format(base_url=self.base_url))
-        for i in range(self.start_page, self.page_max + 1):
-            # print('next_page', i)
-            yield PageContext(name=self.name, page=i, url=self.page_url.format(base_url=self.base_url, page=i))
+        if self._text_maker is None:
+            return self.converters.get()
+        return self._text_maker
 
-    def parse_list(self, content):
+    @text_maker.setter
+    def text_maker(self, text_maker):
+        self._text_maker = text_maker
+
+    def page_range(self):
         """
-        解析网页内容
+        列表页的 PageRange（start_page 到 page_max，第 1 页使用 start_url），可以切片、分片
         """
-        soup = BeautifulSoup(content, 'lxml')
-        article_list = soup.find_all('article', class_='post')
-        data_list = []
+        return PageRange(self.page_url, start=self.start_page, end=self.page_max, name=self.name,
+                         first_url=self.start_url, base_url=self.base_url)
 
-        for article in article_list:
-            # print(article)
-            title = article.h2.text
-            url = article.h2.a.get('href')
+    def get_urls(self, offset=0, shard=None):
+        """
+        获取需要爬取的 url
 
-            data = {
-                'title': title,
-                'url': url,
-            }
-            # print(data)
-            data_list.append(data)
+        :param offset: 跳过前面 offset 个列表页，用来从上次中断的地方继续
+        :param shard: (k, n) 表示只生成分成 n 份的第 k 份
+        """
+        pages = self.page_range()
+        if shard is not None:
+            pages = pages.shard(*shard)
+        return pages.iter_from(offset)
 
-        return data_list
+    def parse_list(self, content):
+        """
+        解析网页内容
+        """
+        return self.parser.parse_list(content)
 
     def parse_detail(self, content):
         """
         解析网页内容
+
+        使用每个线程自己的 HTML2Text（可以在多个线程里面同时调用），lxml 解析器直接转换正文的元素
         """
-        soup = BeautifulSoup(content, 'lxml')
-        article = soup.find('div', class_='entry-content')
         data = {}
-        # html = soup.prettify("utf-8")
-        # print(type(html), html)
-        # print(article)
-        # print(article.p)
 
-        md_content = self.text_maker.handle(article.prettify("utf-8").decode(encoding="utf-8"))
+        with Timer(self.metrics, 'parse_seconds', stage='detail'):
+            if self._text_maker is None:
+                md_content = convert_detail(self.parser, self.converters, content)
+            else:
+                # 设置了 text_maker 的时候和以前一样使用这个 HTML2Text
+                md_content = self._text_maker.handle(self.parser.detail_html(content) or '')
 
         data['content'] = md_content
 
         return data
 
+    def pipeline(self, **kwargs):
+        """
+        创建下载、解析、输出分开进行的 CrawlPipeline，参数见 CrawlPipeline
+        """
+        from .pipeline import CrawlPipeline
+        return CrawlPipeline(self, **kwargs)
+
+    def list_fingerprint(self, data):
+        """
+        列表页数据的指纹，用来判断详情是否需要重新爬取
+        """
+        if self.fingerprint_fields is not None:
+            data = {key: data.get(key) for key in self.fingerprint_fields}
+        return content_hash(data)
+
+    def is_unchanged(self, data):
+        """
+        检查列表页数据并记录到 seen_index，已经爬取过并且没有变化的时候返回 True
+        """
+        if self.seen_index is None or not data.get('url'):
+            return False
+        status = self.seen_index.check(data['url'], self.list_fingerprint(data))
+        if self.metrics is not None:
+            self.metrics.inc('crawl_items_total', status=status)
+        return status == UNCHANGED
+
     def update_detail(self, objs, update_associated_data=False, ):
         """
         更新详情，一般是用用更新导入以后的内容
 
-        :param objs:
-        :param update_associated_data: 更新关联数据
-        :return:
+        重新下载并解析每个对象的详情页，设置了 seen_index 的时候详情内容没有变化的对象不再更新
+
+        :param objs: 带有 url 的字典或者对象
+        :param update_associated_data: 更新关联数据，传给 save_detail
+        :return: 更新的信息
         """
         infos = []
 
+        for obj in objs:
+            url = obj.get('url') if isinstance(obj, dict) else getattr(obj, 'url', None)
+            if not url:
+                continue
+            try:
+                data = self.parse_detail(self.get(url).content)
+            except Exception as e:
+                self.log_function(f'错误:{url} {e}')
+                self.add_error(e, url=url)
+                continue
+            if self.seen_index is not None and not self.seen_index.record_detail(url, content_hash(data)):
+                continue
+            self.save_detail(obj, data, update_associated_data)
+            info = f'更新:{url}'
+            self.add_info(info)
+            infos.append(info)
+
+        if self.seen_index is not None:
+            self.seen_index.checkpoint()
         return infos
 
+    def save_detail(self, obj, data, update_associated_data=False):
+        """
+        把 parse_detail 的结果保存到对象，子类可以重写这个方法保存到数据库或者更新关联数据
+
+        :param obj: update_detail 的对象
+        :param data: parse_detail 的结果
+        :param update_associated_data: 更新关联数据
+        """
+        if isinstance(obj, dict):
+            obj.update(data)
+        else:
+            for key, value in data.items():
+                setattr(obj, key, value)
+
     def process_list_page(self, content):
         """
         采集详情页
@@ -209,36 +333,180 @@ class BaseSpider(BaseSpiderClient):
         for data in data_list:
             yield data
 
-    def crawl(self, overlay_file=False, max_exist=3):
+    def fetch_page(self, page, overlay_file=False):
+        """
+        下载列表页并保存到 storage
+
+        :param page: PageContext
+        :param overlay_file: 如果已经保存过是否重新下载
+        :return: 网页内容，已经保存过或者下载失败返回 None
+        """
+        self.log_function(page.url)
+        if not overlay_file and self.storage.exists(page.url):
+            if self.metrics is not None:
+                self.metrics.inc('crawl_pages_total', status='skipped')
+            return None
+        try:
+            r = self.get(page.url)
+            self.storage.put(page.url, r.content, page=page)
+        except Exception as e:
+            self.log_function(f'错误:{e}')
+            self.add_error(e, url=page.url)
+            if self.metrics is not None:
+                self.metrics.inc('crawl_pages_total', status='error')
+            return None
+        if self.metrics is not None:
+            self.metrics.inc('crawl_pages_total', status='ok')
+        return r.content
+
+    def crawl(self, overlay_file=False, max_exist=3, workers=1, ordered=True, pages=None):
         """
         爬取内容
 
         1. 爬取列表内容
         2. 解析列表内容中的详情内容
         3. 添加内容到数据库
-        :param overlay_file: 如果文件已经存在是否重新下载
-        :param max_exist: 超过最大数量就退出爬取
+        :param overlay_file: 如果已经保存过是否重新下载
+        :param max_exist: 设置了 seen_index 的时候，连续遇到这么多个已经爬取过并且没有变化的数据就不再爬取后面的列表页，
+          None 表示不停止。is_update 为 True 的时候不停止
+        :param workers: 同时下载列表页的线程数，大于 1 时下载和解析同时进行。设置了 concurrency 的时候线程数最少为
+          concurrency.ceiling，同时进行的请求数由 concurrency 根据延迟和错误自动调整
+        :param ordered: 多线程时是否按页码顺序返回结果，False 表示哪页先下载完就先解析哪页
+        :param pages: PageContext 的可迭代对象，None 表示使用 get_urls()，比如 self.get_urls(offset=100, shard=(0, 4))
         :return:
         """
 
         exist_count = 0
+        # completed 是正常结束或者调用者停止迭代，stopped 是达到 max_exist 提前停止
+        completed = stopped = False
+        if self.concurrency is not None:
+            workers = max(workers, self.concurrency.ceiling)
+
+        if self.frontier is not None:
+            pages = self._frontier_pages(pages, restart=overlay_file)
+        elif pages is None:
+            pages = self.get_urls()
+        if workers > 1:
+            results = self._fetch_pages(pages, overlay_file, workers, ordered)
+        else:
+            results = ((page, self.fetch_page(page, overlay_file)) for page in pages)
 
-        i = 1
-        for page in self.get_urls():
-            file = self.save_dir / f'{datetime.now().strftime("%Y-%m-%d %H.%M.%S")} {page.page:05}.html'
-            self.log_function(page.url, file)
-            if file.exists() and not overlay_file:
-                continue
-            with open(file, 'wb') as f:
-                try:
-                    r = self.get(page.url)
-                    f.write(r.content)
-                    for data in self.process_list_page(r.content):
+        try:
+            for page, content in results:
+                if content is not None:
+                    for data in self._process_content(content, page.url):
+                        if self.is_unchanged(data):
+                            exist_count += 1
+                            continue
+                        exist_count = 0
                         yield data
-                except Exception as e:
-                    self.log_function(f'错误:{e}')
-                    self.errors.append(f'错误:{e}')
-            i += 1
-            # random_sleep()
-            if exist_count >= max_exist:
+                        # 调用者处理完这个数据（继续迭代）以后才记录为已经返回
+                        self._mark_detail(data)
+                if self.frontier is not None:
+                    if content is None:
+                        self.frontier.failed(page.url)
+                    else:
+                        self.frontier.done(page.url)
+                # random_sleep()
+                if not self.is_update and max_exist is not None and exist_count >= max_exist:
+                    stopped = True
+                    break
+            completed = True
+        except GeneratorExit:
+            # 调用者停止迭代，没有处理的数据没有记录
+            completed = True
+            raise
+        finally:
+            results.close()
+            if self.frontier is not None and stopped:
+                # 后面的列表页这次不需要爬取，下次从头开始
+                self.frontier.skip_pending(LIST_QUEUE)
+            self.storage.flush()
+            self.errors.flush()
+            if self.seen_index is not None:
+                self.seen_index.checkpoint()
+            if self.frontier is not None and completed:
+                # 出错的时候不保存，下次从上次保存的地方继续
+                self.frontier.checkpoint()
+
+    def _frontier_pages(self, pages=None, restart=False):
+        """
+        把列表页（默认是 get_urls）加入 frontier，再从 frontier 取出没有爬取的列表页
+
+        上次的爬取中断的时候只爬取剩下的列表页，上次的爬取已经完成或者 restart 为 True 的时候重新爬取这些列表页
+        """
+        frontier = self.frontier
+        urls = []
+        for page in self.get_urls() if pages is None else pages:
+            frontier.add(page.url, priority=-page.page, data={'name': page.name, 'page': page.page},
+                         queue=LIST_QUEUE)
+            urls.append(page.url)
+        states = [frontier.state(url) for url in urls]
+        unfinished = PENDING in states or IN_PROGRESS in states
+        for url, state in zip(urls, states):
+            if state == IN_PROGRESS or ((restart or not unfinished) and state in (DONE, FAILED)):
+                frontier.retry(url)
+        frontier.checkpoint()
+        while True:
+            item = self.frontier.pop(LIST_QUEUE)
+            if item is None:
                 break
+            yield PageContext(name=item.data['name'], page=item.data['page'], url=item.url)
+
+    def _process_content(self, content, url=None):
+        """
+        解析列表页，解析出错时记录错误
+
+        使用 frontier 的时候，已经返回过的详情页网址不再返回
+        """
+        try:
+            for data in timed_iter(self.metrics, 'parse_seconds', self.process_list_page(content), stage='list'):
+                if not self._detail_seen(data):
+                    yield data
+        except Exception as e:
+            self.log_function(f'错误:{e}')
+            self.add_error(e, url=url, kind=f'Parse{type(e).__name__}')
+
+    def _detail_seen(self, data):
+        """
+        使用 frontier 的时候，详情页网址是否已经返回过
+        """
+        return self.frontier is not None and bool(data.get('url')) and self.frontier.seen(data['url'])
+
+    def _mark_detail(self, data):
+        """
+        使用 frontier 的时候记录已经返回并且被处理的详情页网址（状态是 DONE，不排队）
+        """
+        if self.frontier is not None and data.get('url'):
+            self.frontier.mark_done(data['url'], data=data, queue=DETAIL_QUEUE)
+
+    def _fetch_pages(self, pages, overlay_file, workers, ordered):
+        """
+        使用线程池下载列表页，返回 (PageContext, 网页内容)，同时最多只提交 workers * 2 个任务，
+        这样调用者停止迭代（比如达到 max_exist）时不会再去下载剩下的页面。
+        """
+        pages = iter(pages)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            def submit():
+                for page in pages:
+                    pending.append((page, executor.submit(self.fetch_page, page, overlay_file)))
+                    return True
+                return False
+
+            try:
+                while len(pending) < workers * 2 and submit():
+                    pass
+
+                while pending:
+                    if ordered:
+                        page, future = pending.popleft()
+                    else:
+                        wait([future for _, future in pending], return_when=FIRST_COMPLETED)
+                        page, future = next(item for item in pending if item[1].done())
+                        pending.remove((page, future))
+                    submit()
+                    yield page, future.result()
+            finally:
+                for _, future in pending:
+                    future.cancel()
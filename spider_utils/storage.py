@@ -0,0 +1,291 @@
+"""
+保存爬取的网页
+
+FileStorage     每个网页保存为一个文件（以前的方式）
+SegmentStorage  追加写入压缩的段文件，用索引按网址查找，适合大量网页
+
+SegmentStorage 的段文件里面每条记录是一行 JSON 头（网址、时间、压缩以后的长度）加上单独压缩的内容，
+所以段文件本身就是完整的，索引丢失以后可以用 rebuild_index 重建。
+压缩默认使用 zstd（需要安装 zstandard），没有安装的时候使用 zlib。
+
+例子：
+from spider_utils.storage import SegmentStorage
+
+storage = SegmentStorage('cache/pages')
+spider = BaseSpider('https://www.example.com', storage=storage)
+for data in spider.crawl():
+    ...
+html = storage.get('https://www.example.com/page/2/')
+"""
+import os
+import re
+import json
+import time
+import zlib
+import threading
+from pathlib import Path
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SEGMENT_RE = re.compile(r'segment-(\d{5})\.dat')
+
+
+class FileStorage:
+    def __init__(self, save_dir):
+        """
+        每个网页保存为一个文件，文件名是 {时间} {页码}.html
+
+        :param save_dir: 保存的文件夹
+        """
+        self.save_dir = Path(save_dir)
+        self._files = {}
+        self._lock = threading.Lock()
+        if not self.save_dir.exists():
+            self.save_dir.mkdir(parents=True)
+
+    def path(self, url, page=None):
+        """
+        网页保存的文件路径
+        """
+        if page is None:
+            name = re.sub(r'[\\/:*?"<>|]', '-', url)
+        else:
+            name = f'{page.page:05}'
+        return self.save_dir / f'{datetime.now().strftime("%Y-%m-%d %H.%M.%S")} {name}.html'
+
+    def exists(self, url):
+        """
+        网页是否已经保存（只记录这次运行保存的网页，因为文件名里面有时间）
+        """
+        return url in self._files
+
+    def put(self, url, content, page=None):
+        """
+        保存网页，返回文件路径
+        """
+        file = self.path(url, page)
+        with open(file, 'wb') as f:
+            f.write(content)
+        with self._lock:
+            self._files[url] = file
+        return file
+
+    def get(self, url):
+        """
+        读取保存的网页，没有保存的时候返回 None
+        """
+        file = self._files.get(url)
+        if file is None:
+            return None
+        with open(file, 'rb') as f:
+            return f.read()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SegmentStorage:
+    def __init__(self, directory, compression=None, segment_size=256 * 1024 * 1024, sync_every=100, level=3):
+        """
+        追加写入压缩的段文件，索引保存在 index.jsonl
+
+        :param directory: 保存的文件夹
+        :param compression: zstd、zlib 或者 none（不压缩），None 表示安装了 zstandard 的时候使用 zstd，否则使用 zlib
+        :param segment_size: 段文件的最大字节数，超过以后写入新的段文件
+        :param sync_every: 每写入多少条记录 fsync 一次
+        :param level: 压缩级别
+        """
+        if compression is None:
+            compression = 'zstd' if zstandard is not None else 'zlib'
+        elif compression == 'zstd' and zstandard is None:
+            raise ImportError('使用 zstd 压缩需要安装 zstandard')
+        elif compression not in ('zstd', 'zlib', 'none'):
+            raise ValueError(f'不支持的压缩方式: {compression}')
+
+        self.directory = Path(directory)
+        self.compression = compression
+        self.segment_size = segment_size
+        self.sync_every = sync_every
+        self.level = level
+
+        # 网址 -> (段序号, 内容的位置, 内容的长度, 压缩方式)
+        self.index = {}
+        self._unsynced = 0
+        self._readers = {}
+        # 每个线程使用自己的压缩器
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        if not self.directory.exists():
+            self.directory.mkdir(parents=True)
+
+        self._load_index()
+        segments = self._segments()
+        self._segment = segments[-1] if segments else 0
+        self._writer = open(self._segment_path(self._segment), 'ab')
+        self._index_writer = open(self.directory / 'index.jsonl', 'a', encoding='utf-8')
+
+    def _segment_path(self, segment):
+        return self.directory / f'segment-{segment:05}.dat'
+
+    def _segments(self):
+        return sorted(int(m.group(1)) for m in map(SEGMENT_RE.fullmatch, os.listdir(self.directory)) if m)
+
+    def _load_index(self):
+        """
+        读取索引，忽略程序崩溃时没有写完的记录
+
+        最后一行没有换行符（没有写完）的时候截掉，否则下一条记录会接在这一行后面，再读取的时候被忽略
+        """
+        index_file = self.directory / 'index.jsonl'
+        if not index_file.exists():
+            return
+        sizes = {segment: os.path.getsize(self._segment_path(segment)) for segment in self._segments()}
+        end = 0
+        with open(index_file, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                end += len(line)
+                try:
+                    url, segment, offset, length, compression = json.loads(line)
+                except ValueError:
+                    continue
+                if offset + length <= sizes.get(segment, -1):
+                    self.index[url] = (segment, offset, length, compression)
+        if end < os.path.getsize(index_file):
+            with open(index_file, 'r+b') as f:
+                f.truncate(end)
+
+    def rebuild_index(self):
+        """
+        扫描段文件重新生成索引
+        """
+        with self._lock:
+            self._flush()
+            self.index = {}
+            self._index_writer.close()
+            with open(self.directory / 'index.jsonl', 'w', encoding='utf-8') as index_writer:
+                for segment in self._segments():
+                    with open(self._segment_path(segment), 'rb') as f:
+                        while True:
+                            line = f.readline()
+                            if not line:
+                                break
+                            try:
+                                header = json.loads(line)
+                            except ValueError:
+                                break
+                            offset = f.tell()
+                            if offset + header['length'] > os.path.getsize(self._segment_path(segment)):
+                                break
+                            entry = (segment, offset, header['length'], header['compression'])
+                            self.index[header['url']] = entry
+                            index_writer.write(json.dumps([header['url'], *entry]) + '\n')
+                            f.seek(header['length'], os.SEEK_CUR)
+            self._index_writer = open(self.directory / 'index.jsonl', 'a', encoding='utf-8')
+
+    def _compress(self, content):
+        if self.compression == 'zstd':
+            compressor = getattr(self._local, 'compressor', None)
+            if compressor is None:
+                compressor = self._local.compressor = zstandard.ZstdCompressor(level=self.level)
+            return compressor.compress(content)
+        if self.compression == 'zlib':
+            return zlib.compress(content, self.level)
+        return content
+
+    @staticmethod
+    def _decompress(data, compression):
+        if compression == 'zstd':
+            if zstandard is None:
+                raise ImportError('读取 zstd 压缩的内容需要安装 zstandard')
+            return zstandard.ZstdDecompressor().decompress(data)
+        if compression == 'zlib':
+            return zlib.decompress(data)
+        return data
+
+    def exists(self, url):
+        """
+        网页是否已经保存
+        """
+        return url in self.index
+
+    def __contains__(self, url):
+        return url in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def put(self, url, content, page=None):
+        """
+        保存网页，返回 (段序号, 位置)
+        """
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        data = self._compress(content)
+        header = json.dumps({'url': url, 'time': time.time(), 'length': len(data), 'compression': self.compression})
+        with self._lock:
+            if self._writer.tell() >= self.segment_size:
+                self._flush()
+                self._writer.close()
+                self._segment += 1
+                self._writer = open(self._segment_path(self._segment), 'ab')
+            self._writer.write(header.encode('utf-8') + b'\n')
+            offset = self._writer.tell()
+            self._writer.write(data)
+            entry = (self._segment, offset, len(data), self.compression)
+            # 先写内容再写索引，崩溃的时候索引不会指向不完整的内容
+            self._writer.flush()
+            self._index_writer.write(json.dumps([url, *entry]) + '\n')
+            self.index[url] = entry
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every:
+                self._flush()
+        return entry[:2]
+
+    def get(self, url):
+        """
+        读取保存的网页，没有保存的时候返回 None
+        """
+        entry = self.index.get(url)
+        if entry is None:
+            return None
+        segment, offset, length, compression = entry
+        with self._lock:
+            if segment == self._segment:
+                self._writer.flush()
+            reader = self._readers.get(segment)
+            if reader is None:
+                reader = self._readers[segment] = open(self._segment_path(segment), 'rb')
+            reader.seek(offset)
+            data = reader.read(length)
+        return self._decompress(data, compression)
+
+    def _flush(self):
+        for f in (self._writer, self._index_writer):
+            f.flush()
+            os.fsync(f.fileno())
+        self._unsynced = 0
+
+    def flush(self):
+        """
+        把写入的内容保存到磁盘
+        """
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._writer.close()
+            self._index_writer.close()
+            for reader in self._readers.values():
+                reader.close()
+            self._readers = {}
@@ -0,0 +1,248 @@
+"""
+生成列表页网址：预先编译的网址模板和可以切片、分片、从中断位置继续的页码范围
+
+模板只在创建的时候解析一次，生成网址的时候只拼接字符串，不再每页调用 str.format。
+PageRange 里面保存的是 range，所以切片、分片（第 k 个进程处理 n 份里面的一份）和从第 offset 个继续都不用生成前面的网址。
+多个来源可以用 chain 连在一起，或者用 interleave 轮流生成。
+
+例子：
+from spider_utils.urlgen import PageRange, chain, interleave
+
+news = PageRange('{base_url}/news/page/{page}/', end=1000, name='news', base_url='https://www.example.com')
+posts = PageRange('{base_url}/p/{page}.html', start=100000, end=2000000, name='posts', base_url='https://www.example.com')
+
+pages = interleave(news, posts).shard(k, n)  # 第 k 个进程
+for page in pages.iter_from(offset):  # offset 是上次处理完的数量
+    print(page.name, page.page, page.url)
+"""
+from string import Formatter
+from itertools import islice
+
+
+class PageContext:
+    """
+    一个列表页：来源的名字、页码和网址，用法和以前的 namedtuple 一样（可以解包）
+    """
+    __slots__ = ('name', 'page', 'url')
+
+    def __init__(self, name, page, url):
+        self.name = name
+        self.page = page
+        self.url = url
+
+    def __iter__(self):
+        yield self.name
+        yield self.page
+        yield self.url
+
+    def __getitem__(self, index):
+        return (self.name, self.page, self.url)[index]
+
+    def __len__(self):
+        return 3
+
+    def __eq__(self, other):
+        if isinstance(other, PageContext):
+            return (self.name, self.page, self.url) == (other.name, other.page, other.url)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self.name, self.page, self.url))
+
+    def __repr__(self):
+        return f'PageContext(name={self.name!r}, page={self.page!r}, url={self.url!r})'
+
+    def __reduce__(self):
+        return PageContext, (self.name, self.page, self.url)
+
+    def _asdict(self):
+        return {'name': self.name, 'page': self.page, 'url': self.url}
+
+
+class UrlTemplate:
+    def __init__(self, template, field='page', **fields):
+        """
+        预先编译的网址模板
+
+        :param template: str.format 格式的模板，比如 '{base_url}/page/{page}/'
+        :param field: 变化的字段
+        :param fields: 其他字段的值，编译的时候就替换进去
+        """
+        self.template = template
+        self.field = field
+        # 编译成 [文字, 文字, ...]，相邻两段之间是 field（可以有格式，比如 {page:05}）
+        parts = ['']
+        specs = []
+        for literal, name, spec, conversion in Formatter().parse(template):
+            parts[-1] += literal
+            if name is None:
+                continue
+            if name == field:
+                parts.append('')
+                specs.append(spec)
+            else:
+                value = fields[name]
+                if conversion:
+                    value = {'r': repr, 's': str, 'a': ascii}[conversion](value)
+                parts[-1] += format(value, spec)
+        self._parts = parts
+        self._specs = specs
+        if len(parts) == 2 and not specs[0]:
+            self._prefix, self._suffix = parts
+        else:
+            self._prefix = self._suffix = None
+
+    def __call__(self, value):
+        if self._prefix is not None:
+            return f'{self._prefix}{value}{self._suffix}'
+        result = [self._parts[0]]
+        for spec, part in zip(self._specs, self._parts[1:]):
+            result.append(format(value, spec))
+            result.append(part)
+        return ''.join(result)
+
+    def __repr__(self):
+        return f'UrlTemplate({self.template!r}, field={self.field!r})'
+
+
+class PageRange:
+    def __init__(self, template, start=1, end=None, step=1, name='', first_url=None, field='page', **fields):
+        """
+        页码范围，生成 PageContext
+
+        :param template: 网址模板（str.format 格式或者 UrlTemplate）
+        :param start: 第一页的页码
+        :param end: 最后一页的页码（包括 end）
+        :param step: 页码的间隔
+        :param name: 来源的名字，保存在 PageContext.name
+        :param first_url: 第 1 页的网址（很多网站的第 1 页没有页码），可以使用模板里面的其他字段
+        :param field: 模板里面页码的字段
+        :param fields: 模板里面其他字段的值，比如 base_url
+        """
+        if end is None:
+            raise ValueError('需要设置 end')
+        self.template = template if isinstance(template, UrlTemplate) else UrlTemplate(template, field, **fields)
+        self.name = name
+        self.first_url = first_url.format(**fields) if first_url else None
+        self.pages = range(start, end + 1, step)
+
+    @classmethod
+    def _from_range(cls, source, pages):
+        page_range = cls.__new__(cls)
+        page_range.template = source.template
+        page_range.name = source.name
+        page_range.first_url = source.first_url
+        page_range.pages = pages
+        return page_range
+
+    def url(self, page):
+        if page == 1 and self.first_url:
+            return self.first_url
+        return self.template(page)
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._from_range(self, self.pages[index])
+        page = self.pages[index]
+        return PageContext(self.name, page, self.url(page))
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def iter_from(self, offset=0):
+        """
+        从第 offset 个（从 0 开始）继续生成，前面的网址不会生成
+        """
+        name = self.name
+        template = self.template
+        pages = self.pages[offset:]
+        if self.first_url and 1 in pages:
+            for page in pages:
+                yield PageContext(name, page, self.url(page))
+            return
+        for page in pages:
+            yield PageContext(name, page, template(page))
+
+    def shard(self, k, n):
+        """
+        分成 n 份的第 k 份（从 0 开始），每份的页码交错分布，所以每份的数量差不多
+        """
+        if not 0 <= k < n:
+            raise ValueError('需要 0 <= k < n')
+        return self._from_range(self, self.pages[k::n])
+
+    def __repr__(self):
+        return f'PageRange({self.template.template!r}, name={self.name!r}, pages={self.pages!r})'
+
+
+class _Combined:
+    def __init__(self, sources):
+        self.sources = list(sources)
+
+    def __len__(self):
+        return sum(len(source) for source in self.sources)
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def shard(self, k, n):
+        """
+        每个来源分别分成 n 份，取第 k 份
+        """
+        return type(self)(source.shard(k, n) for source in self.sources)
+
+
+class ChainedPages(_Combined):
+    """
+    按顺序生成每个来源的网址
+    """
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        for source in self.sources:
+            if index < len(source):
+                return source[index]
+            index -= len(source)
+        raise IndexError(index)
+
+    def iter_from(self, offset=0):
+        for source in self.sources:
+            size = len(source)
+            if offset >= size:
+                offset -= size
+                continue
+            yield from source.iter_from(offset)
+            offset = 0
+
+
+class InterleavedPages(_Combined):
+    """
+    轮流生成每个来源的网址，生成完的来源跳过
+    """
+
+    def _order(self):
+        """
+        (来源, 来源里面的位置) 的顺序，只计算位置不生成网址
+        """
+        sizes = [len(source) for source in self.sources]
+        for position in range(max(sizes, default=0)):
+            for index, size in enumerate(sizes):
+                if position < size:
+                    yield index, position
+
+    def iter_from(self, offset=0):
+        sources = self.sources
+        for index, position in islice(self._order(), offset, None):
+            yield sources[index][position]
+
+
+def chain(*sources):
+    return ChainedPages(sources)
+
+
+def interleave(*sources):
+    return InterleavedPages(sources)
@@ -5,16 +5,44 @@ import random
 
 from . import BASE_DIR
 
-from fake_useragent import UserAgent
+# 第一次调用 get_user_agent 的时候再创建，导入这个模块的时候不读取文件
+_ua = None
+_mobile_user_agents = None
 
-ua = UserAgent()
 
-with open(os.path.join(BASE_DIR, 'data', 'mobile_user_agents.txt')) as f:
-    mobile_user_agents = [i.strip() for i in f.readlines()]
+def get_ua():
+    """
+    fake_useragent 的 UserAgent（第一次调用的时候创建）
+    """
+    global _ua
+    if _ua is None:
+        from fake_useragent import UserAgent
+        _ua = UserAgent()
+    return _ua
+
+
+def get_mobile_user_agents():
+    """
+    手机的 User Agent 列表（第一次调用的时候读取 data/mobile_user_agents.txt）
+    """
+    global _mobile_user_agents
+    if _mobile_user_agents is None:
+        with open(os.path.join(BASE_DIR, 'data', 'mobile_user_agents.txt')) as f:
+            _mobile_user_agents = [i.strip() for i in f.readlines()]
+    return _mobile_user_agents
+
+
+def __getattr__(name):
+    # 兼容以前的模块属性 ua 和 mobile_user_agents
+    if name == 'ua':
+        return get_ua()
+    if name == 'mobile_user_agents':
+        return get_mobile_user_agents()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def get_user_agent(is_mobile=False):
     """
     随机获取 User Agent
     """
-    return random.choice(mobile_user_agents) if is_mobile else ua.random
+    return random.choice(get_mobile_user_agents()) if is_mobile else get_ua().random
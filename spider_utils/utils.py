@@ -1,6 +1,7 @@
 import time
 import random
 
+from functools import lru_cache
 from urllib import parse
 
 
@@ -14,30 +15,118 @@ def random_sleep(start=1, end=3, debug=True):
     time.sleep(sleep_time)
 
 
-def url_to_dict(url):
+def _query(url):
     """
-    把 url 转换为 dict 字典
+    网址里面的查询字符串，传入的已经是查询字符串的时候直接返回
     """
+    head, sep, query = url.partition('?')
+    if sep and '=' not in head and '&' not in head:
+        url = query
+    return url.partition('#')[0]
+
+
+@lru_cache(maxsize=65536)
+def _unquote_plus(value):
+    return parse.unquote(value.replace('+', ' '))
+
+
+def _parse_query(query, unquote=_unquote_plus):
     params = {}
-    url = parse.unquote(url)
-    for param in url.split('&'):
-        # print(param)
-        k, v = param.split('=')
+    for param in query.split('&'):
+        if not param:
+            continue
+        k, _, v = param.partition('=')
+        # 先分开再解码，这样编码过的 & 和 = 不会影响分割
+        if '%' in k or '+' in k:
+            k = unquote(k)
+        if '%' in v or '+' in v:
+            v = unquote(v)
         params[k] = v
-        # print("'{}': '{}',".format(k, v),)
     return params
 
 
-def get_cookie_dict(cookie):
+def url_to_dict(url):
     """
-    转换 Raw 格式的 Cookie 为字典格式
+    把 url 转换为 dict 字典
+
+    和 parse_qsl(keep_blank_values=True) 的结果一样：先按 & 和第一个 = 分割再解码，值里面可以有 =，
+    空的部分会被忽略，没有 = 的参数值为 ''，重复的参数使用最后一个。可以传入查询字符串或者完整的网址。
     """
+    return _parse_query(_query(url))
+
+
+def _parse_cookie(cookie):
     params = {}
     cookie = cookie.strip()
     if cookie.startswith('Cookie:'):
-        cookie = cookie[7:].strip()
+        cookie = cookie[7:]
     for param in cookie.split(';'):
-        k, v = param.split('=')
-        params[k.strip()] = v.strip()
-        # print("'{}': '{}',".format(k, v), )
+        k, _, v = param.partition('=')
+        k = k.strip()
+        if k:
+            params[k] = v.strip()
     return params
+
+
+def get_cookie_dict(cookie):
+    """
+    转换 Raw 格式的 Cookie 为字典格式
+
+    按 ; 和第一个 = 分割，值里面可以有 =，空的部分会被忽略，没有 = 的值为 ''
+    """
+    return _parse_cookie(cookie)
+
+
+def urls_to_dicts(urls):
+    """
+    批量转换 url，返回每个 url 的字典（迭代器），见 url_to_dict
+
+    :param urls: url 或者查询字符串的可迭代对象，比如 HAR 文件里面所有请求的网址
+    """
+    parse_query = _parse_query
+    query = _query
+    for url in urls:
+        yield parse_query(query(url))
+
+
+def cookies_to_dicts(cookies):
+    """
+    批量转换 Raw 格式的 Cookie，返回每个 Cookie 的字典（迭代器），见 get_cookie_dict
+    """
+    parse_cookie = _parse_cookie
+    for cookie in cookies:
+        yield parse_cookie(cookie)
+
+
+def dicts_to_columns(dicts, keys=None):
+    """
+    把字典按列保存：Dict(键 -> 每一行的值的列表)，没有这个键的行是 None
+
+    :param dicts: 字典的可迭代对象
+    :param keys: 需要的键，None 表示所有出现过的键
+    """
+    columns = {} if keys is None else {key: [] for key in keys}
+    count = 0
+    for row in dicts:
+        if keys is None:
+            for key in row:
+                if key not in columns:
+                    columns[key] = [None] * count
+        for key, column in columns.items():
+            column.append(row.get(key))
+        count += 1
+    return columns
+
+
+def urls_to_columns(urls, keys=None):
+    """
+    批量转换 url，按列返回，见 dicts_to_columns
+    """
+    return dicts_to_columns(urls_to_dicts(urls), keys)
+
+
+def cookies_to_columns(cookies, keys=None):
+    """
+    批量转换 Raw 格式的 Cookie，按列返回，见 dicts_to_columns
+    """
+    return dicts_to_columns(cookies_to_dicts(cookies), keys)
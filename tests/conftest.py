@@ -0,0 +1,12 @@
+import pytest
+
+from benchmarks.server import BenchServer
+
+
+@pytest.fixture(scope='module')
+def server():
+    """
+    本地的列表页、详情页和文件服务器（见 benchmarks/server.py）
+    """
+    with BenchServer(pages=5) as server:
+        yield server
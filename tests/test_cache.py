@@ -0,0 +1,118 @@
+import gzip
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+from spider_utils.cache import ResponseCache
+
+
+class CacheHandler(BaseHTTPRequestHandler):
+    """
+    /etag 支持 If-None-Match，/gzip 返回压缩的内容，/no-store、/private 不允许缓存，
+    /vary 按 Accept-Language 返回不同的内容
+    """
+    protocol_version = 'HTTP/1.1'
+    requests = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body=b'', headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        type(self).requests += 1
+        if self.path == '/etag':
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.send(304, headers=[('ETag', '"v1"')])
+            else:
+                self.send(200, b'etag body', [('ETag', '"v1"')])
+        elif self.path == '/gzip':
+            self.send(200, gzip.compress(b'plain body' * 100), [('Content-Encoding', 'gzip')])
+        elif self.path == '/no-store':
+            self.send(200, b'secret', [('Cache-Control', 'no-store')])
+        elif self.path == '/private':
+            self.send(200, b'secret', [('Cache-Control', 'private, max-age=60')])
+        elif self.path == '/vary':
+            language = self.headers.get('Accept-Language', '')
+            self.send(200, f'lang={language}'.encode(), [('Vary', 'Accept-Language')])
+        else:
+            self.send(404)
+
+
+@pytest.fixture(scope='module')
+def base_url():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), CacheHandler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    host, port = httpd.server_address[:2]
+    yield f'http://{host}:{port}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(tmp_path / 'cache.sqlite', ttl=None)
+    yield cache
+    cache.close()
+
+
+def get(cache, url, headers=None):
+    return cache.request(url, lambda h: requests.get(url, headers=h, timeout=5), headers)
+
+
+def test_revalidate_with_etag(base_url, cache):
+    url = base_url + '/etag'
+    first = get(cache, url)
+    assert not first.from_cache
+    second = get(cache, url)
+    assert second.from_cache and second.status_code == 200 and second.content == b'etag body'
+    assert cache.stats()['misses'] == 1
+    assert cache.stats()['revalidated'] == 1
+
+
+def test_fresh_entry_is_not_requested(base_url, tmp_path):
+    cache = ResponseCache(tmp_path / 'fresh.sqlite', ttl=60)
+    url = base_url + '/etag'
+    get(cache, url)
+    count = CacheHandler.requests
+    assert get(cache, url).from_cache
+    assert CacheHandler.requests == count
+    assert cache.stats()['hits'] == 1
+    cache.close()
+
+
+def test_decoded_body_drops_encoding_headers(base_url, cache):
+    url = base_url + '/gzip'
+    get(cache, url)
+    cached = cache.to_response(cache._load(url))
+    assert cached.content == b'plain body' * 100
+    assert 'Content-Encoding' not in cached.headers
+    assert 'Content-Length' not in cached.headers
+
+
+@pytest.mark.parametrize('path', ['/no-store', '/private'])
+def test_no_store_and_private_are_not_cached(base_url, cache, path):
+    get(cache, base_url + path)
+    assert cache.stats()['size'] == 0
+    assert not get(cache, base_url + path).from_cache
+
+
+def test_vary_headers_are_part_of_key(base_url, tmp_path):
+    cache = ResponseCache(tmp_path / 'vary.sqlite', ttl=60)
+    url = base_url + '/vary'
+    assert get(cache, url, {'Accept-Language': 'en'}).content == b'lang=en'
+    zh = get(cache, url, {'Accept-Language': 'zh'})
+    assert not zh.from_cache and zh.content == b'lang=zh'
+    en = get(cache, url, {'Accept-Language': 'en'})
+    assert en.from_cache and en.content == b'lang=en'
+    cache.close()
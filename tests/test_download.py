@@ -0,0 +1,129 @@
+import os
+import json
+import hashlib
+
+import pytest
+import requests
+
+from benchmarks.server import file_bytes
+from spider_utils.client import BaseSpiderClient
+from spider_utils.download import download, download_progress, download_segmented, download_many, parse_range_response
+
+
+def expected(size):
+    return b''.join(file_bytes(0, size))
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_download_zero_length(server, tmp_path):
+    dst = tmp_path / 'empty.bin'
+    assert download(server.url('/files/0.bin'), str(dst)) == 0
+    assert dst.exists() and read(dst) == b''
+
+
+def test_download_many_with_manifest_and_resume(server, tmp_path):
+    sizes = [0, 1000, 300000, 2 * 1024 * 1024]
+    jobs = [(server.url(f'/files/{size}.bin'), str(tmp_path / 'files' / f'{size}.bin')) for size in sizes]
+    manifest = tmp_path / 'state' / 'manifest.jsonl'
+    # 中断的下载：一个文件只下载了一部分
+    os.makedirs(tmp_path / 'files')
+    with open(jobs[2][1], 'wb') as f:
+        f.write(expected(300000)[:1234])
+
+    result = download_many(jobs, workers=2, progress=False, manifest=str(manifest))
+    assert result['failed'] == []
+    assert result['done'] == len(sizes)
+    assert result['bytes'] == sum(sizes) - 1234
+    for size, (_, dst) in zip(sizes, jobs):
+        assert read(dst) == expected(size)
+    done = {record['dst'] for record in map(json.loads, manifest.read_text().splitlines()) if record.get('done')}
+    assert done == {dst for _, dst in jobs}
+
+    # 再次运行的时候全部跳过
+    result = download_many(jobs, workers=2, progress=False, manifest=str(manifest))
+    assert result == {'done': 0, 'skipped': len(sizes), 'failed': [], 'bytes': 0}
+
+
+@pytest.mark.parametrize('function', [download, download_progress])
+def test_download_resumes_from_existing_file(server, tmp_path, function):
+    size = 300000
+    dst = tmp_path / 'file.bin'
+    # 已经下载的部分用不同的内容，结果里面保留说明是续传而不是重新下载
+    dst.write_bytes(b'x' * 1000)
+    assert function(server.url(f'/files/{size}.bin'), str(dst)) == size
+    assert read(dst) == b'x' * 1000 + expected(size)[1000:]
+
+    # 已经下载完成的时候返回 416，不修改文件
+    assert function(server.url(f'/files/{size}.bin'), str(dst)) == size
+    assert read(dst) == b'x' * 1000 + expected(size)[1000:]
+
+    assert function(server.url(f'/files/{size}.bin'), str(dst), resume=False) == size
+    assert read(dst) == expected(size)
+
+
+def test_download_segmented(server, tmp_path):
+    size = 2 * 1024 * 1024 + 123
+    dst = tmp_path / 'segmented.bin'
+    assert download_segmented(server.url(f'/files/{size}.bin'), str(dst), segments=4) == size
+    assert read(dst) == expected(size)
+    assert not os.path.exists(f'{dst}.segments')
+
+
+def test_download_segmented_resumes_each_segment(server, tmp_path):
+    size = 400000
+    dst = tmp_path / 'segmented.bin'
+    # 中断的分段下载：每一段下载了一部分，已经下载的部分用不同的内容，结果里面保留说明没有重新下载
+    parts = [[0, 99999, 100000], [100000, 199999, 5000], [200000, 299999, 0], [300000, 399999, 99999]]
+    content = bytearray(size)
+    for start, _, done in parts:
+        content[start:start + done] = b'x' * done
+    dst.write_bytes(bytes(content))
+    with open(f'{dst}.segments', 'w', encoding='utf-8') as f:
+        json.dump({'size': size, 'segments': parts}, f)
+
+    assert download_segmented(server.url(f'/files/{size}.bin'), str(dst), segments=4) == size
+    data = expected(size)
+    for start, end, done in parts:
+        assert read(dst)[start:end + 1] == b'x' * done + data[start + done:end + 1]
+    assert not os.path.exists(f'{dst}.segments')
+
+
+def md5(data):
+    return hashlib.md5(data).hexdigest()
+
+
+def test_client_download_checksum_and_part_resume(server, tmp_path):
+    size = 300000
+    url = server.url(f'/files/{size}.bin')
+    client = BaseSpiderClient(log_function=lambda *args: None)
+    dst = tmp_path / 'file.bin'
+    assert client.download(url, str(dst), checksum=md5(expected(size))) == size
+    assert read(dst) == expected(size)
+    assert not os.path.exists(f'{dst}.part')
+
+    # 从 .part 续传，校验值包括已经下载的部分
+    resumed = tmp_path / 'resumed.bin'
+    content = b'x' * 1000 + expected(size)[1000:]
+    with open(f'{resumed}.part', 'wb') as f:
+        f.write(b'x' * 1000)
+    assert client.download(url, str(resumed), checksum=md5(content)) == size
+    assert read(resumed) == content
+
+
+def test_client_download_checksum_mismatch(server, tmp_path):
+    client = BaseSpiderClient(log_function=lambda *args: None)
+    dst = tmp_path / 'file.bin'
+    assert client.download(server.url('/files/1000.bin'), str(dst), checksum='0' * 32) is None
+    assert not dst.exists() and not os.path.exists(f'{dst}.part')
+    assert client.errors[-1].kind == 'ChecksumMismatch'
+
+
+def test_range_response_without_start():
+    response = requests.Response()
+    response.status_code = 206
+    response.headers['Content-Range'] = 'bytes */1000'
+    assert parse_range_response(response, 600)[1:] == (600, 1000)
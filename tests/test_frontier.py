@@ -0,0 +1,117 @@
+import pytest
+
+from spider_utils.frontier import Frontier, normalize_url, PENDING, DONE
+from spider_utils.spider import BaseSpider
+
+
+def test_normalize_url():
+    assert normalize_url('HTTP://Example.com:80/a?b=2&a=1#top') == 'http://example.com/a?a=1&b=2'
+    assert normalize_url('https://example.com') == 'https://example.com/'
+
+
+def test_dedup_and_round_robin(tmp_path):
+    frontier = Frontier(tmp_path / 'frontier.sqlite')
+    assert frontier.add('http://a.example/1', priority=1)
+    assert not frontier.add('http://A.example:80/1#x')
+    frontier.add('http://a.example/2', priority=2)
+    frontier.add('http://b.example/1')
+    hosts = [frontier.pop().host for _ in range(3)]
+    assert sorted(hosts[:2]) == ['a.example', 'b.example']
+    assert frontier.pop() is None
+
+
+def test_resume_after_restart(tmp_path):
+    path = tmp_path / 'frontier.sqlite'
+    frontier = Frontier(path)
+    for i in range(3):
+        frontier.add(f'http://a.example/{i}')
+    first = frontier.pop()
+    frontier.done(first.url)
+    frontier.pop()
+    frontier.close()
+
+    # 正在爬取的网址重新加入队列，已经爬取的不再取出
+    frontier = Frontier(path)
+    assert len(frontier) == 2
+    assert frontier.state(first.url) == DONE
+    urls = {frontier.pop().url, frontier.pop().url}
+    assert first.url not in urls and frontier.pop() is None
+
+
+def test_mark_done_and_skip_pending(tmp_path):
+    frontier = Frontier(tmp_path / 'frontier.sqlite')
+    assert frontier.mark_done('http://a.example/1', queue='detail')
+    assert not frontier.mark_done('http://a.example/1', queue='detail')
+    assert frontier.pop('detail') is None
+    frontier.add('http://a.example/2', queue='list')
+    frontier.skip_pending('list')
+    assert frontier.state('http://a.example/2') == DONE
+    assert frontier.stats() == {'detail': {'pending': 0, 'in_progress': 0, 'done': 1, 'failed': 0},
+                                'list': {'pending': 0, 'in_progress': 0, 'done': 1, 'failed': 0}}
+
+
+class CountingSpider(BaseSpider):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fetched = []
+
+    def fetch_page(self, page, overlay_file=False):
+        self.fetched.append(page.page)
+        return super().fetch_page(page, overlay_file)
+
+
+def make_spider(server, tmp_path, frontier):
+    return CountingSpider(server.url(), page_max=server.pages, save_dir=tmp_path / 'pages', frontier=frontier,
+                          log_function=lambda *a: None, parser='lxml')
+
+
+class Stop(Exception):
+    pass
+
+
+def test_crawl_resume_keeps_unprocessed_items(server, tmp_path):
+    path = tmp_path / 'frontier.sqlite'
+    processed = []
+    frontier = Frontier(path)
+    with pytest.raises(Stop):
+        for data in make_spider(server, tmp_path, frontier).crawl(overlay_file=True):
+            if len(processed) == 25:
+                # 处理第 26 个数据的时候出错，这个数据下次还要返回
+                raise Stop
+            processed.append(data['url'])
+    frontier.close()
+
+    frontier = Frontier(path)
+    spider = make_spider(server, tmp_path, frontier)
+    rest = [data['url'] for data in spider.crawl()]
+    # 第 1 页已经爬取完成，不再下载
+    assert 1 not in spider.fetched
+    assert len(processed) + len(rest) == 20 * server.pages
+    assert not set(processed) & set(rest)
+    assert frontier.stats()['detail']['pending'] == 0
+
+
+def test_crawl_again_refetches_list_pages(server, tmp_path):
+    frontier = Frontier(tmp_path / 'frontier.sqlite')
+    first = list(make_spider(server, tmp_path, frontier).crawl(overlay_file=True))
+    assert len(first) == 20 * server.pages
+
+    # 上次的爬取已经完成，再次爬取的时候重新下载列表页，已经返回过的详情页不再返回
+    spider = make_spider(server, tmp_path, frontier)
+    assert list(spider.crawl()) == []
+    assert sorted(spider.fetched) == list(range(1, server.pages + 1))
+    assert frontier.stats()['list'] == {'pending': 0, 'in_progress': 0, 'done': server.pages, 'failed': 0}
+
+
+def test_failed_crawl_does_not_checkpoint(tmp_path):
+    class BrokenSpider(BaseSpider):
+        def fetch_page(self, page, overlay_file=False):
+            raise RuntimeError('boom')
+
+    path = tmp_path / 'frontier.sqlite'
+    frontier = Frontier(path, checkpoint_interval=10 ** 6)
+    spider = BrokenSpider('http://127.0.0.1:1', page_max=3, save_dir=tmp_path, frontier=frontier,
+                          log_function=lambda *a: None)
+    with pytest.raises(RuntimeError):
+        list(spider.crawl())
+    assert frontier.state('http://127.0.0.1:1/page/2/') in (PENDING, None)
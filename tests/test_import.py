@@ -0,0 +1,30 @@
+"""
+导入时间的回归测试：在新的进程里面使用 python -X importtime 导入，检查预算和不应该加载的依赖
+
+预算和 benchmarks/bench_import.py 一样，比较慢的机器可以设置环境变量 IMPORT_BUDGET_SCALE=2 把预算放大
+"""
+import os
+
+import pytest
+
+from benchmarks.bench_import import CASES, import_time
+
+SCALE = float(os.environ.get('IMPORT_BUDGET_SCALE', 1))
+
+
+@pytest.mark.parametrize('code', ['import spider_utils', 'from spider_utils import url_to_dict, get_cookie_dict'])
+def test_heavy_dependencies_not_loaded(code):
+    _, modules = import_time(code)
+    loaded = sorted(name for name in ('requests', 'bs4', 'lxml', 'html2text') if name in modules)
+    assert loaded == []
+
+
+@pytest.mark.parametrize('code, budget, forbidden', CASES, ids=[case[0] for case in CASES])
+def test_import_budget(code, budget, forbidden):
+    # 取 3 次里面最快的一次，减少机器负载的影响
+    best = None
+    for _ in range(3):
+        elapsed, modules = import_time(code)
+        assert sorted(name for name in forbidden if name in modules) == []
+        best = elapsed if best is None else min(best, elapsed)
+    assert best <= budget * SCALE, f'{code} 导入用了 {best:.1f} ms，预算 {budget * SCALE:.0f} ms'
@@ -0,0 +1,47 @@
+import pytest
+
+from benchmarks.pages import list_page, detail_page
+from spider_utils.converter import ConverterPool, convert_detail
+from spider_utils.parsers import PARSERS, get_parser, parse_list_pages
+
+
+def available_parsers():
+    params = []
+    for name in PARSERS:
+        try:
+            get_parser(name)
+        except ImportError:
+            params.append(pytest.param(name, marks=pytest.mark.skip(reason=f'{name} is not installed')))
+        else:
+            params.append(name)
+    return params
+
+
+LIST_PAGES = [list_page(page, seed=seed) for page, seed in [(1, 0), (2, 1), (7, 5)]]
+DETAIL_PAGES = [detail_page(article_id, seed=seed) for article_id, seed in [(1, 0), (42, 3)]]
+# 没有正文和文章的页面
+EMPTY_PAGE = b'<html><body><p>nothing here</p></body></html>'
+
+
+@pytest.mark.parametrize('name', available_parsers())
+def test_parse_list_matches_bs4(name):
+    for content in LIST_PAGES:
+        expected = get_parser('bs4').parse_list(content)
+        assert len(expected) == 20
+        assert get_parser(name).parse_list(content) == expected
+    assert get_parser(name).parse_list(EMPTY_PAGE) == []
+
+
+@pytest.mark.parametrize('name', available_parsers())
+def test_detail_markdown_matches_bs4(name):
+    converters = ConverterPool()
+    for content in DETAIL_PAGES:
+        expected = convert_detail(get_parser('bs4'), converters, content)
+        assert expected.strip()
+        assert convert_detail(get_parser(name), converters, content) == expected
+    assert get_parser(name).detail_html(EMPTY_PAGE) is None
+
+
+def test_parse_list_pages_in_process_pool():
+    assert list(parse_list_pages(LIST_PAGES, parser='lxml', workers=2)) == \
+        [get_parser('lxml').parse_list(content) for content in LIST_PAGES]
@@ -0,0 +1,66 @@
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from spider_utils.frontier import Frontier
+from spider_utils.parsers import LxmlParser
+from spider_utils.spider import BaseSpider
+
+MAIN_PID = os.getpid()
+
+
+class CustomParser(LxmlParser):
+    name = 'custom-test'
+
+
+class BrokenParser(LxmlParser):
+    name = 'broken-test'
+
+    def __init__(self):
+        if os.getpid() != MAIN_PID:
+            raise RuntimeError('boom')
+        super().__init__()
+
+
+def make_spider(server, tmp_path, **kwargs):
+    kwargs.setdefault('parser', 'lxml')
+    return BaseSpider(server.url(), page_max=server.pages, save_dir=tmp_path, log_function=lambda *args: None,
+                      **kwargs)
+
+
+def test_workers_start_before_fetch_threads(server, tmp_path):
+    pipeline = make_spider(server, tmp_path).pipeline(parse_workers=2, mp_context='fork')
+    threads = threading.active_count()
+    executor, in_process = pipeline._executor(False)
+    try:
+        assert in_process
+        assert len(executor._processes) == 2
+    finally:
+        executor.shutdown(wait=True)
+    assert threading.active_count() == threads
+
+
+@pytest.mark.parametrize('mp_context', [None, 'spawn'])
+def test_crawl_with_process_pool(server, tmp_path, mp_context):
+    spider = make_spider(server, tmp_path, parser=CustomParser())
+    items = list(spider.pipeline(parse_workers=2, mp_context=mp_context).crawl(overlay_file=True))
+    assert len(items) == server.pages * 20
+    assert len({item['url'] for item in items}) == len(items)
+
+
+def test_broken_pool_raises(server, tmp_path):
+    spider = make_spider(server, tmp_path, parser=BrokenParser())
+    with pytest.raises(BrokenProcessPool):
+        list(spider.pipeline(parse_workers=2).crawl(overlay_file=True))
+
+
+def test_crawl_with_frontier(server, tmp_path):
+    frontier = Frontier(tmp_path / 'frontier.sqlite')
+    spider = make_spider(server, tmp_path, frontier=frontier)
+    first = list(spider.pipeline(parse_workers=2).crawl())
+    assert len(first) == server.pages * 20
+    # 已经完成的爬取重新开始列表页，但是详情网址已经爬取过
+    assert list(spider.pipeline(parse_workers=2).crawl()) == []
+    frontier.close()
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from spider_utils.records import RecordBuffer, OTHER_HOSTS
+
+
+def test_ring_buffer_spills_oldest(tmp_path):
+    spill = tmp_path / 'logs' / 'errors.jsonl'
+    buffer = RecordBuffer(maxlen=3, spill_path=str(spill))
+    for i in range(5):
+        buffer.append(f'error {i}', url=f'http://example.com/{i}')
+    buffer.close()
+    assert [str(record) for record in buffer] == ['error 2', 'error 3', 'error 4']
+    assert [json.loads(line)['message'] for line in spill.read_text().splitlines()] == ['error 0', 'error 1']
+    assert buffer.stats()['total'] == 5
+    assert buffer.stats()['spilled'] == 2
+    assert buffer.since(3) == buffer[-2:]
+
+
+def test_maxlen_zero_spills_everything(tmp_path):
+    spill = tmp_path / 'errors.jsonl'
+    buffer = RecordBuffer(maxlen=0, spill_path=str(spill))
+    buffer.append(ValueError('bad'), url='http://example.com/')
+    buffer.append('second')
+    buffer.close()
+    assert len(buffer) == 0 and not buffer
+    assert buffer.stats()['total'] == buffer.stats()['spilled'] == 2
+    assert buffer.by_kind() == {'ValueError': 1, None: 1}
+    assert len(spill.read_text().splitlines()) == 2
+
+
+def test_negative_maxlen():
+    with pytest.raises(ValueError):
+        RecordBuffer(maxlen=-1)
+
+
+def test_by_host_is_bounded():
+    buffer = RecordBuffer(maxlen=10, max_hosts=3)
+    for i in range(100):
+        buffer.append('error', url=f'http://host{i % 50}.example.com/')
+    by_host = buffer.by_host()
+    assert len(by_host) == 4
+    assert by_host['host0.example.com'] == 2
+    assert by_host[OTHER_HOSTS] == 100 - 3 * 2
+    assert sum(by_host.values()) == 100
@@ -0,0 +1,124 @@
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+import requests
+from urllib3 import HTTPConnectionPool
+from urllib3.exceptions import ProxyError
+
+from spider_utils.retry import RetryPolicy, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+from spider_utils.spider import requests_retry_session
+
+
+def state(policy, host):
+    return policy.stats()[host]['state']
+
+
+def test_opens_after_threshold_and_rejects():
+    policy = RetryPolicy(failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        policy.record_failure('a.example')
+    assert state(policy, 'a.example') == CLOSED
+    policy.record_failure('a.example')
+    assert state(policy, 'a.example') == OPEN
+    with pytest.raises(CircuitOpenError):
+        policy.before_request('a.example')
+    # 其他主机不受影响
+    policy.before_request('b.example')
+    assert policy.stats()['a.example']['rejected'] == 1
+
+
+def test_half_open_single_trial_then_close():
+    policy = RetryPolicy(failure_threshold=1, reset_timeout=0.05)
+    policy.record_failure('a.example')
+    time.sleep(0.06)
+    policy.before_request('a.example')
+    assert state(policy, 'a.example') == HALF_OPEN
+    # 试探的时候其他请求还是被拒绝
+    with pytest.raises(CircuitOpenError):
+        policy.before_request('a.example')
+    policy.record_success('a.example')
+    assert state(policy, 'a.example') == CLOSED
+    policy.before_request('a.example')
+
+
+def test_failed_trial_doubles_open_time():
+    policy = RetryPolicy(failure_threshold=1, reset_timeout=0.05, max_reset_timeout=10)
+    policy.record_failure('a.example')
+    time.sleep(0.06)
+    policy.before_request('a.example')
+    policy.record_failure('a.example')
+    assert state(policy, 'a.example') == OPEN
+    time.sleep(0.06)
+    # 熔断时间加倍，0.06 秒以后还没有结束
+    assert policy.is_open('a.example')
+
+
+def test_proxy_error_releases_trial():
+    policy = RetryPolicy(failure_threshold=1, reset_timeout=0.05, backoff_factor=0)
+    policy.record_failure('a.example')
+    time.sleep(0.06)
+    policy.before_request('a.example')
+    retry = policy.retry()
+    retry.increment('GET', '/', error=ProxyError('proxy', OSError()), _pool=HTTPConnectionPool('a.example'))
+    # 代理出错不算主机的失败，下一个请求可以再试探
+    assert state(policy, 'a.example') == HALF_OPEN
+    policy.before_request('a.example')
+
+
+def test_pause_and_retry_budget():
+    policy = RetryPolicy(retry_budget=0.0001, retry_burst=2)
+    assert policy.consume_retry('a.example')
+    assert policy.consume_retry('a.example')
+    assert not policy.consume_retry('a.example')
+    policy.pause('b.example', 60)
+    assert policy.is_open('b.example')
+
+
+def test_backoff_is_bounded():
+    policy = RetryPolicy(backoff_factor=0.5, max_backoff=2)
+    previous = None
+    for _ in range(20):
+        previous = policy.backoff(previous)
+        assert 0.5 <= previous <= 2
+
+
+class UnavailableProxy(BaseHTTPRequestHandler):
+    """
+    所有请求都返回 503 的 HTTP 代理
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(503)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+@pytest.fixture
+def proxy():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), UnavailableProxy)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    host, port = httpd.server_address[:2]
+    yield f'http://{host}:{port}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_failures_through_proxy_count_against_target(proxy):
+    policy = RetryPolicy(total=5, backoff_factor=0, failure_threshold=3, reset_timeout=60)
+    session = requests_retry_session(retry_policy=policy)
+    proxies = {'http': proxy}
+    with pytest.raises(requests.exceptions.RetryError):
+        session.get('http://target.example/', proxies=proxies, timeout=5)
+    stats = policy.stats()
+    assert stats['target.example']['state'] == OPEN
+    assert list(stats) == ['target.example']
+    with pytest.raises(CircuitOpenError):
+        session.get('http://target.example/', proxies=proxies, timeout=5)
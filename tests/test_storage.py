@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from spider_utils.storage import SegmentStorage, zstandard
+
+COMPRESSIONS = ['zlib', 'none', pytest.param('zstd', marks=pytest.mark.skipif(zstandard is None,
+                                                                               reason='zstandard is not installed'))]
+
+
+def page(i):
+    return f'<html><body>page {i} {"x" * (i * 37 % 500)}</body></html>'.encode()
+
+
+def url(i):
+    return f'https://www.example.com/page/{i}/'
+
+
+def fill(directory, count, **kwargs):
+    storage = SegmentStorage(directory, **kwargs)
+    for i in range(count):
+        storage.put(url(i), page(i))
+    storage.close()
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+def test_put_get_across_segments(tmp_path, compression):
+    fill(tmp_path, 50, compression=compression, segment_size=2000)
+    storage = SegmentStorage(tmp_path, compression=compression, segment_size=2000)
+    assert len(storage._segments()) > 1
+    assert len(storage) == 50
+    assert all(storage.get(url(i)) == page(i) for i in range(50))
+    assert storage.get('https://www.example.com/missing/') is None
+    storage.close()
+
+
+def test_truncated_index_line_is_dropped(tmp_path):
+    fill(tmp_path, 10, compression='zlib')
+    index_file = tmp_path / 'index.jsonl'
+    size = os.path.getsize(index_file)
+    # 程序崩溃的时候最后一行没有写完
+    with open(index_file, 'ab') as f:
+        f.write(b'["https://www.example.com/partial/", 0, 12')
+
+    storage = SegmentStorage(tmp_path, compression='zlib')
+    assert len(storage) == 10
+    assert os.path.getsize(index_file) == size
+    storage.put(url(10), page(10))
+    storage.close()
+
+    storage = SegmentStorage(tmp_path, compression='zlib')
+    assert len(storage) == 11
+    assert all(storage.get(url(i)) == page(i) for i in range(11))
+    storage.close()
+
+
+def test_index_entry_past_segment_end_is_ignored(tmp_path):
+    fill(tmp_path, 10, compression='zlib')
+    segment = tmp_path / 'segment-00000.dat'
+    with open(segment, 'r+b') as f:
+        f.truncate(os.path.getsize(segment) - 5)
+
+    storage = SegmentStorage(tmp_path, compression='zlib')
+    assert len(storage) == 9
+    assert url(9) not in storage
+    storage.close()
+
+
+def test_rebuild_index(tmp_path):
+    fill(tmp_path, 30, compression='zlib', segment_size=2000)
+    os.remove(tmp_path / 'index.jsonl')
+    # 最后一个段文件的最后一条记录没有写完
+    last = tmp_path / sorted(name for name in os.listdir(tmp_path) if name.endswith('.dat'))[-1]
+    with open(last, 'r+b') as f:
+        f.truncate(os.path.getsize(last) - 5)
+
+    storage = SegmentStorage(tmp_path, compression='zlib', segment_size=2000)
+    assert len(storage) == 0
+    storage.rebuild_index()
+    assert len(storage) == 29
+    assert all(storage.get(url(i)) == page(i) for i in range(29))
+    storage.close()
+
+    storage = SegmentStorage(tmp_path, compression='zlib', segment_size=2000)
+    assert len(storage) == 29
+    storage.close()
@@ -0,0 +1,69 @@
+import random
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+from spider_utils.utils import (url_to_dict, urls_to_dicts, urls_to_columns, get_cookie_dict, cookies_to_dicts,
+                                cookies_to_columns)
+
+QUERIES = [
+    'a=1&b=2',
+    'a=1&a=2',
+    'a=&b',
+    'a=1&&b=2&',
+    '=v&k=',
+    'token=abc==&sig=x=y',
+    'q=%E4%B8%AD%E6%96%87+search&x=%26%3D',
+    'k%20ey=va+lue&plus=a%2Bb',
+    'bad=%zz&half=%E4%B8',
+    'redirect=https%3A%2F%2Fexample.com%2F%3Fa%3D1%26b%3D2',
+    '',
+]
+
+# 随机查询字符串用的字符，包括分隔符和编码
+ALPHABET = ['a', 'b', 'k', '1', '=', '&', '+', '%', '%20', '%26', '%3D', '%E4%B8%AD', '%zz', ' ', '~']
+
+
+def random_queries(count, seed=0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 20)))
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_url_to_dict_matches_parse_qsl(query):
+    expected = dict(parse_qsl(query, keep_blank_values=True))
+    assert url_to_dict(query) == expected
+    assert url_to_dict(f'https://www.example.com/search?{query}#top') == expected
+
+
+def test_url_to_dict_matches_parse_qsl_random():
+    for query in random_queries(2000):
+        assert url_to_dict(query) == dict(parse_qsl(query, keep_blank_values=True)), query
+
+
+def test_bulk_urls():
+    urls = [f'https://www.example.com/?{query}' for query in QUERIES]
+    expected = [dict(parse_qsl(urlsplit(url).query, keep_blank_values=True)) for url in urls]
+    assert list(urls_to_dicts(urls)) == expected
+    columns = urls_to_columns(urls)
+    assert columns['a'] == [row.get('a') for row in expected]
+    assert urls_to_columns(urls, keys=['b']) == {'b': [row.get('b') for row in expected]}
+
+
+@pytest.mark.parametrize('cookie, expected', [
+    ('a=1; b=2', {'a': '1', 'b': '2'}),
+    ('Cookie: a=1;b=2 ', {'a': '1', 'b': '2'}),
+    ('token=abc==; sig=x=y', {'token': 'abc==', 'sig': 'x=y'}),
+    ('a=1;; flag; b=', {'a': '1', 'flag': '', 'b': ''}),
+    ('a=1; a=2', {'a': '2'}),
+    ('', {}),
+])
+def test_get_cookie_dict(cookie, expected):
+    assert get_cookie_dict(cookie) == expected
+
+
+def test_bulk_cookies():
+    cookies = ['a=1; b=2', 'b=3; c=x=y', '']
+    assert list(cookies_to_dicts(cookies)) == [get_cookie_dict(cookie) for cookie in cookies]
+    assert cookies_to_columns(cookies) == {'a': ['1', None, None], 'b': ['2', '3', None], 'c': [None, 'x=y', None]}